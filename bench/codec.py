@@ -0,0 +1,204 @@
+"""
+Codec microbenchmark: the server's per-frame decode, scale and colour conversion costs
+
+    python bench/codec.py                                  # the client's presets, single-threaded
+    python bench/codec.py --resolutions 1280x720 --formats jpeg --rounds 100
+    python bench/codec.py --threads 2 --json > codec.json
+
+For every resolution in the client's dropdown and every quality preset
+(Low 0.5, Medium 0.7, High 0.8) it encodes camera-like frames as JPEG and as
+WebP the way the browser would, then times each operation the upload path
+can run on them: every installed decoder backend (at full size and, for
+JPEG, DCT-reduced to the output size), decoding into a pooled buffer, the
+fit to the output resolution, the BGR -> RGB conversion for the camera, the
+YUV-native decode and its RGB fallback, and the whole RGB path as
+decode_frame() plus output_frame() run it.
+
+Every operation gets warm-up rounds first. OpenCV runs on a fixed number of
+threads (--threads, default 1). Timings are reported as percentiles of the
+wall time per frame; "FPS/core" is 1000 divided by the mean CPU time per
+frame, i.e. how many frames one core sustains if it does nothing else.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'src', 'core'))
+
+import cv2  # noqa: E402
+import numpy as np  # noqa: E402
+
+from decoders import DecoderSet, frame_size, reduction_factor  # noqa: E402
+from publisher import RESOLUTIONS, camera_frames, encode_frames  # noqa: E402
+from scaling import FrameScaler  # noqa: E402
+from yuv import YuvDecoder, yuv_to_rgb  # noqa: E402
+
+QUALITIES = (0.5, 0.7, 0.8)  # The client's Low, Medium and High presets
+FORMATS = ('jpeg', 'webp')
+OUTPUT_SIZE = (1280, 720)  # main.py's OUTPUT_WIDTH x OUTPUT_HEIGHT
+SAMPLE_FRAMES = 4  # Distinct frames per setting, cycled through while timing
+SCALERS = {name: FrameScaler(*OUTPUT_SIZE, interpolation=name) for name in FrameScaler.INTERPOLATIONS}
+
+
+def measure(operation, frames, rounds, warmup):
+    """Time ``operation(frame)`` over ``rounds`` calls after ``warmup`` untimed ones"""
+    for i in range(warmup):
+        operation(frames[i % len(frames)])
+    wall = []
+    cpu_started = time.process_time()
+    for i in range(rounds):
+        started = time.perf_counter()
+        operation(frames[i % len(frames)])
+        wall.append((time.perf_counter() - started) * 1000)
+    cpu_ms = (time.process_time() - cpu_started) * 1000 / rounds
+    wall.sort()
+    pick = lambda q: wall[min(len(wall) - 1, int(round(q / 100 * (len(wall) - 1))))]  # noqa: E731
+    return {
+        'mean_ms': round(statistics.fmean(wall), 3),
+        'stdev_ms': round(statistics.stdev(wall), 3) if len(wall) > 1 else 0.0,
+        'min_ms': round(wall[0], 3),
+        'p50_ms': round(pick(50), 3),
+        'p90_ms': round(pick(90), 3),
+        'p99_ms': round(pick(99), 3),
+        'cpu_ms': round(cpu_ms, 3),
+        'fps_per_core': round(1000 / cpu_ms, 1) if cpu_ms > 0 else None,
+    }
+
+
+def operations(fmt, encoded, decoders, yuv_decoders):
+    """``(name, operation, inputs)`` for everything the upload path can do with these frames"""
+    scaler = SCALERS['fast']  # main.py's SCALE_INTERPOLATION
+    width, height = frame_size(encoded[0])
+    plan = scaler.plan(width, height)
+    factor = reduction_factor(width, height, plan.width, plan.height) if fmt == 'jpeg' else 1
+    ops = []
+
+    for backend in decoders.backends.values():
+        if fmt not in backend.formats:
+            continue
+        ops.append((f"decode {backend.name}", lambda data, b=backend: b.decode(data, 'bgr'), encoded))
+        if backend.decode_into:
+            dst = np.empty((height, width, 3), dtype=np.uint8)
+            ops.append((f"decode {backend.name} into buffer",
+                        lambda data, b=backend, d=dst: b.decode(data, 'bgr', dst=d), encoded))
+        if factor > 1 and fmt in backend.reduced_formats:
+            ops.append((f"decode {backend.name} 1/{factor}",
+                        lambda data, b=backend: b.decode(data, 'bgr', scale=factor), encoded))
+
+    # Scaling and conversion take the decoded frame the path would produce
+    decoded = [decoders.decode(data, scale=factor) for data in encoded]
+    if decoded[0].shape[:2] != (scaler.height, scaler.width):
+        out = np.empty((scaler.height, scaler.width, 3), dtype=np.uint8)
+        for name, fit in SCALERS.items():
+            ops.append((f"scale {name} {decoded[0].shape[1]}x{decoded[0].shape[0]}",
+                        lambda img, s=fit, o=out: s.scale(img, out=o), decoded))
+    output = [scaler.scale(img) for img in decoded]
+    rgb = np.empty_like(output[0])
+    ops.append(('convert bgr->rgb', lambda img: cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=rgb), output))
+
+    for pixel_format, yuv_decoder in yuv_decoders.items():
+        ops.append((f"decode to {pixel_format}", yuv_decoder.decode, encoded))
+    i420 = yuv_decoders['i420'].decode(encoded[0])
+    ops.append(('convert i420->rgb', lambda frame: yuv_to_rgb(frame, 'i420'), [i420]))
+
+    pooled = np.empty((scaler.height, scaler.width, 3), dtype=np.uint8)
+
+    def rgb_path(data):
+        # decode_frame() followed by output_frame()'s conversion, with main.py's defaults
+        img = decoders.decode(data, scale=factor)
+        out = scaler.scale(img, out=pooled)
+        return cv2.cvtColor(out, cv2.COLOR_BGR2RGB, dst=rgb)
+
+    ops.append(('total rgb path', rgb_path, encoded))
+    return ops
+
+
+def run(resolutions=RESOLUTIONS, qualities=QUALITIES, formats=FORMATS, rounds=30, warmup=5, threads=1,
+        progress=None):
+    cv2.setNumThreads(threads)
+    decoders = DecoderSet()
+    decoders.benchmark()  # Select backends the way the server does at start-up
+    yuv_decoders = {fmt: YuvDecoder(SCALERS['fast'], fmt) for fmt in ('i420', 'nv12')}
+    results = []
+    for resolution in resolutions:
+        width, height = (int(v) for v in resolution.split('x'))
+        images = camera_frames(width, height, SAMPLE_FRAMES)
+        for fmt in formats:
+            for quality in qualities:
+                encoded = encode_frames(images, fmt, quality)
+                for name, operation, inputs in operations(fmt, encoded, decoders, yuv_decoders):
+                    if progress:
+                        progress(f"{resolution} {fmt} q{quality}: {name}")
+                    results.append({'resolution': resolution, 'format': fmt, 'quality': quality,
+                                    'frame_kb': round(statistics.fmean(len(d) for d in encoded) / 1024, 1),
+                                    'operation': name, **measure(operation, inputs, rounds, warmup)})
+    return {
+        'settings': {'rounds': rounds, 'warmup': warmup, 'opencv_threads': cv2.getNumThreads(),
+                     'output': f"{OUTPUT_SIZE[0]}x{OUTPUT_SIZE[1]}", 'opencv': cv2.__version__,
+                     'backends': list(decoders.backends),
+                     'selected': {fmt: backend.name for fmt, backend in decoders.selected.items()}},
+        'results': results,
+    }
+
+
+def print_table(report):
+    settings = report['settings']
+    print(f"OpenCV {settings['opencv']} on {settings['opencv_threads']} thread(s), "
+          f"{settings['warmup']} warm-up + {settings['rounds']} timed rounds, output {settings['output']}, "
+          f"backends: {', '.join(settings['backends'])}")
+    header = (f"{'resolution':<11}{'fmt':<5}{'q':>4}{'KB':>7}  {'operation':<32}"
+              f"{'p50':>8}{'p99':>8}{'mean':>8}{'stdev':>7}{'cpu':>8}{'FPS/core':>9}")
+    print(header)
+    print('-' * len(header))
+    previous = None
+    for row in report['results']:
+        setting = (row['resolution'], row['format'], row['quality'])
+        if previous is not None and setting != previous:
+            print()
+        previous = setting
+        print(f"{row['resolution']:<11}{row['format']:<5}{row['quality']:>4}{row['frame_kb']:>7}  "
+              f"{row['operation']:<32}{row['p50_ms']:>8.2f}{row['p99_ms']:>8.2f}{row['mean_ms']:>8.2f}"
+              f"{row['stdev_ms']:>7.2f}{row['cpu_ms']:>8.2f}{row['fps_per_core'] or 0:>9.1f}")
+    print("\nms per frame; FPS/core = 1000 / cpu ms. 'total rgb path' is what one upload costs the server.")
+
+    # The preset matrix: how many frames per second one core decodes and outputs
+    totals = {(row['resolution'], row['format'], row['quality']): row['fps_per_core']
+              for row in report['results'] if row['operation'] == 'total rgb path'}
+    qualities = sorted({quality for _, _, quality in totals})
+    print(f"\nMax FPS per core, full RGB path\n{'resolution':<11}{'fmt':<5}"
+          + ''.join(f"{f'q{quality}':>8}" for quality in qualities))
+    for resolution, fmt in dict.fromkeys((resolution, fmt) for resolution, fmt, _ in totals):
+        print(f"{resolution:<11}{fmt:<5}" + ''.join(f"{totals.get((resolution, fmt, quality)) or 0:>8.1f}"
+                                                   for quality in qualities))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time decode, scale and colour conversion per frame')
+    parser.add_argument('--resolutions', default=','.join(RESOLUTIONS), help='comma-separated WxH')
+    parser.add_argument('--qualities', default=','.join(map(str, QUALITIES)), help='comma-separated, 0 to 1')
+    parser.add_argument('--formats', default=','.join(FORMATS), help='comma-separated: jpeg, webp')
+    parser.add_argument('--rounds', type=int, default=30, help='timed calls per operation (default 30)')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed calls first (default 5)')
+    parser.add_argument('--threads', type=int, default=1, help='OpenCV threads (default 1)')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    # Decoder set-up messages go to stderr so stdout holds only the table or the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args.resolutions.split(','), [float(q) for q in args.qualities.split(',')],
+                     args.formats.split(','), args.rounds, args.warmup, args.threads,
+                     progress=lambda message: print(f"[Bench] {message}"))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_table(report)
+
+
+if __name__ == '__main__':
+    main()
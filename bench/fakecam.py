@@ -0,0 +1,85 @@
+"""
+In-memory stand-in for pyvirtualcam
+
+bench/server.py installs this module as ``pyvirtualcam`` before importing the
+server, so the whole output path -- camera init, colour conversion, send --
+runs on a headless machine without OBS or v4l2loopback. Frames are checked
+the way the real backends check them and then counted, not shown.
+"""
+
+import enum
+import itertools
+import threading
+import time
+
+
+class PixelFormat(enum.Enum):
+    RGB = 'RGB'
+    BGR = 'BGR'
+    GRAY = 'GRAY'
+    I420 = 'I420'
+    NV12 = 'NV12'
+    YUYV = 'YUYV'
+    UYVY = 'UYVY'
+
+
+_numbers = itertools.count()
+_lock = threading.Lock()
+cameras = []  # Every camera opened in this process, newest last
+
+
+class Camera:
+    """Accepts frames like ``pyvirtualcam.Camera`` and counts them"""
+
+    def __init__(self, width, height, fps, fmt=PixelFormat.RGB, device=None, backend=None, print_fps=False,
+                 **kwargs):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.fmt = fmt
+        self.device = device or f"fakecam{next(_numbers)}"
+        self.backend = backend or 'fake'
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.closed = False
+        self._opened = time.monotonic()
+        self._next_frame = self._opened
+        with _lock:
+            cameras.append(self)
+
+    def send(self, frame):
+        if self.closed:
+            raise RuntimeError('Camera is closed')
+        if self.fmt in (PixelFormat.I420, PixelFormat.NV12):
+            expected = (self.height * 3 // 2, self.width)
+        elif self.fmt == PixelFormat.GRAY:
+            expected = (self.height, self.width)
+        else:
+            expected = (self.height, self.width, 3)
+        if frame.shape != expected:
+            raise ValueError(f"Expected a frame of shape {expected}, got {frame.shape}")
+        self.frames_sent += 1
+        self.bytes_sent += frame.nbytes
+
+    def sleep_until_next_frame(self):
+        self._next_frame = max(self._next_frame + 1 / self.fps, time.monotonic())
+        time.sleep(max(0.0, self._next_frame - time.monotonic()))
+
+    @property
+    def current_fps(self):
+        elapsed = time.monotonic() - self._opened
+        return self.frames_sent / elapsed if elapsed > 0 else 0.0
+
+    def close(self):
+        self.closed = True
+
+    def stats(self):
+        return {'device': self.device, 'size': f"{self.width}x{self.height}", 'format': self.fmt.name,
+                'frames_sent': self.frames_sent, 'bytes_sent': self.bytes_sent, 'closed': self.closed}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,363 @@
+"""
+Headless publisher: streams frames to the server the way the browser client does
+
+    python bench/publisher.py https://127.0.0.1:5443 --sessions 4 --fps 30 --resolution 1280x720 --quality 0.7
+
+Every session negotiates with /session (following a prefork worker's
+``ingest`` URL), then sends pre-encoded frames at a steady rate either as
+POST /upload bodies over one persistent HTTPS connection or over the /ws
+WebSocket, backing off when the server sheds with 429/503 like the client.
+Frames are synthetic camera-like images (a lit gradient, sensor noise and a
+moving subject) or come from --source, a video file or a directory of
+images. Like the client, every publisher syncs its clock with /clock and
+stamps each frame with the time it was due to be captured, so the server's
+capture-to-output latency covers the bench too. With --burst N frames are
+captured on time but sent N at a time, the way a busy Wi-Fi link delivers
+them. Prints a JSON summary:
+achieved FPS, upload latency percentiles, the server's capture latency
+reports and status counts.
+"""
+
+import argparse
+import glob
+import http.client
+import json
+import os
+import socket
+import ssl
+import struct
+import threading
+import time
+from collections import Counter, deque
+from urllib.parse import urlsplit
+
+import cv2
+import numpy as np
+import simple_websocket
+
+RESOLUTIONS = ('3840x2160', '1280x720', '960x540', '640x360')  # The client's resolution presets
+DISTINCT_FRAMES = 30  # Frames encoded up front and sent round-robin
+FRAME_HEADER = struct.Struct('>I')  # Length prefix of a WebSocket frame, as in main.py
+TIMED_FRAME_HEADER = struct.Struct('>Id')  # Length and capture time in ms, as main.py reads them with ?timestamps=1
+CLOCK_SYNC_SAMPLES = 8  # /clock round trips per sync, as in the client
+WS_MAX_IN_FLIGHT = 2  # Frames sent but not yet acknowledged, as in the client
+
+
+def camera_frames(width, height, count=DISTINCT_FRAMES, seed=0):
+    """Camera-like BGR frames: a lit gradient, fixed texture, sensor noise and a subject moving across"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    light = 60 + 140 * np.exp(-(((x - width * 0.3) / width) ** 2 + ((y - height * 0.4) / height) ** 2) * 3)
+    texture = cv2.GaussianBlur(rng.normal(0, 18, (height, width)).astype(np.float32), (0, 0), 3)
+    base = np.clip(np.dstack([light * 0.8, light * 0.9, light]) + texture[..., None], 0, 255)
+    frames = []
+    for i in range(count):
+        frame = base + rng.normal(0, 4, base.shape).astype(np.float32)
+        cx = int(width * (0.2 + 0.6 * i / max(1, count - 1)))
+        cv2.circle(frame, (cx, height // 2), height // 6, (40, 90, 200), -1, cv2.LINE_AA)
+        frames.append(np.clip(frame, 0, 255).astype(np.uint8))
+    return frames
+
+
+def file_frames(source, width, height, count=DISTINCT_FRAMES):
+    """Frames from a video file or a directory of images, resized to ``width`` x ``height``"""
+    if os.path.isdir(source):
+        paths = sorted(p for p in glob.glob(os.path.join(source, '*')) if cv2.haveImageReader(p))[:count]
+        images = [cv2.imread(p, cv2.IMREAD_COLOR) for p in paths]
+    else:
+        capture = cv2.VideoCapture(source)
+        images = []
+        while len(images) < count:
+            ok, image = capture.read()
+            if not ok:
+                break
+            images.append(image)
+        capture.release()
+    if not images:
+        raise ValueError(f"No frames could be read from {source}")
+    return [cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA) for image in images]
+
+
+def encode_frames(images, fmt='jpeg', quality=0.7):
+    """Encode like canvas.toBlob(type, quality): ``quality`` from 0 to 1"""
+    if fmt == 'webp':
+        ext, params = '.webp', [cv2.IMWRITE_WEBP_QUALITY, max(1, int(quality * 100))]
+    else:
+        ext, params = '.jpg', [cv2.IMWRITE_JPEG_QUALITY, int(quality * 100)]
+    return [cv2.imencode(ext, image, params)[1].tobytes() for image in images]
+
+
+def tls_context():
+    """The server runs on a self-signed certificate"""
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def sync_clock(conn, samples=CLOCK_SYNC_SAMPLES):
+    """The server's clock minus ours in seconds, from the /clock round trip with the shortest RTT.
+
+    None if the server has no /clock.
+    """
+    best = None
+    for _ in range(samples):
+        t0 = time.time()
+        conn.request('GET', '/clock')
+        response = conn.getresponse()
+        body = response.read()
+        t3 = time.time()
+        if response.status != 200:
+            return None
+        reply = json.loads(body)
+        receive, transmit = reply['receive'] / 1000, reply['transmit'] / 1000
+        rtt = (t3 - t0) - (transmit - receive)
+        if best is None or rtt < best[0]:
+            best = (rtt, ((receive - t0) + (transmit - t3)) / 2)
+    return best[1]
+
+
+def parse_pairs(header):
+    """``{'p50_ms': 81.0, ...}`` from a header like ``p50_ms=81.0, p95_ms=97.5``"""
+    pairs = (part.strip().split('=', 1) for part in header.split(','))
+    return {name: float(value) for name, value in pairs}
+
+
+class Publisher(threading.Thread):
+    """One emulated phone: negotiates a session and streams ``frames`` at ``fps`` for ``duration`` seconds"""
+
+    def __init__(self, url, frames, fps=30, duration=10.0, transport='http', context=None, burst=1):
+        super().__init__(daemon=True)
+        self.url = url.rstrip('/')
+        self.frames = frames
+        self.fps = fps
+        self.duration = duration
+        self.transport = transport
+        self.burst = burst
+        self.context = context or tls_context()
+        self.session = None
+        self.sent = 0
+        self.bytes = 0
+        self.late = 0  # Frames skipped because the previous upload took longer than a frame interval
+        self.stalled = 0  # WebSocket frames skipped while WS_MAX_IN_FLIGHT frames awaited their ack
+        self.statuses = Counter()
+        self.latencies = []
+        self.connections = 0
+        self.clock_offset = None  # Seconds the server's clock is ahead of ours; None if not synced
+        self.capture_latency = None  # The server's latest capture-to-output percentiles for this session
+        self.error = None
+
+    def run(self):
+        try:
+            ingest = self._negotiate()
+            if self.transport == 'ws':
+                self._stream_ws(ingest)
+            else:
+                self._stream_http(ingest)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+
+    def _connection(self, base):
+        parts = urlsplit(base)
+        if parts.scheme == 'https':
+            return http.client.HTTPSConnection(parts.hostname, parts.port, context=self.context, timeout=10)
+        return http.client.HTTPConnection(parts.hostname, parts.port, timeout=10)
+
+    def _negotiate(self):
+        conn = self._connection(self.url)
+        try:
+            conn.request('POST', '/session', body=b'{}', headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            body = response.read()
+            if response.status != 200:
+                raise RuntimeError(f"/session answered {response.status}: {body[:100]!r}")
+            self.clock_offset = sync_clock(conn)
+        finally:
+            conn.close()
+        reply = json.loads(body)
+        self.session = reply['session']
+        return reply.get('ingest', self.url)
+
+    def _frames(self):
+        """Yield the frame to send next and its capture time by the server's clock, pacing on absolute deadlines"""
+        interval = 1.0 / self.fps
+        started = time.monotonic()
+        due = started
+        index = 0
+        held = []  # Captured frames waiting for the rest of their burst
+        while due - started < self.duration:
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif -delay > interval:
+                # Like the client's capture loop: don't try to catch up, drop the missed frames
+                missed = int(-delay / interval)
+                self.late += missed
+                due += missed * interval
+            capture_time = time.time() + self.clock_offset if self.clock_offset is not None else None
+            held.append((self.frames[index % len(self.frames)], capture_time))
+            if len(held) >= self.burst:
+                yield from held
+                held = []
+            index += 1
+            due += interval
+
+    def _stream_http(self, base):
+        conn = self._connection(base)
+        headers = {'Content-Type': 'application/octet-stream', 'X-Session-Id': self.session,
+                   'X-Max-FPS': str(round(self.fps))}
+        backoff_until = 0.0
+        for data, capture_time in self._frames():
+            if time.monotonic() < backoff_until:
+                continue
+            if conn.sock is None:
+                self.connections += 1  # The server closed the previous connection
+            if capture_time is not None:
+                headers['X-Capture-Time'] = f"{capture_time * 1000:.1f}"
+            started = time.perf_counter()
+            conn.request('POST', '/upload', body=data, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            self.latencies.append(time.perf_counter() - started)
+            self._count(response.status, len(data))
+            if response.getheader('X-Capture-Latency'):
+                self.capture_latency = parse_pairs(response.getheader('X-Capture-Latency'))
+            if response.status in (429, 503):
+                retry_ms = response.getheader('X-Retry-After-Ms')
+                retry = int(retry_ms) / 1000 if retry_ms else float(response.getheader('Retry-After') or 1)
+                backoff_until = time.monotonic() + retry
+        conn.close()
+
+    def _stream_ws(self, base):
+        """Like the client: up to WS_MAX_IN_FLIGHT unacknowledged frames, acks matched in order"""
+        parts = urlsplit(base)
+        scheme = 'wss' if parts.scheme == 'https' else 'ws'
+        ws = simple_websocket.Client.connect(f"{scheme}://{parts.netloc}/ws?session={self.session}&timestamps=1",
+                                             ssl_context=self.context if scheme == 'wss' else None)
+        # Browsers (and http.client) turn Nagle off; with it on a frame's tail waits for a delayed ACK
+        ws.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connections += 1
+        pending = deque()  # (send time, size) of frames awaiting their ack
+        acked = threading.Condition()
+        backoff = [0.0]
+
+        def receive_acks():
+            while True:
+                try:
+                    message = ws.receive()
+                except simple_websocket.ConnectionClosed:
+                    break
+                ack = json.loads(message)
+                with acked:
+                    if not pending:
+                        continue  # An error reply to an unparseable message
+                    sent_at, size = pending.popleft()
+                    self.latencies.append(time.perf_counter() - sent_at)
+                    self._count(ack.get('status', 0), size)
+                    if 'latency' in ack:
+                        self.capture_latency = ack['latency']
+                    if 'retry_after_ms' in ack:
+                        backoff[0] = time.monotonic() + ack['retry_after_ms'] / 1000
+                    acked.notify()
+
+        receiver = threading.Thread(target=receive_acks, daemon=True)
+        receiver.start()
+        try:
+            ws.send(json.dumps({'max_fps': round(self.fps)}))
+            for data, capture_time in self._frames():
+                with acked:
+                    if time.monotonic() < backoff[0] or len(pending) >= WS_MAX_IN_FLIGHT:
+                        self.stalled += 1
+                        continue
+                    pending.append((time.perf_counter(), len(data)))
+                capture_ms = capture_time * 1000 if capture_time is not None else float('nan')
+                ws.send(TIMED_FRAME_HEADER.pack(len(data), capture_ms) + data)
+            with acked:
+                if not acked.wait_for(lambda: not pending, timeout=10):
+                    raise TimeoutError(f"{len(pending)} frame(s) not acknowledged within 10s")
+        finally:
+            ws.close()
+            receiver.join(1)
+
+    def _count(self, status, size):
+        self.sent += 1
+        self.statuses[status] += 1
+        if status == 204:
+            self.bytes += size
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def summarize(publishers, elapsed):
+    """Achieved FPS, latency percentiles and status counts over all publishers"""
+    latencies = [latency for p in publishers for latency in p.latencies]
+    statuses = sum((p.statuses for p in publishers), Counter())
+    accepted = statuses.get(204, 0)
+    ms = lambda value: round(value * 1000, 2) if value is not None else None  # noqa: E731
+    return {
+        'sessions': len(publishers),
+        'elapsed_s': round(elapsed, 2),
+        'frames_sent': sum(p.sent for p in publishers),
+        'frames_accepted': accepted,
+        'frames_late': sum(p.late for p in publishers),
+        'frames_stalled': sum(p.stalled for p in publishers),
+        'achieved_fps': round(accepted / elapsed, 1) if elapsed else 0.0,
+        'achieved_fps_per_session': round(accepted / elapsed / max(1, len(publishers)), 1) if elapsed else 0.0,
+        'megabits_per_second': round(sum(p.bytes for p in publishers) * 8 / elapsed / 1e6, 2) if elapsed else 0.0,
+        'upload_latency_ms': {
+            'p50': ms(percentile(latencies, 50)),
+            'p90': ms(percentile(latencies, 90)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(max(latencies) if latencies else None),
+        },
+        'clock_offsets_ms': [ms(p.clock_offset) for p in publishers],
+        'capture_latency_ms': [p.capture_latency for p in publishers],
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'connections': sum(p.connections for p in publishers),
+        'errors': [p.error for p in publishers if p.error],
+    }
+
+
+def run(url, sessions=1, fps=30, resolution='1280x720', quality=0.7, fmt='jpeg', transport='http',
+        duration=10.0, source=None, burst=1):
+    """Stream from ``sessions`` publishers at once and return the summary"""
+    width, height = (int(v) for v in resolution.split('x'))
+    images = file_frames(source, width, height) if source else camera_frames(width, height)
+    frames = encode_frames(images, fmt, quality)
+    context = tls_context()
+    publishers = [Publisher(url, frames, fps, duration, transport, context, burst) for _ in range(sessions)]
+    started = time.monotonic()
+    for publisher in publishers:
+        publisher.start()
+    for publisher in publishers:
+        publisher.join()
+    summary = summarize(publishers, time.monotonic() - started)
+    summary['load'] = {'fps': fps, 'resolution': resolution, 'quality': quality, 'format': fmt,
+                       'transport': transport, 'burst': burst, 'frame_bytes': int(np.mean([len(f) for f in frames]))}
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream synthetic or file-sourced frames to the server')
+    parser.add_argument('url', help='server URL, e.g. https://127.0.0.1:5443')
+    parser.add_argument('--sessions', type=int, default=1, help='concurrent publishers (default 1)')
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--resolution', default='1280x720', help=f"WxH, e.g. one of {', '.join(RESOLUTIONS)}")
+    parser.add_argument('--quality', type=float, default=0.7, help='encoder quality from 0 to 1 (default 0.7)')
+    parser.add_argument('--format', choices=('jpeg', 'webp'), default='jpeg')
+    parser.add_argument('--transport', choices=('http', 'ws'), default='http')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to stream (default 10)')
+    parser.add_argument('--source', help='video file or image directory to take frames from')
+    parser.add_argument('--burst', type=int, default=1, help='send frames this many at a time (default 1)')
+    args = parser.parse_args()
+    print(json.dumps(run(args.url, args.sessions, args.fps, args.resolution, args.quality, args.format,
+                         args.transport, args.duration, args.source, args.burst), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+"""
+Load benchmark: starts the server with the fake camera and drives it with publishers
+
+    python bench/run.py                                      # 1 session, 30 FPS, 1280x720, quality 0.7, HTTP
+    python bench/run.py --sessions 1,2,4 --transport http,ws --duration 20 --output results.json
+    python bench/run.py --resolution 640x360,1280x720 --quality 0.5,0.8 --format jpeg,webp --workers 2
+    python bench/run.py --burst 1,4 --jitter-buffer 0,200                # Output cadence under bursty delivery
+
+Every combination of the comma-separated options is one scenario, run
+against a fresh bench/server.py so scenarios don't inherit each other's
+sessions or caches. Besides the publishers' view (achieved FPS, upload
+latency, capture-to-camera latency) each scenario records the server's CPU use and peak RSS, worker
+processes included, how evenly frames reached the camera, and its /stats
+and fake-camera counters. The JSON
+result names the git commit it was measured on, so runs from different
+commits can be compared with any JSON diff tool.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import signal
+import socket
+import ssl
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import publisher  # noqa: E402
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+READY = '[Bench] Server ready'  # What server.py prints once it is listening
+STARTUP_TIMEOUT = 60  # Seconds to wait for the server's ready line (the decoder benchmark runs first)
+SAMPLE_INTERVAL = 0.5  # Seconds between server CPU/RSS samples
+SETTLE_SECONDS = 1.0  # Pause between server start and load, and between load and the final stats
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def process_tree(pid):
+    """``pid`` and all its descendants"""
+    if psutil is not None:
+        try:
+            root = psutil.Process(pid)
+            return [root.pid] + [child.pid for child in root.children(recursive=True)]
+        except psutil.NoSuchProcess:
+            return []
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+
+def process_usage(pid):
+    """CPU seconds (user + system) and RSS bytes of one process, or None if it is gone"""
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            times = process.cpu_times()
+            return times.user + times.system, process.memory_info().rss
+        except psutil.NoSuchProcess:
+            return None
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    ticks = os.sysconf('SC_CLK_TCK')
+    return (int(fields[11]) + int(fields[12])) / ticks, pages * os.sysconf('SC_PAGE_SIZE')
+
+
+class ResourceSampler(threading.Thread):
+    """Samples the CPU use and RSS of a process tree until stopped"""
+
+    def __init__(self, pid, interval=SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.cpu_percent = []
+        self.rss = []
+        self._done = threading.Event()
+
+    def _usage(self):
+        cpu, rss = {}, 0
+        for pid in process_tree(self.pid):
+            usage = process_usage(pid)
+            if usage is not None:
+                cpu[pid] = usage[0]
+                rss += usage[1]
+        return cpu, rss
+
+    def run(self):
+        last_cpu, _ = self._usage()
+        last = time.monotonic()
+        while not self._done.wait(self.interval):
+            cpu, rss = self._usage()
+            now = time.monotonic()
+            # Only processes seen in both samples, so a worker exiting doesn't look like negative CPU
+            used = sum(cpu[pid] - last_cpu[pid] for pid in cpu if pid in last_cpu)
+            self.cpu_percent.append(100 * used / (now - last))
+            self.rss.append(rss)
+            last_cpu, last = cpu, now
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    def summary(self):
+        if not self.cpu_percent:
+            return {'cpu_percent_mean': None, 'cpu_percent_max': None, 'rss_mb_peak': None, 'rss_mb_end': None}
+        return {
+            'cpu_percent_mean': round(sum(self.cpu_percent) / len(self.cpu_percent), 1),
+            'cpu_percent_max': round(max(self.cpu_percent), 1),
+            'rss_mb_peak': round(max(self.rss) / 2**20, 1),
+            'rss_mb_end': round(self.rss[-1] / 2**20, 1),
+        }
+
+
+class BenchServer:
+    """bench/server.py in a subprocess on a free port"""
+
+    def __init__(self, workers=0, options=()):
+        self.port = free_port()
+        self.url = f"https://127.0.0.1:{self.port}"
+        self.log = []
+        command = [sys.executable, '-u', os.path.join(BENCH_DIR, 'server.py'), '--port', str(self.port)]
+        if workers:
+            command += ['--workers', str(workers)]
+        command += list(options)
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        ready = threading.Event()
+        threading.Thread(target=self._read_output, args=(ready,), daemon=True).start()
+        if not ready.wait(STARTUP_TIMEOUT) or self.process.poll() is not None:
+            self.stop()
+            raise RuntimeError("The bench server didn't start:\n" + ''.join(self.log[-20:]))
+        self._wait_listening()
+
+    def _read_output(self, ready):
+        # Keep draining the pipe so the server never blocks on a full one
+        for line in self.process.stdout:
+            self.log.append(line)
+            if line.startswith(READY):
+                ready.set()
+        ready.set()
+
+    def _wait_listening(self):
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError(f"The bench server isn't listening on port {self.port}")
+
+    def get(self, path):
+        with urllib.request.urlopen(self.url + path, context=publisher.tls_context(), timeout=30) as response:
+            return json.load(response)
+
+    def post(self, path):
+        request = urllib.request.Request(self.url + path, data=b'', method='POST')
+        with urllib.request.urlopen(request, context=publisher.tls_context(), timeout=30) as response:
+            return response.status
+
+    def stop(self, timeout=15):
+        """SIGINT, like Ctrl+C, so sessions and workers shut down the way they do in production"""
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGINT)
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                print(f"[Bench] Server didn't stop within {timeout}s; killing it")
+                self.process.kill()
+                self.process.wait()
+
+
+def run_scenario(scenario, duration, workers, source=None):
+    options = ['--jitter-buffer', str(scenario['jitter_buffer'])] if scenario['jitter_buffer'] else []
+    server = BenchServer(workers, options)
+    try:
+        time.sleep(SETTLE_SECONDS)
+        sampler = ResourceSampler(server.process.pid)
+        sampler.start()
+        try:
+            result = publisher.run(server.url, scenario['sessions'], scenario['fps'], scenario['resolution'],
+                                   scenario['quality'], scenario['format'], scenario['transport'], duration,
+                                   source, scenario['burst'])
+            time.sleep(SETTLE_SECONDS)  # Let the pipeline drain before reading the counters
+        finally:
+            sampler.stop()
+        stats = server.get('/stats')
+        cameras = server.get('/bench/cameras')
+    finally:
+        server.stop()
+    result['server'] = sampler.summary()
+    result['server']['pipeline'] = {name: stats.get(name) for name in (
+        'submitted', 'decoded', 'decode_failed', 'expired', 'ingest_dropped', 'ingest_superseded',
+        'decoded_dropped', 'output', 'output_failed', 'stale', 'late', 'repeated')}
+    result['server']['latency'] = stats.get('latency')
+    result['server']['camera_frames'] = sum(camera['frames_sent'] for camera in cameras)
+    result['server']['camera_fps'] = round(result['server']['camera_frames'] / result['elapsed_s'], 1)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        'commit': git_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'openssl': ssl.OPENSSL_VERSION,
+        'resource_sampler': 'psutil' if psutil is not None else 'procfs',
+    }
+
+
+def split(value, cast=str):
+    return [cast(item) for item in value.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run load scenarios against the server with a fake camera')
+    parser.add_argument('--sessions', default='1', help='comma-separated publisher counts (default 1)')
+    parser.add_argument('--fps', default='30', help='comma-separated frame rates (default 30)')
+    parser.add_argument('--resolution', default='1280x720', help='comma-separated WxH (default 1280x720)')
+    parser.add_argument('--quality', default='0.7', help='comma-separated encoder qualities (default 0.7)')
+    parser.add_argument('--format', default='jpeg', help='comma-separated: jpeg, webp (default jpeg)')
+    parser.add_argument('--transport', default='http', help='comma-separated: http, ws (default http)')
+    parser.add_argument('--burst', default='1', help='comma-separated frames sent at a time (default 1)')
+    parser.add_argument('--jitter-buffer', default='0',
+                        help='comma-separated most ms the jitter buffer may add (default 0, off)')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load per scenario (default 10)')
+    parser.add_argument('--workers', type=int, default=0, help='prefork ingest workers (default 0)')
+    parser.add_argument('--source', help='video file or image directory to take frames from')
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    args = parser.parse_args()
+
+    options = {
+        'sessions': split(args.sessions, int),
+        'fps': split(args.fps, float),
+        'resolution': split(args.resolution),
+        'quality': split(args.quality, float),
+        'format': split(args.format),
+        'transport': split(args.transport),
+        'burst': split(args.burst, int),
+        'jitter_buffer': split(args.jitter_buffer, float),
+    }
+    scenarios = [dict(zip(options, values)) for values in itertools.product(*options.values())]
+    results = {'environment': environment(), 'duration_s': args.duration, 'workers': args.workers,
+               'scenarios': []}
+    for number, scenario in enumerate(scenarios, 1):
+        print(f"[Bench] Scenario {number}/{len(scenarios)}: {scenario}", file=sys.stderr)
+        result = run_scenario(scenario, args.duration, args.workers, args.source)
+        latency = result['upload_latency_ms']
+        capture = (result['server']['latency'] or {}).get('capture_to_output')
+        cadence = (result['server']['latency'] or {}).get('playout_jitter')
+        print(f"[Bench]   {result['achieved_fps']} FPS accepted, upload p50 {latency['p50']} ms, "
+              f"p99 {latency['p99']} ms, server CPU {result['server']['cpu_percent_mean']}%, "
+              f"RSS {result['server']['rss_mb_peak']} MB", file=sys.stderr)
+        if capture:
+            print(f"[Bench]   Capture to virtual camera p50 {capture['p50_ms']} ms, p99 {capture['p99_ms']} ms",
+                  file=sys.stderr)
+        if cadence:
+            print(f"[Bench]   Playout jitter p50 {cadence['p50_ms']} ms, p99 {cadence['p99_ms']} ms",
+                  file=sys.stderr)
+        results['scenarios'].append(result)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"[Bench] Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Benchmark server: the real server with the in-memory camera of fakecam.py
+
+    python bench/server.py --port 5443 [--workers N]
+
+Runs src/core/main.py's app over TLS on localhost without the desktop
+automation (QR code, browser, shortcuts), with every session's virtual camera
+replaced by a fakecam.Camera. GET /bench/cameras lists what the cameras
+received. Stop it with SIGINT (Ctrl+C) so recordings and workers shut down
+cleanly.
+
+With --tracemalloc N the server traces allocations (N frames deep) for
+bench/soak.py: GET /bench/memory samples RSS, open file descriptors, threads
+and cameras, POST /bench/memory/baseline remembers the current allocations
+and GET /bench/memory/growth lists where memory grew since then.
+"""
+
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'src', 'core'))
+
+import fakecam  # noqa: E402
+
+sys.modules['pyvirtualcam'] = fakecam
+
+import main as server  # noqa: E402
+
+READY = '[Bench] Server ready'
+REPO_DIR = os.path.dirname(BENCH_DIR)
+# Allocations made by the tracing itself or by imports are not the server's
+TRACE_FILTERS = (tracemalloc.Filter(False, tracemalloc.__file__),
+                 tracemalloc.Filter(False, '<frozen importlib._bootstrap*>', all_frames=True),
+                 tracemalloc.Filter(False, '<unknown>'))
+baseline = None  # tracemalloc snapshot taken by POST /bench/memory/baseline
+
+
+def camera_stats():
+    return server.jsonify([camera.stats() for camera in list(fakecam.cameras)])
+
+
+def memory_sample():
+    """Process-level resource use; idle sessions are expired first so they don't count as leaks"""
+    server.sessions.expire()
+    with open('/proc/self/statm') as f:
+        rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    sample = {
+        'time': time.time(),
+        'rss_bytes': rss,
+        'fds': len(os.listdir('/proc/self/fd')),
+        'threads': threading.active_count(),
+        # Per kind of thread, so a leak shows which kind keeps piling up
+        'thread_kinds': Counter(re.sub(r'\d+', 'N', thread.name) for thread in threading.enumerate()),
+        'sessions': len(server.sessions),
+        'cameras_open': sum(1 for camera in list(fakecam.cameras) if not camera.closed),
+        'cameras_opened': len(fakecam.cameras),
+    }
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        sample['traced_bytes'] = current
+        sample['traced_peak_bytes'] = peak
+    return server.jsonify(sample)
+
+
+def set_baseline():
+    global baseline
+    if not tracemalloc.is_tracing():
+        return ('Start the server with --tracemalloc', 409)
+    baseline = tracemalloc.take_snapshot().filter_traces(TRACE_FILTERS)
+    return ('', 204)
+
+
+def location(frame):
+    path = frame.filename
+    if path.startswith(REPO_DIR):
+        path = os.path.relpath(path, REPO_DIR)
+    return f"{path}:{frame.lineno}"
+
+
+def memory_growth():
+    """The call stacks whose allocations grew most since the baseline"""
+    if baseline is None:
+        return ('POST /bench/memory/baseline first', 409)
+    limit = server.request.args.get('limit', 20, type=int)
+    snapshot = tracemalloc.take_snapshot().filter_traces(TRACE_FILTERS)
+    stats = snapshot.compare_to(baseline, 'traceback')
+    growth = []
+    for stat in sorted(stats, key=lambda stat: stat.size_diff, reverse=True)[:limit]:
+        frames = list(reversed(stat.traceback))  # Most recent call first
+        # Attribute the growth to the innermost frame in this repo's code, if any
+        owner = next((frame for frame in frames if frame.filename.startswith(REPO_DIR)), frames[0])
+        growth.append({'location': location(owner), 'size_diff': stat.size_diff, 'count_diff': stat.count_diff,
+                       'size': stat.size, 'count': stat.count,
+                       'traceback': [location(frame) for frame in frames]})
+    return server.jsonify({'total_diff': sum(stat.size_diff for stat in stats), 'top': growth})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the server with an in-memory virtual camera')
+    parser.add_argument('--port', type=int, default=5443)
+    parser.add_argument('--workers', type=int, default=0, help='prefork ingest workers (default 0)')
+    parser.add_argument('--tracemalloc', type=int, default=0, metavar='FRAMES',
+                        help='trace allocations this many frames deep (default off)')
+    parser.add_argument('--session-idle-timeout', type=float, help='seconds before an idle session closes')
+    parser.add_argument('--jitter-buffer', type=float, default=0, metavar='MS',
+                        help='most latency the jitter buffer may add (default off)')
+    args = parser.parse_args()
+
+    if args.tracemalloc:
+        tracemalloc.start(args.tracemalloc)
+    if args.session_idle_timeout is not None:
+        server.SESSION_IDLE_TIMEOUT = args.session_idle_timeout
+        server.sessions.idle_timeout = args.session_idle_timeout
+
+    server.RUNNING_IN_DOCKER = False  # The camera is in memory, so exercise it even in a container
+    server.PREFORK_WORKERS = args.workers
+    server.pipeline.jitter_buffer = args.jitter_buffer / 1000 or None
+    server.app.add_url_rule('/bench/cameras', 'bench_cameras', camera_stats)
+    server.app.add_url_rule('/bench/memory', 'bench_memory', memory_sample)
+    server.app.add_url_rule('/bench/memory/baseline', 'bench_memory_baseline', set_baseline, methods=['POST'])
+    server.app.add_url_rule('/bench/memory/growth', 'bench_memory_growth', memory_growth)
+    server.decoders.benchmark()
+    server.pipeline.start()
+    if args.workers:
+        server.start_dispatcher(args.port)
+    print(f"{READY} on port {args.port}", flush=True)
+    try:
+        server.app.run(host='127.0.0.1', port=args.port, ssl_context=server.certificate_paths(),
+                       threaded=True, use_reloader=False)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
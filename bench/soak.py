@@ -0,0 +1,377 @@
+"""
+Soak test: hours of mixed traffic with memory, file descriptor and thread leak detection
+
+    python bench/soak.py --duration 4h
+    python bench/soak.py --duration 20m --sessions 2 --output soak.json
+
+Starts bench/server.py with allocation tracing and a short session idle
+timeout, so sessions and their (fake) virtual cameras are opened and closed
+over and over. Publishers then stream in episodes of a few seconds to a
+minute. Each episode negotiates a session, picks HTTP or WebSocket and
+JPEG or WebP, switches resolution every few seconds and mixes in
+malformed bodies and gzip-compressed uploads. It ends with a clean or an
+abrupt disconnect.
+
+The server is sampled every --interval: RSS (worker processes included),
+open file descriptors, threads, open sessions and cameras. After --warmup
+the current allocations become the baseline. At the end the load stops, idle
+sessions are given time to close, and the run fails (exit status 1) when
+- RSS under load grew more than --max-rss-growth MB over the baseline,
+- file descriptors or threads didn't return to their level before the load
+  (beyond --max-fd-growth / --max-thread-growth), or
+- a virtual camera is still open with no session left.
+The report lists the call stacks whose allocations grew most, attributed to
+the innermost line of this repository's code.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import re
+import socket
+import statistics
+import struct
+import sys
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import simple_websocket  # noqa: E402
+
+import publisher  # noqa: E402
+from run import BenchServer, environment, process_tree, process_usage  # noqa: E402
+
+SOAK_RESOLUTIONS = ('640x360', '960x540', '1280x720')  # 4K is left out by default: it measures CPU, not leaks
+EPISODE_SECONDS = (5, 60)  # Range of one publisher episode's length
+RESOLUTION_SWITCH_SECONDS = (2, 15)  # Range of time between resolution changes within an episode
+TRACE_FRAMES = 12  # Stack depth recorded per allocation
+SESSION_IDLE_TIMEOUT = 5  # Short, so sessions and cameras are recycled many times per hour
+GROWTH_REPORT_SIZE = 15  # Call stacks listed in the leak report
+RESET_ON_CLOSE = struct.pack('ii', 1, 0)  # SO_LINGER on with a zero timeout: close() sends a TCP reset
+
+
+def parse_duration(text):
+    """'90', '90s', '20m', '4h' -> seconds"""
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([smh]?)', text.strip())
+    if not match:
+        raise argparse.ArgumentTypeError(f"Invalid duration '{text}', expected e.g. 90s, 20m or 4h")
+    return float(match.group(1)) * {'': 1, 's': 1, 'm': 60, 'h': 3600}[match.group(2)]
+
+
+def malformed_bodies(jpeg):
+    """Bodies the server must reject without leaking anything"""
+    rng = random.Random(1)
+    return [
+        bytes(rng.getrandbits(8) for _ in range(2048)),  # Noise
+        jpeg[:len(jpeg) // 2],  # Cut off mid-scan
+        jpeg[:200] + bytes(rng.getrandbits(8) for _ in range(4096)),  # Valid header, garbage scan
+        b'RIFF\x00\x10\x00\x00WEBPVP8 ' + bytes(64),  # WebP header without a bitstream
+        b'\xff\xd8\xff',  # Nothing but a JPEG signature
+    ]
+
+
+class FrameSet:
+    """Pre-encoded bodies per resolution and format, plus gzip and malformed variants"""
+
+    def __init__(self, resolutions, quality):
+        self.frames = {}
+        self.gzipped = {}
+        for resolution in resolutions:
+            width, height = (int(v) for v in resolution.split('x'))
+            images = publisher.camera_frames(width, height, count=8)
+            for fmt in ('jpeg', 'webp'):
+                frames = publisher.encode_frames(images, fmt, quality)
+                self.frames[resolution, fmt] = frames
+                self.gzipped[resolution, fmt] = [gzip.compress(frame, compresslevel=1) for frame in frames]
+        self.resolutions = list(resolutions)
+        self.malformed = malformed_bodies(self.frames[self.resolutions[0], 'jpeg'][0])
+
+
+class SoakClient(threading.Thread):
+    """One phone that keeps connecting, streaming in changing ways and disconnecting until stopped"""
+
+    def __init__(self, number, url, frame_set, fps, stop, malformed_rate, gzip_rate):
+        super().__init__(name=f"soak-client-{number}", daemon=True)
+        self.url = url
+        self.frame_set = frame_set
+        self.fps = fps
+        self.stop = stop
+        self.malformed_rate = malformed_rate
+        self.gzip_rate = gzip_rate
+        self.rng = random.Random(number)
+        self.context = publisher.tls_context()
+        self.counts = Counter()  # '<kind> <status>' -> frames
+        self.episodes = Counter()
+        self.errors = Counter()
+
+    def run(self):
+        while not self.stop.is_set():
+            transport = 'ws' if self.rng.random() < 0.3 else 'http'
+            try:
+                self._episode(transport, self.rng.uniform(*EPISODE_SECONDS))
+                self.episodes[transport] += 1
+            except Exception as e:
+                self.errors[f"{transport} {type(e).__name__}: {e}"[:120]] += 1
+                self.stop.wait(1.0)
+
+    def _negotiate(self):
+        while not self.stop.is_set():
+            probe = publisher.Publisher(self.url, [], context=self.context)
+            try:
+                return probe._negotiate(), probe.session
+            except RuntimeError:
+                # All slots taken by sessions that haven't expired yet
+                self.stop.wait(SESSION_IDLE_TIMEOUT)
+        return None, None
+
+    def _bodies(self, seconds):
+        """Yield ``(kind, body)`` at the client's frame rate for ``seconds``"""
+        fmt = 'webp' if self.rng.random() < 0.3 else 'jpeg'
+        interval = 1.0 / self.fps
+        ends = time.monotonic() + seconds
+        switch_at = 0.0
+        due = time.monotonic()
+        index = 0
+        while not self.stop.is_set() and due < ends:
+            now = time.monotonic()
+            if now >= switch_at:
+                resolution = self.rng.choice(self.frame_set.resolutions)
+                switch_at = now + self.rng.uniform(*RESOLUTION_SWITCH_SECONDS)
+            roll = self.rng.random()
+            if roll < self.malformed_rate:
+                yield 'malformed', self.rng.choice(self.frame_set.malformed)
+            elif roll < self.malformed_rate + self.gzip_rate:
+                yield 'gzip', self.frame_set.gzipped[resolution, fmt][index % 8]
+            else:
+                yield fmt, self.frame_set.frames[resolution, fmt][index % 8]
+            index += 1
+            due = max(due + interval, time.monotonic() - interval)
+            self.stop.wait(max(0.0, due - time.monotonic()))
+
+    def _episode(self, transport, seconds):
+        base, session = self._negotiate()
+        if session is None:
+            return
+        abrupt = self.rng.random() < 0.5
+        if transport == 'ws':
+            self._stream_ws(base, session, seconds, abrupt)
+        else:
+            self._stream_http(base, session, seconds, abrupt)
+
+    def _stream_http(self, base, session, seconds, abrupt):
+        probe = publisher.Publisher(base, [], context=self.context)
+        conn = probe._connection(base)
+        try:
+            for kind, body in self._bodies(seconds):
+                headers = {'Content-Type': 'application/octet-stream', 'X-Session-Id': session,
+                           'X-Max-FPS': str(round(self.fps))}
+                if kind == 'gzip':
+                    headers['Content-Encoding'] = 'gzip'
+                conn.request('POST', '/upload', body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                self.counts[f"{kind} {response.status}"] += 1
+                if response.status in (429, 503):
+                    retry_ms = response.getheader('X-Retry-After-Ms')
+                    self.stop.wait(int(retry_ms) / 1000 if retry_ms else 1.0)
+            if abrupt and conn.sock is not None:
+                # Reset instead of a clean close, like a phone dropping off Wi-Fi
+                conn.sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, RESET_ON_CLOSE)
+        finally:
+            conn.close()
+
+    def _stream_ws(self, base, session, seconds, abrupt):
+        parts = urlsplit(base)
+        ws = simple_websocket.Client.connect(f"wss://{parts.netloc}/ws?session={session}",
+                                             ssl_context=self.context)
+        ws.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            for kind, body in self._bodies(seconds):
+                if kind == 'gzip':
+                    continue  # WebSocket frames aren't compressed by the client
+                ws.send(publisher.FRAME_HEADER.pack(len(body)) + body)
+                ack = ws.receive(timeout=10)
+                if ack is None:
+                    raise TimeoutError('No acknowledgement within 10s')
+                self.counts[f"{kind} {json.loads(ack).get('status')}"] += 1
+        finally:
+            # The client's reader thread closes the socket itself once it is unblocked. Client.close()
+            # closes it right away, freeing the descriptor while that thread may still read from it,
+            # so the next connection to get that descriptor would lose its bytes to the old thread
+            if abrupt:
+                # Reset instead of a clean close, like a phone dropping off Wi-Fi
+                ws.sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, RESET_ON_CLOSE)
+                ws.sock.shutdown(socket.SHUT_RD)
+            elif ws.connected:
+                simple_websocket.ws.Base.close(ws)  # Sends the Close frame; the server's reply ends the thread
+            ws.thread.join(5)
+
+
+def sample(server):
+    """The server's own view plus the RSS of its whole process tree"""
+    result = server.get('/bench/memory')
+    rss = 0
+    for pid in process_tree(server.process.pid):
+        usage = process_usage(pid)
+        if usage is not None:
+            rss += usage[1]
+    result['rss_tree_bytes'] = rss
+    return result
+
+
+def slope_mb_per_hour(samples):
+    """Least-squares RSS trend over the samples"""
+    if len(samples) < 3:
+        return None
+    times = [s['time'] for s in samples]
+    values = [s['rss_tree_bytes'] / 2**20 for s in samples]
+    return round(statistics.linear_regression(times, values).slope * 3600, 2)
+
+
+def describe(sample_, started):
+    return (f"{time.strftime('%H:%M:%S', time.gmtime(sample_['time'] - started))} "
+            f"rss {sample_['rss_tree_bytes'] / 2**20:.1f} MB, {sample_['fds']} fds, {sample_['threads']} threads, "
+            f"{sample_['sessions']} sessions, {sample_['cameras_open']}/{sample_['cameras_opened']} cameras open")
+
+
+def soak(args):
+    options = ['--tracemalloc', str(TRACE_FRAMES), '--session-idle-timeout', str(SESSION_IDLE_TIMEOUT)]
+    server = BenchServer(args.workers, options)
+    stop = threading.Event()
+    clients = []
+    samples = []
+    try:
+        frame_set = FrameSet(args.resolutions.split(','), args.quality)
+        idle = sample(server)
+        started = time.time()
+        print(f"[Soak] Before load: {describe(idle, started)}", file=sys.stderr)
+        clients = [SoakClient(i, server.url, frame_set, args.fps, stop, args.malformed, args.gzip)
+                   for i in range(args.sessions)]
+        for client in clients:
+            client.start()
+
+        baseline = None
+        deadline = time.monotonic() + args.duration
+        warmup_ends = time.monotonic() + args.warmup
+        while time.monotonic() < deadline:
+            time.sleep(max(0.0, min(args.interval, deadline - time.monotonic())))
+            current = sample(server)
+            samples.append(current)
+            if baseline is None and time.monotonic() >= warmup_ends:
+                server.post('/bench/memory/baseline')
+                baseline = current
+                print(f"[Soak] Baseline: {describe(baseline, started)}", file=sys.stderr)
+            else:
+                growth = (f" ({(current['rss_tree_bytes'] - baseline['rss_tree_bytes']) / 2**20:+.1f} MB)"
+                          if baseline else '')
+                print(f"[Soak] {describe(current, started)}{growth}", file=sys.stderr)
+        if baseline is None:
+            raise SystemExit('The run ended before the warm-up; use a --duration longer than --warmup')
+
+        loaded = samples[-1]
+        growth = server.get(f'/bench/memory/growth?limit={GROWTH_REPORT_SIZE}')
+        stop.set()
+        for client in clients:
+            client.join(15)
+        # Idle sessions expire when sampled after the timeout
+        time.sleep(SESSION_IDLE_TIMEOUT + 2 * args.settle)
+        settled = sample(server)
+        print(f"[Soak] After load: {describe(settled, started)}", file=sys.stderr)
+    finally:
+        stop.set()
+        server.stop()
+
+    after_baseline = [s for s in samples if s['time'] >= baseline['time']]
+    rss_growth_mb = (loaded['rss_tree_bytes'] - baseline['rss_tree_bytes']) / 2**20
+    failures = []
+    if rss_growth_mb > args.max_rss_growth:
+        failures.append(f"RSS grew {rss_growth_mb:.1f} MB under load (limit {args.max_rss_growth} MB)")
+    if settled['fds'] - idle['fds'] > args.max_fd_growth:
+        failures.append(f"{settled['fds'] - idle['fds']} more file descriptors open after the load than before "
+                        f"(limit {args.max_fd_growth})")
+    if settled['threads'] - idle['threads'] > args.max_thread_growth:
+        kinds = Counter(settled['thread_kinds'])
+        kinds.subtract(idle['thread_kinds'])
+        failures.append(f"{settled['threads'] - idle['threads']} more threads after the load than before "
+                        f"(limit {args.max_thread_growth}): " + ', '.join(
+                            f"{kind} +{count}" for kind, count in kinds.most_common() if count > 0))
+    if settled['sessions'] == 0 and settled['cameras_open']:
+        failures.append(f"{settled['cameras_open']} virtual camera(s) open with no session left")
+
+    counts = sum((client.counts for client in clients), Counter())
+    return {
+        'environment': environment(),
+        'settings': {name: getattr(args, name) for name in (
+            'duration', 'warmup', 'interval', 'sessions', 'fps', 'quality', 'resolutions', 'malformed', 'gzip',
+            'workers', 'max_rss_growth', 'max_fd_growth', 'max_thread_growth')},
+        'passed': not failures,
+        'failures': failures,
+        'rss_growth_mb': round(rss_growth_mb, 2),
+        'rss_trend_mb_per_hour': slope_mb_per_hour(after_baseline),
+        'traced_growth_bytes': growth['total_diff'],
+        'top_growth': growth['top'],
+        'idle': idle,
+        'baseline': baseline,
+        'loaded': loaded,
+        'settled': settled,
+        'frames': dict(sorted(counts.items())),
+        'episodes': dict(sum((client.episodes for client in clients), Counter())),
+        'client_errors': dict(sum((client.errors for client in clients), Counter())),
+        'samples': [{'time': round(s['time'], 1), 'rss_mb': round(s['rss_tree_bytes'] / 2**20, 1),
+                     'fds': s['fds'], 'threads': s['threads'], 'sessions': s['sessions']} for s in samples],
+    }
+
+
+def print_report(report):
+    print(f"\nSoak {'PASSED' if report['passed'] else 'FAILED'} after {report['settings']['duration']:.0f}s: "
+          f"RSS {report['rss_growth_mb']:+.1f} MB over the baseline "
+          f"(trend {report['rss_trend_mb_per_hour']} MB/h), traced {report['traced_growth_bytes'] / 2**20:+.2f} MB")
+    for failure in report['failures']:
+        print(f"  - {failure}")
+    print("Frames: " + ', '.join(f"{kind} x{count}" for kind, count in report['frames'].items()))
+    print(f"\n{'growth':>12}{'blocks':>9}  location")
+    for entry in report['top_growth']:
+        print(f"{entry['size_diff'] / 1024:>+10.1f}KB{entry['count_diff']:>+9}  {entry['location']}")
+        for frame in entry['traceback'][:4]:
+            if frame != entry['location']:
+                print(f"{'':>23}via {frame}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Drive the server for hours and check for leaks')
+    parser.add_argument('--duration', type=parse_duration, default='1h', help='e.g. 90s, 20m, 4h (default 1h)')
+    parser.add_argument('--warmup', type=parse_duration, default='2m',
+                        help='load before the baseline is taken (default 2m)')
+    parser.add_argument('--interval', type=parse_duration, default='30s', help='sampling interval (default 30s)')
+    parser.add_argument('--settle', type=float, default=2.0, help='extra seconds to let the server go idle')
+    parser.add_argument('--sessions', type=int, default=3, help='concurrent publishers (default 3)')
+    parser.add_argument('--fps', type=float, default=15)
+    parser.add_argument('--quality', type=float, default=0.7)
+    parser.add_argument('--resolutions', default=','.join(SOAK_RESOLUTIONS), help='comma-separated WxH')
+    parser.add_argument('--malformed', type=float, default=0.02, help='share of malformed bodies (default 0.02)')
+    parser.add_argument('--gzip', type=float, default=0.1, help='share of gzip uploads over HTTP (default 0.1)')
+    parser.add_argument('--workers', type=int, default=0, help='prefork ingest workers (default 0)')
+    parser.add_argument('--max-rss-growth', type=float, default=64, help='MB over the baseline (default 64)')
+    parser.add_argument('--max-fd-growth', type=int, default=8, help='default 8')
+    parser.add_argument('--max-thread-growth', type=int, default=4, help='default 4')
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args()
+
+    report = soak(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        print(f"\n[Soak] Report written to {args.output}")
+    sys.exit(0 if report['passed'] else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,7 @@ from PyInstaller.utils.hooks import collect_all
 
 datas = [('iphone.html', '.'), ('cert.pem', '.'), ('key.pem', '.')]
 binaries = []
-hiddenimports = ['cv2', 'numpy', 'flask', 'pyvirtualcam', 'qrcode', 'PIL', 'OpenSSL', 'websockets', 'pystray']
+hiddenimports = ['cv2', 'numpy', 'flask', 'pyvirtualcam', 'qrcode', 'PIL', 'OpenSSL', 'websockets', 'flask_sock', 'simple_websocket', 'pystray']
 hiddenimports += collect_submodules('flask')
 tmp_ret = collect_all('cv2')
 datas += tmp_ret[0]; binaries += tmp_ret[1]; hiddenimports += tmp_ret[2]
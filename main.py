@@ -1,6 +1,8 @@
 import cv2
 import numpy as np
 from flask import Flask, request, Response, make_response, send_from_directory
+from flask_sock import Sock
+from simple_websocket import ConnectionClosed
 import threading
 import pyvirtualcam
 import platform
@@ -13,20 +15,44 @@ from OpenSSL import crypto
 from datetime import datetime, timedelta
 import gzip
 import io
+import itertools
+import json
+import struct
 import webbrowser
+from collections import deque
 import qrcode
 from PIL import Image, ImageDraw, ImageFont
 
 app = Flask(__name__)
+sock = Sock(app)
+# One phone, one virtual camera: there are no sessions here (src/core/main.py serves several phones)
 frame = None
 frame_event = threading.Event()
 virtual_cam = None
 last_shape = None
+frame_seq = itertools.count(1)  # Sequence number of accepted frames
 
 # Network optimization settings
 ENABLE_COMPRESSION = True
 MAX_FRAME_SIZE = 1024 * 1024  # 1MB max frame size
 
+# Virtual camera output rate, kept in sync with src/core/main.py
+OUTPUT_FPS = 60
+
+# WebSocket ingest settings
+FRAME_HEADER = struct.Struct('>I')  # 4-byte big-endian length prefix per frame
+TIMED_FRAME_HEADER = struct.Struct('>Id')  # With /ws?timestamps=1: length and capture time (ms since the epoch)
+app.config['SOCK_SERVER_OPTIONS'] = {
+    'ping_interval': 25,
+    'max_message_size': 4 * (MAX_FRAME_SIZE + TIMED_FRAME_HEADER.size),
+}
+
+# Glass-to-glass latency: the phone syncs to our clock with /clock and sends each frame's capture time
+LATENCY_WINDOW = 120  # Recent frames the capture latency percentiles are taken over
+MAX_CAPTURE_AGE = 60  # Capture times further than this many seconds from now are ignored as a failed sync
+capture_latency = deque(maxlen=LATENCY_WINDOW)  # Seconds from capture to the virtual camera
+capture_latency_lock = threading.Lock()
+
 def create_self_signed_cert():
     """Create a self-signed certificate for HTTPS"""
     print("[Setup] Checking SSL certificates...")
@@ -284,7 +310,7 @@ def init_virtual_camera(width, height):
             for backend in backends:
                 try:
                     print(f"Trying virtual camera with backend: {backend}")
-                    virtual_cam = pyvirtualcam.Camera(width=width, height=height, fps=60, backend=backend)
+                    virtual_cam = pyvirtualcam.Camera(width=width, height=height, fps=OUTPUT_FPS, backend=backend)
                     print(f"Successfully initialized virtual camera using {backend} backend")
                     break
                 except Exception as e:
@@ -294,7 +320,7 @@ def init_virtual_camera(width, height):
             if virtual_cam is None:
                 raise Exception("No working virtual camera backend found")
         else:
-            virtual_cam = pyvirtualcam.Camera(width=width, height=height, fps=60)
+            virtual_cam = pyvirtualcam.Camera(width=width, height=height, fps=OUTPUT_FPS)
             
         last_shape = (width, height)
         print(f"Virtual camera initialized at {width}x{height}")
@@ -312,21 +338,23 @@ def init_virtual_camera(width, height):
 def add_cors_headers(response):
     response.headers['Access-Control-Allow-Origin'] = '*'
     response.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Content-Encoding'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Content-Encoding, X-Capture-Time'
+    response.headers['Access-Control-Expose-Headers'] = 'Server-Timing, X-Frame-Seq, X-Capture-Latency'
+    response.headers['Timing-Allow-Origin'] = '*'
     if ENABLE_COMPRESSION:
         response.headers['Accept-Encoding'] = 'gzip, deflate'
     return response
 
 @app.route('/upload', methods=['POST', 'OPTIONS'])
 def upload():
-    global frame, virtual_cam, last_shape
     if request.method == 'OPTIONS':
         resp = make_response('', 204)
         resp.headers['Access-Control-Allow-Origin'] = '*'
         resp.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
-        resp.headers['Access-Control-Allow-Headers'] = 'Content-Type, Content-Encoding'
+        resp.headers['Access-Control-Allow-Headers'] = 'Content-Type, Content-Encoding, X-Capture-Time'
         return resp
 
+    started = time.perf_counter()
     img_bytes = request.data
     if not img_bytes:
         return ('No image data', 400)
@@ -339,6 +367,107 @@ def upload():
             print(f"Failed to decompress gzipped data: {e}")
             return ('Invalid compressed data', 400)
 
+    received = time.perf_counter()
+    message, status = process_frame(img_bytes, capture_time_from(request.headers.get('X-Capture-Time')))
+    # Decode and the camera send happen inside the request here, so 'app' covers them
+    headers = {'Server-Timing': f"recv;dur={(received - started) * 1000:.2f}, "
+                                f"app;dur={(time.perf_counter() - received) * 1000:.2f}"}
+    if status == 204:
+        headers['X-Frame-Seq'] = str(next(frame_seq))
+        latency = capture_latency_summary()
+        if latency:
+            headers['X-Capture-Latency'] = ', '.join(f"{k}={v}" for k, v in latency.items())
+    return (message, status, headers)
+
+@app.route('/clock')
+def clock():
+    """NTP-style clock sync: when this request arrived and when its reply left, in ms since the epoch"""
+    receive = time.time() * 1000
+    return ({'receive': receive, 'transmit': time.time() * 1000}, 200, {'Cache-Control': 'no-store'})
+
+def capture_time_from(value):
+    """A phone's capture time in ms since the epoch (our clock) as seconds, or None if unusable"""
+    try:
+        seconds = float(value) / 1000
+    except (TypeError, ValueError):
+        return None
+    return seconds if abs(time.time() - seconds) <= MAX_CAPTURE_AGE else None
+
+def capture_latency_summary():
+    """p50/p95 in ms of the recent capture to virtual camera latencies, or None"""
+    with capture_latency_lock:
+        samples = sorted(capture_latency)
+    if not samples:
+        return None
+    pick = lambda q: max(0.0, samples[min(len(samples) - 1, int(q * len(samples)))])
+    return {'p50_ms': round(pick(0.5) * 1000, 1), 'p95_ms': round(pick(0.95) * 1000, 1)}
+
+@sock.route('/ws')
+def ws_ingest(ws):
+    """Persistent binary ingest: each message carries one or more length-prefixed frames.
+
+    Every frame is acknowledged with a small JSON text message so the client
+    can keep a bounded number of frames in flight and measure round trips.
+    With ``?timestamps=1`` every length is followed by the frame's capture time.
+    """
+    print("[WebSocket] Publisher connected")
+    timed = request.args.get('timestamps') == '1'
+    try:
+        while True:
+            data = ws.receive()
+            if data is None:
+                continue
+            if isinstance(data, str):
+                # Text messages are reserved for control traffic; ignore them for now
+                continue
+            try:
+                frames = list(split_frames(data, timed))
+            except ValueError as e:
+                ws.send(json.dumps({'status': 400, 'error': str(e)}))
+                continue
+            for img_bytes, capture_ms in frames:
+                started = time.perf_counter()
+                message, status = process_frame(img_bytes, capture_time_from(capture_ms))
+                ack = {'status': status, 'server_ms': round((time.perf_counter() - started) * 1000, 2)}
+                if status == 204:
+                    ack['seq'] = next(frame_seq)
+                    latency = capture_latency_summary()
+                    if latency:
+                        ack['latency'] = latency
+                if message:
+                    ack['error'] = message
+                ws.send(json.dumps(ack))
+    except ConnectionClosed:
+        pass
+    print("[WebSocket] Publisher disconnected")
+
+def split_frames(data, timed=False):
+    """Yield ``(frame, capture_ms)`` for the frames of a length-prefixed WebSocket message.
+
+    Frames are memoryviews; ``capture_ms`` is None unless the headers are ``timed``.
+    """
+    header = TIMED_FRAME_HEADER if timed else FRAME_HEADER
+    view = memoryview(data)
+    offset = 0
+    while offset < len(view):
+        if offset + header.size > len(view):
+            raise ValueError('Truncated frame header')
+        length, *capture_ms = header.unpack_from(view, offset)
+        offset += header.size
+        if offset + length > len(view):
+            raise ValueError('Truncated frame payload')
+        yield view[offset:offset + length], capture_ms[0] if capture_ms else None
+        offset += length
+
+def process_frame(img_bytes, capture_time=None):
+    """Decode one compressed frame and push it to the virtual camera.
+
+    Shared by the HTTP and WebSocket ingest routes. Returns a
+    ``(message, status)`` tuple in the same shape Flask views return.
+    ``capture_time`` is when the phone captured the frame, in our clock.
+    """
+    global frame, virtual_cam, last_shape
+
     # Limit frame size for network efficiency
     if len(img_bytes) > MAX_FRAME_SIZE:
         print(f"Frame too large: {len(img_bytes)} bytes, max: {MAX_FRAME_SIZE}")
@@ -384,6 +513,9 @@ def upload():
             # Convert BGR to RGB for pyvirtualcam
             frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             virtual_cam.send(frame_rgb)
+            if capture_time is not None:
+                with capture_latency_lock:
+                    capture_latency.append(time.time() - capture_time)
             virtual_cam.sleep_until_next_frame()
         except Exception as e:
             print(f"\nError sending frame to virtual camera: {e}")
@@ -0,0 +1,96 @@
+"""
+Admission control for frame ingest
+
+Werkzeug's threaded server starts a thread per connection without limit,
+so under overload uploads pile up and get decoded late instead of being
+dropped. Every upload asks for admission before its body is read. A
+publisher gets a bounded number of uploads in flight (429 when it has more),
+the server as a whole a bounded number (503), and frames are refused with
+503 while the decode backlog is already longer than the frames are worth.
+Rejections carry a retry delay so clients back off for the right amount of
+time instead of hammering the server.
+"""
+
+import math
+import threading
+
+
+class Rejection:
+    """Why an upload was refused and when the publisher may try again"""
+
+    __slots__ = ('status', 'reason', 'retry_after')
+
+    def __init__(self, status, reason, retry_after):
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def message(self):
+        return 'Too many frames in flight' if self.status == 429 else 'Server busy'
+
+    def headers(self):
+        """``Retry-After`` in whole seconds as HTTP requires, plus the precise delay in milliseconds"""
+        return {
+            'Retry-After': str(max(1, math.ceil(self.retry_after))),
+            'X-Retry-After-Ms': str(int(self.retry_after * 1000)),
+        }
+
+
+class AdmissionControl:
+    """Bounded in-flight uploads per publisher and overall.
+
+    ``enter`` returns None when the upload is admitted, in which case the
+    caller must ``leave`` once the frame has been handed to the pipeline,
+    or a Rejection.
+    """
+
+    def __init__(self, per_publisher=2, total=8, max_backlog_delay=0.25, retry_after=0.05):
+        self.per_publisher = per_publisher
+        self.total = total
+        self.max_backlog_delay = max_backlog_delay
+        self.retry_after = retry_after
+        self._in_flight = {}
+        self._total_in_flight = 0
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.shed = {'publisher_busy': 0, 'server_busy': 0, 'backlog': 0}
+
+    def enter(self, publisher, backlog_delay=0.0):
+        """Ask to admit one upload; ``backlog_delay`` is the pipeline's current decode backlog in seconds"""
+        with self._lock:
+            if backlog_delay > self.max_backlog_delay:
+                return self._reject(503, 'backlog', backlog_delay)
+            if self._total_in_flight >= self.total:
+                return self._reject(503, 'server_busy', self.retry_after)
+            count = self._in_flight.get(publisher, 0)
+            if count >= self.per_publisher:
+                return self._reject(429, 'publisher_busy', self.retry_after)
+            self._in_flight[publisher] = count + 1
+            self._total_in_flight += 1
+            self.admitted += 1
+            return None
+
+    def leave(self, publisher):
+        """Release the slot of an admitted upload"""
+        with self._lock:
+            count = self._in_flight.get(publisher, 0) - 1
+            if count > 0:
+                self._in_flight[publisher] = count
+            else:
+                self._in_flight.pop(publisher, None)
+            self._total_in_flight = max(0, self._total_in_flight - 1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'admission_in_flight': self._total_in_flight,
+                'admission_limit': self.total,
+                'admission_per_publisher': self.per_publisher,
+                'admitted': self.admitted,
+                'shed': dict(self.shed),
+            }
+
+    def _reject(self, status, reason, retry_after):
+        self.shed[reason] += 1
+        return Rejection(status, reason, retry_after)
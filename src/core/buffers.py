@@ -0,0 +1,101 @@
+"""
+Reusable frame buffers
+
+Decoding a 1080p frame and converting its colours allocates two ~6 MB
+arrays per frame. The FramePool keeps released arrays keyed by shape and
+dtype so that, once the stream resolution settles, decode, scaling and
+colour conversion write into recycled buffers and nothing new is allocated.
+"""
+
+import threading
+
+import numpy as np
+
+
+class FramePool:
+    """Size-keyed pool of reusable NumPy frame buffers.
+
+    ``acquire`` hands out a free buffer of the requested shape (or allocates
+    one on a miss); ``release`` returns a buffer once its last user is done
+    with it. Buffers that were not allocated here are adopted as well.
+    A buffer shared by several owners is ``retain``-ed by each additional
+    one, and only recycled once every owner has released it.
+    """
+
+    def __init__(self, max_per_shape=4, max_shapes=8):
+        self.max_per_shape = max_per_shape
+        self.max_shapes = max_shapes
+        self._free = {}
+        self._holders = {}  # id(buffer) -> owners besides the one that acquired it
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+        self.allocated_bytes = 0
+        self.resident_bytes = 0
+
+    def acquire(self, shape, dtype=np.uint8):
+        """Return a C-contiguous buffer of ``shape``; its contents are undefined"""
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                buf = free.pop()
+                self.hits += 1
+                self.resident_bytes -= buf.nbytes
+                return buf
+            self.misses += 1
+        buf = np.empty(shape, dtype=dtype)
+        with self._lock:
+            self.allocated_bytes += buf.nbytes
+        return buf
+
+    def retain(self, buf):
+        """Register one more owner of ``buf``; it must release the buffer like the first one"""
+        with self._lock:
+            self._holders[id(buf)] = self._holders.get(id(buf), 0) + 1
+
+    def release(self, buf):
+        """Give a buffer back to the pool; the caller must not touch it afterwards"""
+        if buf is None:
+            return
+        with self._lock:
+            holders = self._holders.pop(id(buf), 0)
+            if holders:
+                # Someone else still owns it
+                if holders > 1:
+                    self._holders[id(buf)] = holders - 1
+                return
+        if not buf.flags.c_contiguous or not buf.flags.writeable or buf.base is not None:
+            # Views and read-only wrappers (e.g. over request bytes) can't be recycled
+            return
+        key = (buf.shape, buf.dtype.str)
+        with self._lock:
+            free = self._free.get(key)
+            if free is None:
+                if len(self._free) >= self.max_shapes:
+                    # Forget the sizes nobody is asking for anymore
+                    self._evict_idle_shapes()
+                free = self._free.setdefault(key, [])
+            if len(free) >= self.max_per_shape or any(b is buf for b in free):
+                self.discarded += 1
+                return
+            free.append(buf)
+            self.resident_bytes += buf.nbytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pool_hits': self.hits,
+                'pool_misses': self.misses,
+                'pool_discarded': self.discarded,
+                'pool_allocated_bytes': self.allocated_bytes,
+                'pool_resident_bytes': self.resident_bytes,
+                'pool_shapes': len(self._free),
+            }
+
+    def _evict_idle_shapes(self):
+        for key in list(self._free):
+            for buf in self._free.pop(key):
+                self.resident_bytes -= buf.nbytes
+                self.discarded += 1
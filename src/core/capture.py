@@ -0,0 +1,164 @@
+"""
+Ingest capture files
+
+With capture on, every frame the server admits is appended to a capture
+file as it came off the wire -- still compressed, if it was -- together with
+its arrival time, its session id and the request headers that affect how it
+is handled, including the publisher's capture time. ``replay.py`` feeds such
+a file back through the same ingest, inflation, decode and output path, so a
+performance problem seen with a live phone can be reproduced and measured
+before and after a change.
+
+The file is a header followed by records; each record's header carries the
+lengths of its parts, so a reader indexes the whole file in one pass over
+the record headers without touching the bodies. A file cut short by a crash
+is readable up to its last complete record.
+"""
+
+import json
+import mmap
+import queue
+import struct
+import threading
+import time
+
+MAGIC = b'IPWC'
+VERSION = 2  # 1 held bodies after inflation
+FILE_HEADER = struct.Struct('<4sI')
+# Per record: arrival time (time.time()), session id bytes, headers JSON bytes, body bytes
+RECORD_HEADER = struct.Struct('<dHHI')
+
+
+class CapturedFrame:
+    """One captured frame; ``body`` is a view into the reader's memory map"""
+
+    __slots__ = ('arrival', 'session', 'headers', 'body')
+
+    def __init__(self, arrival, session, headers, body):
+        self.arrival = arrival
+        self.session = session
+        self.headers = headers
+        self.body = body
+
+
+class CaptureWriter:
+    """Appends received frames to a capture file on a background thread.
+
+    ``write`` never blocks the thread that received the frame; frames that
+    find ``queue_frames`` frames already waiting for the disk are counted in
+    ``dropped`` and left out of the capture.
+    """
+
+    def __init__(self, path, queue_frames=256, buffer_size=4 << 20):
+        self.path = path
+        self._file = open(path, 'wb', buffering=buffer_size)
+        self._file.write(FILE_HEADER.pack(MAGIC, VERSION))
+        self._queue = queue.Queue(queue_frames)
+        self.frames = 0
+        self.dropped = 0
+        self.bytes = FILE_HEADER.size
+        self._thread = threading.Thread(target=self._run, name='capture-writer')
+        self._thread.start()
+
+    def write(self, session_id, headers, body, arrival=None):
+        """Queue a frame; ``body`` must be bytes the caller won't modify. False if it was dropped"""
+        try:
+            self._queue.put_nowait((time.time() if arrival is None else arrival, session_id, headers, body))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self, timeout=None):
+        """Write what is queued, then close the file"""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {'path': self.path, 'frames': self.frames, 'dropped': self.dropped, 'bytes': self.bytes,
+                'queued': self._queue.qsize()}
+
+    def _run(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                arrival, session_id, headers, body = item
+                session = (session_id or '').encode('utf-8')
+                header_json = json.dumps(headers, separators=(',', ':')).encode('utf-8')
+                self._file.write(RECORD_HEADER.pack(arrival, len(session), len(header_json), len(body)))
+                self._file.write(session)
+                self._file.write(header_json)
+                self._file.write(body)
+                self.frames += 1
+                self.bytes += RECORD_HEADER.size + len(session) + len(header_json) + len(body)
+        except OSError as e:
+            print(f"[Capture] Writing {self.path} failed: {e}; capture stopped")
+            # Keep taking frames off the queue so close() doesn't wait forever
+            while self._queue.get() is not None:
+                self.dropped += 1
+        finally:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+
+
+class CaptureReader:
+    """Memory-mapped capture file; iterate it or index it like a list"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        if len(self._view) < FILE_HEADER.size:
+            raise ValueError(f"{path} is not a capture file")
+        magic, version = FILE_HEADER.unpack_from(self._view, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} capture file")
+        self._offsets = []
+        self.truncated = False
+        offset, end = FILE_HEADER.size, len(self._view)
+        while offset + RECORD_HEADER.size <= end:
+            _, session_len, headers_len, body_len = RECORD_HEADER.unpack_from(self._view, offset)
+            size = RECORD_HEADER.size + session_len + headers_len + body_len
+            if offset + size > end:
+                break
+            self._offsets.append(offset)
+            offset += size
+        self.truncated = offset != end
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, index):
+        offset = self._offsets[index]
+        arrival, session_len, headers_len, body_len = RECORD_HEADER.unpack_from(self._view, offset)
+        offset += RECORD_HEADER.size
+        session = bytes(self._view[offset:offset + session_len]).decode('utf-8')
+        offset += session_len
+        headers = json.loads(bytes(self._view[offset:offset + headers_len]))
+        offset += headers_len
+        return CapturedFrame(arrival, session or None, headers, self._view[offset:offset + body_len])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def duration(self):
+        """Seconds between the first and the last frame"""
+        return self[-1].arrival - self[0].arrival if len(self) > 1 else 0.0
+
+    def close(self):
+        """Release the map; views of earlier frames must be gone by now"""
+        self._view.release()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,450 @@
+"""
+Pluggable JPEG/WebP decoder backends
+
+Every backend reports the formats it can read, the pixel layouts it can
+produce and whether it can decode into a caller-provided buffer. A
+DecoderSet benchmarks the installed backends on built-in sample frames at
+start-up, picks the fastest one per format and keeps per-backend decode
+timings so the choice can be checked on each host.
+
+When the output is much smaller than the incoming frame, JPEGs are decoded
+at 1/2, 1/4 or 1/8 scale straight from the DCT coefficients, which skips
+most of the inverse transform and colour conversion work.
+
+OpenCV is always available; PyTurboJPEG, Pillow and the ``webp`` (libwebp)
+package are used when installed.
+"""
+
+import inspect
+import io
+import threading
+import time
+
+import cv2
+import numpy as np
+
+FORMATS = ('jpeg', 'webp')
+REDUCTION_FACTORS = (8, 4, 2)
+
+# Start-of-frame markers carry the image size (C4, C8 and CC are DHT, JPG and DAC)
+SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def sniff_format(data):
+    """Identify the container format from the first bytes of a frame"""
+    head = bytes(data[:12])
+    if head[:3] == b'\xff\xd8\xff':
+        return 'jpeg'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def jpeg_size(data):
+    """Read ``(width, height)`` from a JPEG's SOF segment without decoding; None if not found"""
+    view = memoryview(data)
+    n = len(view)
+    if n < 4 or view[0] != 0xFF or view[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 <= n:
+        if view[i] != 0xFF:
+            return None
+        marker = view[i + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Standalone markers have no length field
+            i += 2
+            continue
+        if marker in SOF_MARKERS:
+            height = (view[i + 5] << 8) | view[i + 6]
+            width = (view[i + 7] << 8) | view[i + 8]
+            return width, height
+        if marker == 0xDA:
+            # Start of scan without a frame header
+            return None
+        i += 2 + ((view[i + 2] << 8) | view[i + 3])
+    return None
+
+
+def webp_size(data):
+    """Read ``(width, height)`` from a WebP (VP8, VP8L or VP8X) header; None if not found"""
+    head = bytes(data[:30])
+    if len(head) < 30 or head[:4] != b'RIFF' or head[8:12] != b'WEBP':
+        return None
+    chunk = head[12:16]
+    if chunk == b'VP8 ' and head[23:26] == b'\x9d\x01\x2a':
+        width = int.from_bytes(head[26:28], 'little') & 0x3FFF
+        height = int.from_bytes(head[28:30], 'little') & 0x3FFF
+        return width, height
+    if chunk == b'VP8L' and head[20] == 0x2F:
+        bits = int.from_bytes(head[21:25], 'little')
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X':
+        return int.from_bytes(head[24:27], 'little') + 1, int.from_bytes(head[27:30], 'little') + 1
+    return None
+
+
+def frame_size(data):
+    """Peek at the ``(width, height)`` of a JPEG or WebP frame without decoding it"""
+    fmt = sniff_format(data)
+    if fmt == 'jpeg':
+        return jpeg_size(data)
+    if fmt == 'webp':
+        return webp_size(data)
+    return None
+
+
+def reduction_factor(src_width, src_height, dst_width, dst_height, factors=REDUCTION_FACTORS):
+    """Largest DCT scaling denominator that still leaves at least the destination size"""
+    for factor in factors:
+        # libjpeg rounds scaled dimensions up
+        if -(-src_width // factor) >= dst_width and -(-src_height // factor) >= dst_height:
+            return factor
+    return 1
+
+
+class DecoderBackend:
+    """Base class for decoder backends"""
+
+    name = None
+    formats = ()
+    layouts = ()
+    decode_into = False
+    reduced_formats = ()  # Formats that can be decoded at 1/2, 1/4 and 1/8 scale
+
+    @classmethod
+    def load(cls):
+        """Return a ready backend instance, or None if its library is missing"""
+        return cls()
+
+    def decode(self, data, layout='bgr', dst=None, scale=1):
+        """Decode frame bytes into ``layout`` at 1/``scale`` size; returns the image (``dst`` if given) or None"""
+        raise NotImplementedError
+
+    def describe(self):
+        return {
+            'formats': list(self.formats),
+            'layouts': list(self.layouts),
+            'decode_into': self.decode_into,
+            'reduced_formats': list(self.reduced_formats),
+        }
+
+    @staticmethod
+    def _deliver(img, dst):
+        # Backends that can't write into dst copy their result there instead
+        if img is None or dst is None:
+            return img
+        np.copyto(dst, img)
+        return dst
+
+
+class OpenCVDecoder(DecoderBackend):
+    name = 'opencv'
+    formats = ('jpeg', 'webp')
+    layouts = ('bgr', 'rgb', 'gray')
+    reduced_formats = ('jpeg',)
+
+    REDUCED_FLAGS = {
+        (False, 2): cv2.IMREAD_REDUCED_COLOR_2,
+        (False, 4): cv2.IMREAD_REDUCED_COLOR_4,
+        (False, 8): cv2.IMREAD_REDUCED_COLOR_8,
+        (True, 2): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+        (True, 4): cv2.IMREAD_REDUCED_GRAYSCALE_4,
+        (True, 8): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+    }
+
+    def decode(self, data, layout='bgr', dst=None, scale=1):
+        gray = layout == 'gray'
+        if scale > 1:
+            flags = self.REDUCED_FLAGS[(gray, scale)]
+        else:
+            flags = cv2.IMREAD_GRAYSCALE if gray else cv2.IMREAD_COLOR
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+        if img is not None and layout == 'rgb':
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        return self._deliver(img, dst)
+
+
+class TurboJpegDecoder(DecoderBackend):
+    name = 'turbojpeg'
+    formats = ('jpeg',)
+    layouts = ('bgr', 'rgb', 'gray')
+    decode_into = True
+    reduced_formats = ('jpeg',)
+
+    def __init__(self, jpeg, pixel_formats, decode_into=True):
+        self._jpeg = jpeg
+        self._pixel_formats = pixel_formats
+        self.decode_into = decode_into
+
+    @classmethod
+    def load(cls):
+        try:
+            from turbojpeg import TurboJPEG, TJPF_BGR, TJPF_RGB, TJPF_GRAY
+            jpeg = TurboJPEG()
+        except Exception:
+            return None
+        # PyTurboJPEG before 2.0 can't decode into a caller's buffer
+        decode_into = 'dst' in inspect.signature(jpeg.decode).parameters
+        return cls(jpeg, {'bgr': TJPF_BGR, 'rgb': TJPF_RGB, 'gray': TJPF_GRAY}, decode_into)
+
+    def decode(self, data, layout='bgr', dst=None, scale=1):
+        scaling_factor = (1, scale) if scale > 1 else None
+        if self.decode_into:
+            img = self._jpeg.decode(data, pixel_format=self._pixel_formats[layout],
+                                    scaling_factor=scaling_factor, dst=dst)
+        else:
+            img = self._jpeg.decode(data, pixel_format=self._pixel_formats[layout],
+                                    scaling_factor=scaling_factor)
+        if layout == 'gray' and img is not None and img.ndim == 3:
+            img = img[:, :, 0]
+        return img if self.decode_into else self._deliver(img, dst)
+
+
+class PillowDecoder(DecoderBackend):
+    name = 'pillow'
+    formats = ('jpeg', 'webp')
+    layouts = ('bgr', 'rgb', 'gray')
+    reduced_formats = ('jpeg',)
+
+    def __init__(self, image_module):
+        self._image = image_module
+
+    @classmethod
+    def load(cls):
+        try:
+            from PIL import Image
+        except ImportError:
+            return None
+        return cls(Image)
+
+    def decode(self, data, layout='bgr', dst=None, scale=1):
+        with self._image.open(io.BytesIO(data)) as im:
+            if scale > 1 and im.format == 'JPEG':
+                # draft() configures libjpeg's DCT scaling before the pixels are read
+                im.draft('L' if layout == 'gray' else 'RGB', (im.width // scale, im.height // scale))
+            img = np.asarray(im.convert('L' if layout == 'gray' else 'RGB'))
+        if layout == 'bgr':
+            img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+        return self._deliver(img, dst)
+
+
+class LibWebPDecoder(DecoderBackend):
+    name = 'libwebp'
+    formats = ('webp',)
+    layouts = ('bgr', 'rgb')
+    decode_into = True
+
+    def __init__(self, webp_module):
+        self._webp = webp_module
+        self._modes = {'bgr': webp_module.WebPColorMode.BGR, 'rgb': webp_module.WebPColorMode.RGB}
+
+    @classmethod
+    def load(cls):
+        try:
+            import webp
+        except ImportError:
+            return None
+        return cls(webp)
+
+    def decode(self, data, layout='bgr', dst=None, scale=1):
+        webp, ffi, lib = self._webp, self._webp.ffi, self._webp.lib
+        webp_data = webp.WebPData.from_buffer(bytes(data))
+        config = webp.WebPDecoderConfig.new()
+        config.read_features(webp_data)
+        width, height = config.input.width, config.input.height
+        if dst is None:
+            dst = np.empty((height, width, 3), dtype=np.uint8)
+        elif dst.shape != (height, width, 3) or not dst.flags.c_contiguous:
+            raise ValueError(f"dst must be a contiguous {height}x{width}x3 array")
+
+        # Point libwebp straight at the destination array
+        config.output.colorspace = self._modes[layout].value
+        config.output.u.RGBA.rgba = ffi.cast('uint8_t*', ffi.from_buffer(dst))
+        config.output.u.RGBA.size = dst.size
+        config.output.u.RGBA.stride = width * 3
+        config.output.is_external_memory = 1
+        status = lib.WebPDecode(webp_data.ptr.bytes, webp_data.size, config.ptr)
+        lib.WebPFreeDecBuffer(ffi.addressof(config.ptr, 'output'))
+        return dst if status == lib.VP8_STATUS_OK else None
+
+
+# Default preference before (or without) a benchmark
+BACKENDS = (TurboJpegDecoder, LibWebPDecoder, OpenCVDecoder, PillowDecoder)
+
+
+def sample_frames(width=1280, height=720, quality=70):
+    """Encode a synthetic camera-like frame as JPEG and WebP for benchmarking"""
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[:, :, 0] = (x * 0.6 + y * 0.4).astype(np.uint8)
+    img[:, :, 1] = (255 - x * 0.5).astype(np.uint8)
+    img[:, :, 2] = (y * 0.8 + 30).astype(np.uint8)
+    cv2.circle(img, (width // 3, height // 2), height // 4, (40, 180, 220), -1)
+    cv2.rectangle(img, (width // 2, height // 4), (width * 5 // 6, height * 3 // 4), (200, 60, 90), -1)
+    noise = rng.normal(0, 6, img.shape).astype(np.int16)
+    img = np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+    samples = {}
+    ok, jpeg = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if ok:
+        samples['jpeg'] = jpeg.tobytes()
+    ok, webp = cv2.imencode('.webp', img, [cv2.IMWRITE_WEBP_QUALITY, quality])
+    if ok:
+        samples['webp'] = webp.tobytes()
+    return samples
+
+
+class DecodeTimer:
+    """Running decode timings for one backend"""
+
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = 0.0
+
+    def add(self, ms):
+        self.count += 1
+        self.total_ms += ms
+        self.min_ms = ms if self.min_ms is None else min(self.min_ms, ms)
+        self.max_ms = max(self.max_ms, ms)
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'failures': self.failures,
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else None,
+            'min_ms': round(self.min_ms, 3) if self.min_ms is not None else None,
+            'max_ms': round(self.max_ms, 3),
+        }
+
+
+class DecoderSet:
+    """The installed backends plus the fastest choice per format"""
+
+    def __init__(self, backends=BACKENDS):
+        self.backends = {}
+        for cls in backends:
+            backend = cls.load()
+            if backend is not None:
+                self.backends[backend.name] = backend
+        self.selected = {}
+        for fmt in FORMATS:
+            for backend in self.backends.values():
+                if fmt in backend.formats:
+                    self.selected[fmt] = backend
+                    break
+        self.benchmark_ms = {}
+        self.reduced = {factor: 0 for factor in REDUCTION_FACTORS}
+        self._timers = {name: DecodeTimer() for name in self.backends}
+        self._lock = threading.Lock()
+
+    def benchmark(self, samples=None, rounds=15, layout='bgr'):
+        """Time every backend on the sample frames and select the fastest per format"""
+        samples = samples if samples is not None else sample_frames()
+        for fmt, data in samples.items():
+            results = {}
+            for backend in self.backends.values():
+                if fmt not in backend.formats or layout not in backend.layouts:
+                    continue
+                try:
+                    backend.decode(data, layout)  # Warm-up
+                    times = []
+                    for _ in range(rounds):
+                        start = time.perf_counter()
+                        backend.decode(data, layout)
+                        times.append((time.perf_counter() - start) * 1000)
+                except Exception as e:
+                    print(f"[Decoders] {backend.name} failed on {fmt}: {e}")
+                    continue
+                results[backend.name] = sorted(times)[len(times) // 2]
+            if results:
+                fastest = min(results, key=results.get)
+                self.selected[fmt] = self.backends[fastest]
+                self.benchmark_ms[fmt] = {name: round(ms, 3) for name, ms in results.items()}
+        return self.benchmark_ms
+
+    def select(self, selected, benchmark_ms=None):
+        """Adopt a selection made elsewhere, e.g. by the dispatcher's benchmark: a backend name per format"""
+        for fmt, name in selected.items():
+            if name in self.backends:
+                self.selected[fmt] = self.backends[name]
+        if benchmark_ms is not None:
+            self.benchmark_ms = benchmark_ms
+
+    def decodes_into(self, data):
+        """Whether the backend selected for this frame's format writes into a caller's buffer"""
+        backend = self.selected.get(sniff_format(data))
+        return backend is not None and backend.decode_into
+
+    def decode(self, data, layout='bgr', dst=None, scale=1):
+        """Decode with the selected backend for the frame's format; None if undecodable.
+
+        ``scale`` requests a reduced-size decode (2, 4 or 8); backends that
+        can't do it for this format decode at full size instead.
+        """
+        fmt = sniff_format(data)
+        backend = self.selected.get(fmt) or self.backends['opencv']
+        if fmt not in backend.reduced_formats:
+            scale = 1
+        start = time.perf_counter()
+        try:
+            img = backend.decode(data, layout, dst, scale)
+        except Exception:
+            img = None
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            timer = self._timers[backend.name]
+            if img is None:
+                timer.failures += 1
+            else:
+                timer.add(elapsed_ms)
+                if scale > 1:
+                    self.reduced[scale] += 1
+        if img is None and backend.name != 'opencv':
+            # Let OpenCV have a go at anything the faster backend rejected
+            img = self._fallback(fmt, data, layout, dst, scale)
+        return img
+
+    def _fallback(self, fmt, data, layout, dst, scale):
+        """Decode with OpenCV at 1/``scale`` size into ``dst``, resizing when it can't reduce the format"""
+        opencv = self.backends['opencv']
+        start = time.perf_counter()
+        try:
+            img = opencv.decode(data, layout, scale=scale if fmt in opencv.reduced_formats else 1)
+        except Exception:
+            img = None
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            timer = self._timers['opencv']
+            if img is None:
+                timer.failures += 1
+            else:
+                timer.add(elapsed_ms)
+        if img is None or dst is None:
+            return img
+        if img.shape != dst.shape:
+            # The caller sized dst for the reduced decode
+            cv2.resize(img, (dst.shape[1], dst.shape[0]), dst=dst, interpolation=cv2.INTER_AREA)
+            return dst
+        np.copyto(dst, img)
+        return dst
+
+    def stats(self):
+        with self._lock:
+            timings = {name: timer.as_dict() for name, timer in self._timers.items()}
+        return {
+            'selected': {fmt: backend.name for fmt, backend in self.selected.items()},
+            'backends': {name: backend.describe() for name, backend in self.backends.items()},
+            'benchmark_ms': self.benchmark_ms,
+            'timings': timings,
+            'reduced_decodes': {f"1/{factor}": count for factor, count in self.reduced.items()},
+        }
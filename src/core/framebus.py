@@ -0,0 +1,256 @@
+"""
+Shared-memory frame bus
+
+The output stage publishes every decoded frame of a session into a ring of
+frame slots in a named shared memory block (``iphone_webcam_0`` for session
+slot 0, and so on), so recorders, analysis and preview tools on the same
+machine can read the stream without decoding it again or going through the
+HTTP server. Each ring slot carries a small header -- sequence number,
+capture timestamp, width, height and pixel format -- and a seqlock: the
+writer makes it odd while it overwrites the slot, so a reader can tell a
+frame it is looking at has been replaced.
+
+Readers need nothing but NumPy and this file::
+
+    from framebus import FrameBusReader
+
+    with FrameBusReader('iphone_webcam_0') as bus:
+        while True:
+            frame = bus.next_frame()
+            process(frame.image)  # A view into shared memory, valid until the writer laps the ring
+
+Readers are unrelated processes that find the bus by name, and the standard
+library has no named semaphore or event to signal them with, so
+``next_frame`` polls the newest sequence number. Each poll is one read of
+shared memory; ``poll_interval`` trades a little CPU for how late after
+publication a reader picks a frame up.
+"""
+
+import struct
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+MAGIC = b'IPWB'
+VERSION = 1
+HEADER_SIZE = 64  # Bytes reserved for the bus header and each slot header; keeps frame data aligned
+# Bus: magic, version, ring slots, bytes per frame, newest sequence number, writer closed
+BUS_HEADER = struct.Struct('<4sIIQQI')
+LATEST = struct.Struct('<Q')
+LATEST_OFFSET = 20
+CLOSED = struct.Struct('<I')
+CLOSED_OFFSET = 28
+# Slot: seqlock, sequence number, timestamp (time.time()), width, height, pixel format, data bytes
+SLOT_HEADER = struct.Struct('<QQdIIII')
+SEQLOCK = struct.Struct('<Q')
+
+PIXEL_FORMATS = ('bgr', 'rgb', 'i420', 'nv12')
+POLL_INTERVAL = 0.001  # Default seconds between checks for a new frame in next_frame()
+
+
+def frame_shape(pixel_format, width, height):
+    """Array shape of a frame: interleaved 3-channel, or planar YUV 4:2:0 as one 2-D array"""
+    if pixel_format in ('i420', 'nv12'):
+        return (height * 3 // 2, width)
+    return (height, width, 3)
+
+
+class Frame:
+    """One frame read from the bus; ``image`` is a view into shared memory"""
+
+    __slots__ = ('seq', 'timestamp', 'width', 'height', 'pixel_format', 'image', '_reader', '_lock')
+
+    def __init__(self, seq, timestamp, width, height, pixel_format, image, reader, lock):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.width = width
+        self.height = height
+        self.pixel_format = pixel_format
+        self.image = image
+        self._reader = reader
+        self._lock = lock
+
+    def valid(self):
+        """Whether ``image`` still holds this frame (check after using it when the reader may lag)"""
+        return self._reader._seqlock(self.seq) == self._lock
+
+    def copy(self):
+        """The pixels in memory of their own, or None if the frame was overwritten meanwhile"""
+        image = self.image.copy()
+        return image if self.valid() else None
+
+
+class FrameBus:
+    """Writer side: a ring of ``slots`` frames of up to ``frame_bytes`` in shared memory ``name``"""
+
+    def __init__(self, name, frame_bytes, slots=4):
+        self.name = name
+        self.slots = slots
+        self.frame_bytes = frame_bytes
+        self._slot_size = HEADER_SIZE + frame_bytes
+        size = HEADER_SIZE + slots * self._slot_size
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a server that didn't shut down cleanly
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        BUS_HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, slots, frame_bytes, 0, 0)
+        self.seq = 0
+        self.published = 0
+
+    def publish(self, image, pixel_format='bgr', timestamp=None):
+        """Write a uint8 frame into the next ring slot and return its sequence number"""
+        if image.nbytes > self.frame_bytes:
+            raise ValueError(f"Frame of {image.nbytes} bytes exceeds the bus's {self.frame_bytes} bytes")
+        if pixel_format in ('i420', 'nv12'):
+            height, width = image.shape[0] * 2 // 3, image.shape[1]
+        else:
+            height, width = image.shape[:2]
+        buf = self.shm.buf
+        seq = self.seq + 1
+        offset = self._offset(seq)
+        (lock,) = SEQLOCK.unpack_from(buf, offset)
+        SEQLOCK.pack_into(buf, offset, lock + 1)
+        dst = np.ndarray(image.shape, np.uint8, buffer=buf, offset=offset + HEADER_SIZE)
+        np.copyto(dst, image)
+        del dst
+        SLOT_HEADER.pack_into(buf, offset, lock + 2, seq, time.time() if timestamp is None else timestamp,
+                              width, height, PIXEL_FORMATS.index(pixel_format), image.nbytes)
+        LATEST.pack_into(buf, LATEST_OFFSET, seq)
+        self.seq = seq
+        self.published += 1
+        return seq
+
+    def close(self):
+        """Tell readers no more frames are coming and remove the block"""
+        CLOSED.pack_into(self.shm.buf, CLOSED_OFFSET, 1)
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        return {'name': self.name, 'slots': self.slots, 'published': self.published}
+
+    def _offset(self, seq):
+        return HEADER_SIZE + (seq % self.slots) * self._slot_size
+
+
+class FrameBusReader:
+    """Reader side of a frame bus; any number of processes may read at once"""
+
+    def __init__(self, name, poll_interval=POLL_INTERVAL):
+        self.name = name
+        self.poll_interval = poll_interval
+        self.shm = _attach(name)
+        magic, version, self.slots, self.frame_bytes, _, _ = BUS_HEADER.unpack_from(self.shm.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.shm.close()
+            raise ValueError(f"'{name}' is not a version {VERSION} frame bus")
+        self._slot_size = HEADER_SIZE + self.frame_bytes
+        self.seq = 0
+        self.missed = 0
+
+    def latest(self):
+        """Sequence number of the newest published frame"""
+        return LATEST.unpack_from(self.shm.buf, LATEST_OFFSET)[0]
+
+    @property
+    def closed(self):
+        return CLOSED.unpack_from(self.shm.buf, CLOSED_OFFSET)[0] != 0
+
+    def next_frame(self, timeout=None):
+        """Block until a frame newer than the last one returned is published.
+
+        Returns the newest frame, skipping (and counting in ``missed``) any
+        the reader was too slow for, or None on timeout. Raises EOFError
+        once the writer has closed the bus. Waits by polling every
+        ``poll_interval`` seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            seq = self.latest()
+            if seq > self.seq:
+                frame = self._read(seq)
+                if frame is not None:
+                    self.missed += seq - self.seq - 1 if self.seq else 0
+                    self.seq = seq
+                    return frame
+                continue
+            if self.closed:
+                raise EOFError(f"Frame bus '{self.name}' was closed")
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def close(self):
+        """Detach; frames returned earlier must not be used afterwards"""
+        self.shm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _offset(self, seq):
+        return HEADER_SIZE + (seq % self.slots) * self._slot_size
+
+    def _seqlock(self, seq):
+        return SEQLOCK.unpack_from(self.shm.buf, self._offset(seq))[0]
+
+    def _read(self, seq):
+        offset = self._offset(seq)
+        lock, slot_seq, timestamp, width, height, fmt, _ = SLOT_HEADER.unpack_from(self.shm.buf, offset)
+        if lock % 2 or slot_seq != seq:
+            # Being overwritten by a newer frame; the caller picks that one up instead
+            return None
+        pixel_format = PIXEL_FORMATS[fmt]
+        image = np.ndarray(frame_shape(pixel_format, width, height), np.uint8,
+                           buffer=self.shm.buf, offset=offset + HEADER_SIZE)
+        return Frame(seq, timestamp, width, height, pixel_format, image, self, lock)
+
+
+def _attach(name, shared_tracker=False):
+    """Map an existing block without letting this process's exit unlink it.
+
+    Pass ``shared_tracker`` from a multiprocessing child of the creator: it
+    shares the creator's resource tracker, where attaching registers nothing
+    new and unregistering would drop the creator's own registration.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if not shared_tracker:
+            # Before 3.13 the resource tracker would unlink the writer's block when this process exits
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+if __name__ == '__main__':
+    # Print the frame rate and latency seen by a reader, e.g. python framebus.py iphone_webcam_0
+    with FrameBusReader(sys.argv[1] if len(sys.argv) > 1 else 'iphone_webcam_0') as bus:
+        frames, started = 0, time.monotonic()
+        while True:
+            try:
+                frame = bus.next_frame(timeout=5)
+            except EOFError as e:
+                print(e)
+                break
+            if frame is None:
+                print("No frames for 5 s")
+                continue
+            frames += 1
+            elapsed = time.monotonic() - started
+            if elapsed >= 1:
+                print(f"{frame.width}x{frame.height} {frame.pixel_format}: {frames / elapsed:.1f} FPS, "
+                      f"{(time.time() - frame.timestamp) * 1000:.1f} ms old, {bus.missed} missed")
+                frames, started = 0, time.monotonic()
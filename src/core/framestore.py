@@ -0,0 +1,104 @@
+"""
+Latest-frame store
+
+A session's FrameStore holds the newest encoded frame (the JPEG bytes as
+uploaded) and the newest decoded frame, each with its pipeline sequence
+number and capture timestamp. Publishing swaps in a new record under a
+condition variable; consumers block in ``wait(after=N)`` until a frame newer
+than N exists instead of polling or reading shared state mid-update.
+"""
+
+import threading
+
+
+class StoredFrame:
+    """One published frame: ``data`` is JPEG bytes or a decoded image"""
+
+    __slots__ = ('seq', 'timestamp', 'data', 'index')
+
+    def __init__(self, seq, timestamp, data, index):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.data = data
+        self.index = index  # How many frames of its kind the store has published, this one included
+
+
+class FrameStore:
+    """The newest encoded and decoded frame of one publisher.
+
+    Encoded frames are immutable bytes and may be kept. A decoded image
+    comes from the output stage's frame ``pool``: the store retains it until
+    the next one is published, then releases it for recycling. Read its
+    pixels with ``copy_decoded``, never through ``StoredFrame.data``.
+    """
+
+    def __init__(self, pool=None):
+        self._pool = pool
+        self._cond = threading.Condition()
+        self._frames = {False: None, True: None}  # Keyed by ``decoded``
+        self._published = {False: 0, True: 0}
+        self._closed = False
+
+    def publish(self, data, seq, timestamp, decoded=False):
+        """Make a frame the newest of its kind and wake the waiters.
+
+        A frame no newer than the current one, e.g. from a slower
+        concurrent upload, is ignored, and so are decoded frames once the
+        store is closed. Returns whether it was stored.
+        """
+        with self._cond:
+            current = self._frames[decoded]
+            if (current is not None and seq <= current.seq) or (decoded and self._closed):
+                return False
+            self._published[decoded] += 1
+            self._frames[decoded] = StoredFrame(seq, timestamp, data, self._published[decoded])
+            if decoded and self._pool is not None:
+                self._pool.retain(data)
+                if current is not None:
+                    self._pool.release(current.data)
+            self._cond.notify_all()
+            return True
+
+    def latest(self, decoded=False):
+        """The newest frame of a kind, or None before the first one"""
+        return self._frames[decoded]
+
+    def wait(self, after=0, timeout=None, decoded=False):
+        """Block until a frame with a sequence number above ``after`` exists and return the newest.
+
+        Returns None on timeout and raises EOFError once the store is closed.
+        """
+        def ready():
+            frame = self._frames[decoded]
+            return self._closed or (frame is not None and frame.seq > after)
+
+        with self._cond:
+            if not self._cond.wait_for(ready, timeout):
+                return None
+            if self._closed:
+                raise EOFError('Frame store closed')
+            return self._frames[decoded]
+
+    def copy_decoded(self, frame):
+        """The pixels of a decoded ``frame`` in an array of their own, or None if it was already replaced"""
+        with self._cond:
+            # The store's hold on the buffer only ends in publish(), which waits for this lock
+            return frame.data.copy() if self._frames[True] is frame else None
+
+    def close(self):
+        """Wake every waiter with EOFError and release the decoded frame; encoded publishes are still stored"""
+        with self._cond:
+            self._closed = True
+            current, self._frames[True] = self._frames[True], None
+            if current is not None and self._pool is not None:
+                self._pool.release(current.data)
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def stats(self):
+        latest = self._frames[False]
+        return {'encoded_published': self._published[False], 'decoded_published': self._published[True],
+                'latest_seq': latest.seq if latest is not None else None}
@@ -0,0 +1,186 @@
+"""
+Bounded, copy-free request body ingest
+
+Upload bodies are read straight from the request stream into a recycled
+buffer with ``readinto``, and compressed bodies are inflated incrementally
+with the frame size limit enforced as the output grows. A small gzip bomb is
+rejected after at most ``max_size`` bytes of output instead of being
+inflated in full first, so peak memory under concurrent uploads is bounded
+by the number of buffers in flight.
+"""
+
+import selectors
+import ssl
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 64 * 1024
+
+# zlib window bits: gzip header, zlib header
+ZLIB_WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'x-gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+
+class IngestError(Exception):
+    """A request body that can't be accepted, with the HTTP status to answer"""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class TLSPendingSelector(selectors.DefaultSelector):
+    """Selector that also reports TLS sockets holding already-decrypted bytes.
+
+    simple_websocket waits in ``select()`` between reads when it sends
+    pings. A TLS socket can have read a whole record that ``recv`` only
+    partly returned, and ``select()`` on the socket doesn't see it: the rest
+    of a frame would sit there until the phone sent something else.
+    """
+
+    def select(self, timeout=None):
+        ready = [(key, selectors.EVENT_READ) for key in self.get_map().values()
+                 if isinstance(key.fileobj, ssl.SSLSocket) and key.fileobj.pending()]
+        return ready or super().select(timeout)
+
+
+class BodyBufferPool:
+    """Recycled ``bytearray`` buffers for request bodies.
+
+    Buffers hold ``max_size + 1`` bytes so that an oversize body is detected
+    by filling the buffer rather than by reading it to the end.
+    """
+
+    def __init__(self, max_size, max_free=8):
+        self.capacity = max_size + 1
+        self.max_free = max_free
+        self._free = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self):
+        with self._lock:
+            if self._free:
+                self.hits += 1
+                return self._free.pop()
+            self.misses += 1
+        return bytearray(self.capacity)
+
+    def release(self, buf):
+        if buf is None:
+            return
+        with self._lock:
+            if len(self._free) < self.max_free:
+                self._free.append(buf)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'body_buffer_hits': self.hits,
+                'body_buffer_misses': self.misses,
+                'body_buffers_free': len(self._free),
+                'body_buffer_bytes': self.capacity,
+            }
+
+
+class TeeStream:
+    """Passes reads through to ``stream`` and keeps a copy of the raw bytes in ``data``"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.data = bytearray()
+
+    def readinto(self, view):
+        n = self.stream.readinto(view)
+        if n:
+            self.data += view[:n]
+        return n
+
+
+def supported_encodings():
+    """Content-Encodings the ingest path can inflate"""
+    encodings = list(ZLIB_WBITS)
+    if zstandard is not None:
+        encodings.append('zstd')
+    return encodings
+
+
+def read_body(stream, buf, max_size, content_length=None, encoding=None):
+    """Read a (possibly compressed) request body into ``buf``.
+
+    Returns the number of frame bytes now at the start of ``buf``.
+    Raises IngestError when the body is too large or can't be decoded.
+    """
+    if content_length is not None and content_length > max_size:
+        raise IngestError('Frame too large', 413)
+
+    view = memoryview(buf)
+    try:
+        encoding = (encoding or 'identity').strip().lower()
+        if encoding == 'identity':
+            length = _read_into(stream, view)
+        elif encoding in ZLIB_WBITS:
+            length = _inflate_into(stream, view, ZLIB_WBITS[encoding])
+        elif encoding == 'zstd' and zstandard is not None:
+            reader = zstandard.ZstdDecompressor().stream_reader(stream, read_size=CHUNK_SIZE)
+            try:
+                length = _read_into(reader, view)
+            except zstandard.ZstdError as e:
+                raise IngestError(f'Invalid compressed data: {e}', 400)
+        else:
+            raise IngestError(f'Unsupported Content-Encoding: {encoding}', 415)
+    finally:
+        view.release()
+
+    if length > max_size:
+        raise IngestError('Frame too large', 413)
+    return length
+
+
+def _read_into(reader, view):
+    total = 0
+    while total < len(view):
+        n = reader.readinto(view[total:])
+        if not n:
+            break
+        total += n
+    return total
+
+
+def _inflate_into(stream, view, wbits):
+    inflater = zlib.decompressobj(wbits)
+    chunk = bytearray(CHUNK_SIZE)
+    chunk_view = memoryview(chunk)
+    total = 0
+    try:
+        while True:
+            n = stream.readinto(chunk_view)
+            if not n:
+                break
+            pending = chunk_view[:n]
+            while pending:
+                # Never inflate more than still fits; a full buffer means oversize
+                out = inflater.decompress(pending, len(view) - total)
+                view[total:total + len(out)] = out
+                total += len(out)
+                if total >= len(view):
+                    return total
+                pending = inflater.unconsumed_tail
+            if inflater.eof:
+                break
+        out = inflater.flush(len(view) - total)
+        view[total:total + len(out)] = out
+        total += len(out)
+    except zlib.error as e:
+        raise IngestError(f'Invalid compressed data: {e}', 400)
+    finally:
+        chunk_view.release()
+    if not inflater.eof:
+        raise IngestError('Truncated compressed data', 400)
+    return total
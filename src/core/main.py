@@ -1,6 +1,8 @@
 import cv2
 import numpy as np
-from flask import Flask, request, Response, make_response, send_from_directory, send_file
+from flask import Flask, request, Response, make_response, redirect, send_from_directory, send_file, jsonify
+from flask_sock import Sock
+from simple_websocket import ConnectionClosed
 import threading
 import pyvirtualcam
 import platform
@@ -11,21 +13,122 @@ import socket
 from contextlib import closing
 from OpenSSL import crypto
 from datetime import datetime, timedelta
-import gzip
 import io
+import json
+import struct
 import webbrowser
+from urllib.parse import urlencode, urlsplit
 import qrcode
 from PIL import Image, ImageDraw, ImageFont
+from admission import AdmissionControl
+from buffers import FramePool
+from capture import CaptureWriter
+from metrics import MetricsRegistry
+from ingest import BodyBufferPool, IngestError, TeeStream, TLSPendingSelector, read_body, supported_encodings
+from decoders import DecoderSet, frame_size, reduction_factor, sniff_format
+from framebus import FrameBus
+from pipeline import FramePipeline
+from prefork import Dispatcher
+from ratecontrol import RateController, format_recommendation
+from recorder import Recorder
+from restream import BOUNDARY, Broadcaster
+from scaling import FrameScaler
+from sessions import SESSION_ID, SessionRegistry
+from yuv import YuvDecoder, yuv_to_rgb
 
 app = Flask(__name__)
-frame = None
-frame_event = threading.Event()
-virtual_cam = None
-last_shape = None
+sock = Sock(app)
+dispatcher = None  # Prefork mode: the ingest workers of this server process
+worker = None  # Prefork mode: this worker process's link to the dispatcher
+capture = None  # Ingest capture file being written, see CAPTURE_INGEST
 
 # Network optimization settings
 ENABLE_COMPRESSION = True
 MAX_FRAME_SIZE = 1024 * 1024  # 1MB max frame size
+MAX_DECODE_PIXELS = 4096 * 4096  # Frames whose header declares more are refused before anything is allocated
+
+# WebSocket ingest settings
+FRAME_HEADER = struct.Struct('>I')  # 4-byte big-endian length prefix per frame
+TIMED_FRAME_HEADER = struct.Struct('>Id')  # With /ws?timestamps=1: length and capture time (ms since the epoch)
+app.config['SOCK_SERVER_OPTIONS'] = {
+    'ping_interval': 25,
+    'selector_class': TLSPendingSelector,
+    'max_message_size': 4 * (MAX_FRAME_SIZE + TIMED_FRAME_HEADER.size),
+}
+
+# Frame pipeline settings
+DECODE_WORKERS = 2  # cv2.imdecode releases the GIL, so decodes run in parallel
+INGEST_QUEUE_SIZE = 2  # Older frames are dropped once this many are waiting
+
+# Virtual camera output settings
+OUTPUT_FPS = 60  # Output clock rate; the last frame is repeated between uploads
+LOW_LATENCY_OUTPUT = False  # Push new frames immediately instead of on the next tick
+JITTER_BUFFER_MAX_DELAY = 0  # Seconds of latency a jitter buffer may add to smooth bursty Wi-Fi (0 = off);
+                             # it overrides LOW_LATENCY_OUTPUT
+CAMERA_RETRY_INTERVAL = 5  # Seconds to wait before retrying a failed camera init
+VIRTUAL_CAMERA_ENABLED = True  # False runs the whole frame path except the camera itself (e.g. replay.py)
+RUNNING_IN_DOCKER = os.path.exists('/.dockerenv')  # The host manages the virtual camera then
+
+# /metrics label for each upload rejection status
+INGEST_REJECT_REASONS = {413: 'oversize', 415: 'unsupported_encoding', 400: 'invalid_body'}
+
+# Server-Timing entries reported from the last frame through the pipeline, by metrics stage
+SERVER_TIMING_STAGES = {'queue': 'queue_wait', 'decode': 'decode', 'convert': 'convert', 'send': 'send'}
+
+# Glass-to-glass latency: publishers sync to our clock with /clock and report each frame's capture time
+MAX_CAPTURE_AGE = 60  # Capture times further than this many seconds from now are ignored as a failed sync
+
+# Server-side rate control: recommended quality/FPS/capture scale in every reply
+RATE_CONTROL_WINDOW = 0.25  # Seconds of arrivals per controller decision
+
+# Sessions: one per phone, each with its own virtual camera
+MAX_SESSIONS = 8  # Phones streaming at once
+DEFAULT_SESSION = 'default'  # Shared by publishers that don't negotiate a session
+SESSION_IDLE_TIMEOUT = 30  # Close the session (and its camera) of a phone silent this long
+VIRTUAL_CAMERA_DEVICES = ()  # Camera device per session slot, e.g. ('/dev/video0', '/dev/video1');
+                             # slots without one let the backend pick a free camera
+
+# Shared-memory frame bus: decoded frames for other local processes (recorders, analysis, previews)
+FRAME_BUS_ENABLED = True
+FRAME_BUS_NAME = 'iphone_webcam'  # Session slot N publishes to '<name>_<N>'; read with framebus.FrameBusReader
+FRAME_BUS_SLOTS = 4  # Frames in each ring; a reader sees a frame until the writer laps it
+
+# JPEG passthrough restream: /stream.mjpg, /snapshot.jpg and /latest serve the phone's own JPEG bytes
+RESTREAM_ENABLED = True
+MAX_STREAM_VIEWERS = 8  # Concurrent /stream.mjpg viewers per session; each one holds a server thread
+LONG_POLL_TIMEOUT = 10  # Longest a /latest request waits for a new frame before answering 204
+
+# Passthrough recording: the uploaded JPEGs go into Matroska files as they are, without re-encoding
+RECORD_SESSIONS = False  # Record every session from the start; otherwise use POST /record
+RECORDING_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'recordings')
+RECORDING_SEGMENT_BYTES = 1 << 30  # Start a new file after this many bytes ...
+RECORDING_SEGMENT_SECONDS = 15 * 60  # ... or this much video
+RECORDING_QUEUE_FRAMES = 90  # Frames waiting for the disk beyond this are left out of the recording
+RECORDING_BUFFER_SIZE = 4 << 20  # Write buffer per recording file
+
+# Ingest capture: every received frame body is appended to a file that replay.py can play back
+CAPTURE_INGEST = False
+CAPTURE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'captures')
+CAPTURE_HEADERS = ('Content-Type', 'Content-Encoding', 'Content-Length', 'X-Max-FPS', 'X-Capture-Time')  # Kept with each frame
+
+# Prefork ingest: worker processes take the uploads, decoded frames come back through shared memory
+PREFORK_WORKERS = 0  # 0 handles everything in this process; N starts N ingest workers on the next N ports
+WORKER_REPORT_INTERVAL = 1.0  # Seconds between worker load reports
+
+# Admission control: uploads beyond these limits are shed with 429/503 and Retry-After
+MAX_UPLOADS_PER_PUBLISHER = 2  # Concurrent uploads from one phone
+MAX_UPLOADS_IN_FLIGHT = 8  # Concurrent uploads overall
+MAX_BACKLOG_DELAY = 0.25  # Seconds of queued decode work beyond which new frames are refused
+MAX_FRAME_AGE = 0.5  # Frames that waited longer than this for a decoder are dropped
+OUTPUT_WIDTH = 1280  # The virtual camera is opened once at this resolution;
+OUTPUT_HEIGHT = 720  # incoming frames of other sizes are scaled to fit
+OUTPUT_LETTERBOX = True  # Keep aspect ratio with black bars instead of stretching
+SCALE_INTERPOLATION = 'fast'  # 'fast' (bilinear) or 'quality' (area/bicubic)
+OUTPUT_PIXEL_FORMAT = 'rgb'  # 'rgb', or 'i420'/'nv12' to decode JPEGs straight to planar YUV
+CAMERA_PIXEL_FORMATS = {
+    'i420': pyvirtualcam.PixelFormat.I420,
+    'nv12': pyvirtualcam.PixelFormat.NV12,
+}
 
 def create_self_signed_cert():
     """Create a self-signed certificate for HTTPS"""
@@ -268,16 +371,23 @@ def start_obs_virtual_camera():
         print(f"Error starting OBS virtual camera: {e}")
     return False
 
-def init_virtual_camera(width, height):
-    """Initialize or reinitialize the virtual camera"""
-    global virtual_cam, last_shape
+def open_camera(width, height, device=None, **kwargs):
+    """Open a pyvirtualcam camera in the configured pixel format, falling back to RGB"""
+    if device is not None:
+        kwargs['device'] = device
+    if OUTPUT_PIXEL_FORMAT != 'rgb':
+        try:
+            return pyvirtualcam.Camera(width=width, height=height, fps=OUTPUT_FPS,
+                                       fmt=CAMERA_PIXEL_FORMATS[OUTPUT_PIXEL_FORMAT], **kwargs)
+        except Exception as e:
+            print(f"{OUTPUT_PIXEL_FORMAT.upper()} output not supported ({e}), falling back to RGB")
+    return pyvirtualcam.Camera(width=width, height=height, fps=OUTPUT_FPS, **kwargs)
+
+def init_virtual_camera(session, width, height):
+    """Initialize or reinitialize the virtual camera of a session"""
+    virtual_cam = None
     try:
-        if virtual_cam is not None:
-            try:
-                virtual_cam.close()
-            except:
-                pass
-            virtual_cam = None
+        session.close_camera()
 
         # Try different virtual camera backends on Windows
         if platform.system() == 'Windows':
@@ -289,7 +399,7 @@ def init_virtual_camera(width, height):
             for backend in backends:
                 try:
                     print(f"Trying virtual camera with backend: {backend}")
-                    virtual_cam = pyvirtualcam.Camera(width=width, height=height, fps=30, backend=backend)
+                    virtual_cam = open_camera(width, height, device=session.device, backend=backend)
                     print(f"Successfully initialized virtual camera using {backend} backend")
                     break
                 except Exception as e:
@@ -299,107 +409,816 @@ def init_virtual_camera(width, height):
             if virtual_cam is None:
                 raise Exception("No working virtual camera backend found")
         else:
-            virtual_cam = pyvirtualcam.Camera(width=width, height=height, fps=30)
+            virtual_cam = open_camera(width, height, device=session.device)
             
-        last_shape = (width, height)
-        print(f"Virtual camera initialized at {width}x{height}")
+        session.virtual_cam = virtual_cam
+        session.last_shape = (width, height)
+        print(f"Virtual camera {virtual_cam.device} initialized at {width}x{height} ({virtual_cam.fmt.name}) "
+              f"for session {session.id}")
+        metrics.inc('camera_inits', result='ok')
         return True
     except Exception as e:
         print(f"Failed to initialize virtual camera: {e}")
+        metrics.inc('camera_inits', result='failed')
         print("\nPlease ensure that:")
         print("1. OBS Studio is installed")
         print("2. You've started OBS at least once")
         print("3. OBS Virtual Camera is installed (Tools -> Virtual Camera -> Start)")
-        virtual_cam = None
         return False
 
 @app.after_request
 def add_cors_headers(response):
     response.headers['Access-Control-Allow-Origin'] = '*'
     response.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Content-Encoding'
+    response.headers['Access-Control-Allow-Headers'] = ('Content-Type, Content-Encoding, X-Max-FPS, X-Session-Id, '
+                                                        'X-Capture-Time')
+    response.headers['Access-Control-Expose-Headers'] = ('Server-Timing, X-Frame-Seq, X-Rate-Recommendation, '
+                                                         'X-Capture-Latency, X-Frame-Timestamp, Retry-After, '
+                                                         'X-Retry-After-Ms')
+    response.headers['Timing-Allow-Origin'] = '*'
     if ENABLE_COMPRESSION:
-        response.headers['Accept-Encoding'] = 'gzip, deflate'
+        response.headers['Accept-Encoding'] = ', '.join(supported_encodings())
     return response
 
 @app.route('/upload', methods=['POST', 'OPTIONS'])
 def upload():
-    global frame, virtual_cam, last_shape
     if request.method == 'OPTIONS':
         resp = make_response('', 204)
         resp.headers['Access-Control-Allow-Origin'] = '*'
         resp.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
-        resp.headers['Access-Control-Allow-Headers'] = 'Content-Type, Content-Encoding'
+        resp.headers['Access-Control-Allow-Headers'] = ('Content-Type, Content-Encoding, X-Max-FPS, X-Session-Id, '
+                                                    'X-Capture-Time')
         return resp
 
-    img_bytes = request.data
-    if not img_bytes:
-        return ('No image data', 400)
+    try:
+        session = find_session(request.headers.get('X-Session-Id'))
+    except ValueError as e:
+        return (str(e), 400)
+    if session is None:
+        return session_refused()
 
-    # Check if data is compressed
-    if request.headers.get('Content-Encoding') == 'gzip':
-        try:
-            img_bytes = gzip.decompress(img_bytes)
-        except Exception as e:
-            print(f"Failed to decompress gzipped data: {e}")
-            return ('Invalid compressed data', 400)
+    # Refuse before reading the body when this session or the server is saturated
+    rejection = admission.enter(session.id, pipeline.backlog_delay())
+    if rejection is not None:
+        metrics.inc('frames_shed', reason=rejection.reason)
+        return (rejection.message, rejection.status, rejection.headers())
+
+    started = time.perf_counter()
+    max_fps = request.headers.get('X-Max-FPS', type=int)
+    if max_fps:
+        session.controller.set_max_fps(max_fps)
+    try:
+        img_bytes, buf = read_upload(session)
+        received = time.perf_counter()
+        message, status, headers = process_frame(img_bytes, buffer=buf, session=session,
+                                                 capture_time=capture_time_from(request.headers.get('X-Capture-Time')))
+    except IngestError as e:
+        received = time.perf_counter()
+        metrics.inc('frames_rejected', reason=INGEST_REJECT_REASONS.get(e.status, 'invalid_body'))
+        message, status, headers = e.message, e.status, {}
+    finally:
+        admission.leave(session.id)
+    finished = time.perf_counter()
+    metrics.observe('receive', received - started)
+    metrics.observe('request', finished - started)
+
+    # Let the client tell network time apart from time spent in here
+    headers['Server-Timing'] = server_timing(recv=received - started, app=finished - received)
+    return (message, status, headers)
+
+def find_session(session_id):
+    """The session a frame belongs to.
+
+    A prefork worker only knows the sessions the dispatcher pinned to it;
+    otherwise an unknown id (e.g. from before a restart) is opened again.
+    Raises ValueError for an id that /session could never have handed out.
+    """
+    if session_id and not SESSION_ID.fullmatch(session_id):
+        raise ValueError('Malformed session id')
+    if worker is not None:
+        return sessions.get(session_id)
+    return sessions.open(session_id or DEFAULT_SESSION)
+
+def session_refused():
+    if worker is not None:
+        # Expired or pinned elsewhere; the phone negotiates again with the dispatcher
+        return ('Unknown session', 409, {})
+    metrics.inc('frames_shed', reason='sessions_full')
+    return ('All session slots are taken', 503, {'Retry-After': str(SESSION_IDLE_TIMEOUT)})
+
+@app.route('/clock')
+def clock():
+    """NTP-style clock sync: when this request arrived and when its reply left, in ms since the epoch.
+
+    A publisher that sent the request at ``t0`` and got the reply at ``t3`` by
+    its own clock is ``((receive - t0) + (transmit - t3)) / 2`` behind us, to
+    within half the round trip ``(t3 - t0) - (transmit - receive)``; the
+    sample with the shortest round trip is the most accurate.
+    """
+    receive = time.time() * 1000
+    reply = jsonify({'receive': receive, 'transmit': time.time() * 1000})
+    reply.headers['Cache-Control'] = 'no-store'
+    return reply
+
+def capture_time_from(value):
+    """A publisher's capture time in ms since the epoch (our clock) as seconds, or None if unusable"""
+    try:
+        seconds = float(value) / 1000
+    except (TypeError, ValueError):
+        return None
+    # NaN fails this too
+    if not abs(time.time() - seconds) <= MAX_CAPTURE_AGE:
+        return None
+    return seconds
+
+@app.route('/session', methods=['POST'])
+def open_session():
+    """Negotiate a session: ``{"resume": id}`` keeps a previous one alive if it still exists.
+
+    In prefork mode the reply names the worker the phone must stream to in ``ingest``.
+    """
+    if worker is not None:
+        return ('Sessions are negotiated with the main server', 404)
+    body = request.get_json(silent=True) or {}
+    resume = body.get('resume')
+    # A resume id that doesn't look like ours just gets a new session
+    session = sessions.open(resume if isinstance(resume, str) and SESSION_ID.fullmatch(resume) else None)
+    if session is None:
+        return (jsonify({'error': 'All session slots are taken'}), 503,
+                {'Retry-After': str(SESSION_IDLE_TIMEOUT)})
+    reply = {'session': session.id, 'slot': session.slot, 'camera': session.camera_name}
+    if session.worker is not None:
+        reply['ingest'] = worker_url(session.worker)
+    return jsonify(reply)
+
+def worker_url(index):
+    """Base URL of a prefork worker, on the host the current request was addressed to"""
+    host = urlsplit(request.host_url).hostname
+    host = f"[{host}]" if ':' in host else host
+    return f"{request.scheme}://{host}:{dispatcher.ports[index]}"
+
+def read_upload(session):
+    """Read the upload body into a recycled buffer and return ``(view, buffer)``.
+
+    Compressed bodies are inflated incrementally and cut off at
+    MAX_FRAME_SIZE. Raises IngestError for bodies that can't be accepted.
+    The body is captured as it was sent, rejected or not.
+    """
+    stream = request.stream if capture is None else TeeStream(request.stream)
+    buf = body_buffers.acquire()
+    try:
+        length = read_body(stream, buf, MAX_FRAME_SIZE,
+                           content_length=request.content_length,
+                           encoding=request.headers.get('Content-Encoding'))
+    except IngestError as e:
+        body_buffers.release(buf)
+        print(f"Rejected upload: {e.message}")
+        raise
+    except Exception as e:
+        body_buffers.release(buf)
+        print(f"Failed to read upload body: {e}")
+        raise IngestError('Invalid request body', 400)
+    finally:
+        if stream is not request.stream:
+            capture_frame(session, stream.data, 'http')
+    return memoryview(buf)[:length], buf
+
+def server_timing(**durations):
+    """Format durations in seconds as a Server-Timing header value.
+
+    ``app`` is the time this request spent in the server after its body was
+    read; the remaining entries come from the most recent frame that made
+    it through the pipeline, since decode and output run after the reply.
+    """
+    entries = dict(durations)
+    for name, stage in SERVER_TIMING_STAGES.items():
+        last = metrics.last(stage)
+        if last is not None:
+            entries[name] = last
+    return ', '.join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in entries.items())
+
+@sock.route('/ws')
+def ws_ingest(ws):
+    """Persistent binary ingest: each message carries one or more length-prefixed frames.
+
+    Every frame is acknowledged with a small JSON text message so the client
+    can keep a bounded number of frames in flight and measure round trips.
+    With ``?timestamps=1`` every length is followed by the frame's capture time.
+    """
+    # Keyed like HTTP uploads so a publisher keeps its session across a fallback
+    try:
+        session = find_session(request.args.get('session'))
+    except ValueError as e:
+        # 1008 makes the client negotiate a proper session
+        ws.send(json.dumps({'status': 400, 'error': str(e)}))
+        ws.close(reason=1008, message=str(e))
+        return
+    if session is None:
+        # 1008 makes the client negotiate again, 1013 to retry later
+        ws.close(reason=1008 if worker is not None else 1013, message=session_refused()[0])
+        return
+    print(f"[WebSocket] Publisher connected (session {session.id})")
+    controller = session.controller
+    timed = request.args.get('timestamps') == '1'
+    try:
+        while True:
+            data = ws.receive()
+            if data is None:
+                continue
+            if isinstance(data, str):
+                # Text messages carry control traffic, e.g. {"max_fps": 30}
+                handle_control_message(data, controller)
+                continue
+            try:
+                frames = list(split_frames(data, timed))
+            except ValueError as e:
+                ws.send(json.dumps({'status': 400, 'error': str(e)}))
+                continue
+            for img_bytes, capture_ms in frames:
+                rejection = admission.enter(session.id, pipeline.backlog_delay())
+                if rejection is not None:
+                    metrics.inc('frames_shed', reason=rejection.reason)
+                    ws.send(json.dumps({'status': rejection.status, 'error': rejection.message,
+                                        'retry_after_ms': int(rejection.retry_after * 1000)}))
+                    continue
+                capture_frame(session, img_bytes, 'ws', capture_ms)
+                started = time.perf_counter()
+                try:
+                    message, status, headers = process_frame(img_bytes, session=session,
+                                                             capture_time=capture_time_from(capture_ms))
+                finally:
+                    admission.leave(session.id)
+                ack = {'status': status, 'server_ms': round((time.perf_counter() - started) * 1000, 2)}
+                if 'X-Frame-Seq' in headers:
+                    ack['seq'] = int(headers['X-Frame-Seq'])
+                    ack['recommend'] = controller.recommendation()
+                    latency = pipeline.capture_latency(session.id)
+                    if latency is not None:
+                        ack['latency'] = latency
+                if message:
+                    ack['error'] = message
+                ws.send(json.dumps(ack))
+    except ConnectionClosed:
+        pass
+    print(f"[WebSocket] Publisher disconnected (session {session.id})")
+
+def capture_frame(session, body, transport, capture_ms=None):
+    """Append a frame body, as it came off the wire, to the ingest capture if one is being written.
+
+    Both transports capture the frames admission control let in, so frames
+    shed with 429/503 are not in the capture. A WebSocket frame's capture
+    time is kept as the X-Capture-Time header an upload would have sent.
+    """
+    if capture is None:
+        return
+    headers = {name: request.headers[name] for name in CAPTURE_HEADERS if name in request.headers}
+    headers['transport'] = transport
+    if capture_ms is not None:
+        headers['X-Capture-Time'] = repr(capture_ms)
+    capture.write(session.id, headers, bytes(body))
+
+def start_capture(name='ingest'):
+    """Start writing the ingest capture to CAPTURE_DIR"""
+    global capture
+    os.makedirs(CAPTURE_DIR, exist_ok=True)
+    path = os.path.join(CAPTURE_DIR, f"{name}_{datetime.now().strftime('%Y%m%d-%H%M%S')}.ipwc")
+    capture = CaptureWriter(path)
+    print(f"⚙️  Capturing ingest to {path}")
+
+def handle_control_message(text, controller):
+    """Apply a JSON control message from a WebSocket publisher"""
+    try:
+        message = json.loads(text)
+    except ValueError:
+        return
+    if isinstance(message, dict) and isinstance(message.get('max_fps'), int) and message['max_fps'] > 0:
+        controller.set_max_fps(message['max_fps'])
 
+def split_frames(data, timed=False):
+    """Yield ``(frame, capture_ms)`` for the frames of a length-prefixed WebSocket message.
+
+    Frames are memoryviews; ``capture_ms`` is None unless the headers are ``timed``.
+    """
+    header = TIMED_FRAME_HEADER if timed else FRAME_HEADER
+    view = memoryview(data)
+    offset = 0
+    while offset < len(view):
+        if offset + header.size > len(view):
+            raise ValueError('Truncated frame header')
+        length, *capture_ms = header.unpack_from(view, offset)
+        offset += header.size
+        if offset + length > len(view):
+            raise ValueError('Truncated frame payload')
+        yield view[offset:offset + length], capture_ms[0] if capture_ms else None
+        offset += length
+
+def process_frame(img_bytes, session, buffer=None, capture_time=None):
+    """Validate one compressed frame of a session and queue it for decoding.
+
+    Shared by the HTTP and WebSocket ingest routes. Returns a
+    ``(message, status, headers)`` tuple in the same shape Flask views
+    return, with the frame's sequence number in ``X-Frame-Seq``, the
+    session's rate recommendation in ``X-Rate-Recommendation`` and, once
+    frames with a capture time have reached its camera, their recent capture
+    to output latency in ``X-Capture-Latency``; decode and virtual camera
+    errors happen later and are reported by ``/stats``.
+    ``buffer`` is the pooled body buffer ``img_bytes`` points into, if any.
+    ``capture_time`` is when the publisher captured the frame, in our clock.
+    A newer frame from the same session replaces this one if it is still
+    waiting for a decoder.
+    """
     # Limit frame size for network efficiency
     if len(img_bytes) > MAX_FRAME_SIZE:
         print(f"Frame too large: {len(img_bytes)} bytes, max: {MAX_FRAME_SIZE}")
-        return ('Frame too large', 413)
+        body_buffers.release(buffer)
+        metrics.inc('frames_rejected', reason='oversize')
+        return ('Frame too large', 413, {})
+
+    if len(img_bytes) == 0:
+        body_buffers.release(buffer)
+        metrics.inc('frames_rejected', reason='empty')
+        return ('Empty image buffer', 400, {})
+
+    # A few hundred bytes can declare a 65535x65535 image; refuse that before a decoder sizes buffers for it
+    if not decodable_size(frame_size(img_bytes)):
+        body_buffers.release(buffer)
+        metrics.inc('frames_rejected', reason='dimensions')
+        return ('Frame dimensions too large', 413, {})
+
+    size = len(img_bytes)
+    # Copied out before the pooled body buffer can go back to the pool
+    passthrough = bytes(img_bytes) if sniff_format(img_bytes) == 'jpeg' else None
+    timestamp = time.time()
+    if capture_time is not None:
+        metrics.observe('capture_to_received', timestamp - capture_time)
+    seq = pipeline.submit(img_bytes, buffer=buffer, publisher=session.id, timestamp=timestamp,
+                          capture_time=capture_time)
+    metrics.inc('frames_accepted')
+    if passthrough is not None:
+        session.store.publish(passthrough, seq, timestamp)
+        recorder = session.recorder
+        if recorder is not None:
+            recorder.write(passthrough, timestamp)
+    now = time.monotonic()
+    session.touch(size, now)
+    # Budget decode time against this session's share of the decoders
+    session.controller.decode_capacity = DECODE_WORKERS / max(1, len(sessions))
+    # Only this publisher's own drops and decodes, so one congested phone doesn't slow down the others
+    dropped, decode_time = pipeline.publisher_load(session.id)
+    session.controller.on_frame(size, now, dropped=dropped, decode_time=decode_time)
+    headers = {
+        'X-Frame-Seq': str(seq),
+        'X-Rate-Recommendation': format_recommendation(session.controller.recommendation()),
+    }
+    latency = pipeline.capture_latency(session.id)
+    if latency is not None:
+        headers['X-Capture-Latency'] = ', '.join(f"{name}={value}" for name, value in latency.items())
+    return ('', 204, headers)
+
+def decodable_size(size):
+    """Whether header dimensions ``(width, height)``, or None if unknown, are within MAX_DECODE_PIXELS"""
+    return size is None or size[0] * size[1] <= MAX_DECODE_PIXELS
+
+def decode_frame(img_bytes):
+    """Decode compressed frame bytes at the output resolution (runs on the decoder pool).
 
-    img_np = np.frombuffer(img_bytes, dtype=np.uint8)
-    if img_np.size == 0:
-        return ('Empty image buffer', 400)
+    Returns a BGR image, or a planar I420/NV12 frame when OUTPUT_PIXEL_FORMAT asks for YUV.
+    """
+    size = frame_size(img_bytes)
+    if not decodable_size(size):
+        return None
+    if yuv_decoder is not None:
+        return yuv_decoder.decode(img_bytes)
+
+    # Peek at the header so the decode can be reduced and land in a pooled buffer
+    scale = 1
+    dst = None
+    if size is not None:
+        plan = scaler.plan(*size)
+        if sniff_format(img_bytes) == 'jpeg':
+            # Decode large JPEGs at 1/2, 1/4 or 1/8 scale when the output is that much smaller
+            scale = reduction_factor(size[0], size[1], plan.width, plan.height)
+        if decoders.decodes_into(img_bytes):
+            dst = frame_pool.acquire((-(-size[1] // scale), -(-size[0] // scale), 3))
 
-    img = cv2.imdecode(img_np, cv2.IMREAD_COLOR)
+    img = decoders.decode(img_bytes, dst=dst, scale=scale)
+    if img is not dst:
+        frame_pool.release(dst)
     if img is None:
-        return ('Failed to decode image', 400)
+        return None
+    if img.shape[:2] == (OUTPUT_HEIGHT, OUTPUT_WIDTH):
+        return img
+
+    with metrics.time('scale'):
+        out = scaler.scale(img, out=frame_pool.acquire((OUTPUT_HEIGHT, OUTPUT_WIDTH, 3)))
+    if img is dst:
+        frame_pool.release(dst)
+    return out
 
-    frame = img
+def output_frame(session, job, repeat=False):
+    """Send a decoded frame to a session's virtual camera (runs on its pipeline output thread)"""
+    frame = job.image
+    if not repeat:
+        session.store.publish(frame, job.seq, job.timestamp, decoded=True)
+        if session.bus is not None:
+            with metrics.time('bus'):
+                session.bus.publish(frame, 'bgr' if yuv_decoder is None else OUTPUT_PIXEL_FORMAT, job.timestamp)
     
     # If not running in Docker, update virtual camera
-    if not os.path.exists('/.dockerenv'):
+    if not VIRTUAL_CAMERA_ENABLED or RUNNING_IN_DOCKER:
+        return
+
+    if yuv_decoder is None:
         height, width = frame.shape[:2]
-        
-        # Initialize or reinitialize camera if needed
-        if virtual_cam is None or last_shape != (width, height):
-            if not init_virtual_camera(width, height):
-                # If initialization failed, try starting OBS Virtual Camera and retry
-                print("\nRetrying with OBS Virtual Camera...")
-                if start_obs_virtual_camera():
-                    time.sleep(2)  # Give it time to start
-                    if not init_virtual_camera(width, height):
-                        print("\nVirtual camera initialization failed. Please:")
-                        print("1. Open OBS Studio")
-                        print("2. Go to Tools -> Virtual Camera")
-                        print("3. Click 'Start'")
-                        print("4. Restart this application")
-                        return ('Failed to initialize virtual camera', 500)
-                else:
-                    print("\nCouldn't start OBS Virtual Camera automatically.")
-                    print("Please start it manually:")
+    else:
+        width, height = frame.shape[1], frame.shape[0] * 2 // 3
+    
+    # Frames are already scaled to the output resolution, so this only
+    # happens on start-up or after the camera was lost
+    if session.virtual_cam is None or session.last_shape != (width, height):
+        # The output clock calls us every tick; don't hammer a camera that just failed
+        if time.monotonic() < session.camera_retry_at:
+            session.frame_out = None
+            return
+        if not init_virtual_camera(session, width, height):
+            # If initialization failed, try starting OBS Virtual Camera and retry
+            print("\nRetrying with OBS Virtual Camera...")
+            if start_obs_virtual_camera():
+                time.sleep(2)  # Give it time to start
+                if not init_virtual_camera(session, width, height):
+                    print("\nVirtual camera initialization failed. Please:")
                     print("1. Open OBS Studio")
                     print("2. Go to Tools -> Virtual Camera")
                     print("3. Click 'Start'")
-                    return ('Failed to initialize virtual camera', 500)
-        
+                    print("4. Restart this application")
+                    session.camera_retry_at = time.monotonic() + CAMERA_RETRY_INTERVAL
+                    raise RuntimeError('Failed to initialize virtual camera')
+            else:
+                print("\nCouldn't start OBS Virtual Camera automatically.")
+                print("Please start it manually:")
+                print("1. Open OBS Studio")
+                print("2. Go to Tools -> Virtual Camera")
+                print("3. Click 'Start'")
+                session.camera_retry_at = time.monotonic() + CAMERA_RETRY_INTERVAL
+                raise RuntimeError('Failed to initialize virtual camera')
+    
+    try:
+        # Convert to the camera's pixel format; repeats reuse the last conversion
+        if not repeat or session.frame_out is None:
+            with metrics.time('convert'):
+                if yuv_decoder is None:
+                    # Reuse one RGB buffer for the lifetime of the camera
+                    if session.frame_out is None or session.frame_out.shape != frame.shape:
+                        session.frame_out = frame_pool.acquire(frame.shape)
+                    cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=session.frame_out)
+                elif session.virtual_cam.fmt == pyvirtualcam.PixelFormat.RGB:
+                    # The backend refused YUV input
+                    session.frame_out = yuv_to_rgb(frame, OUTPUT_PIXEL_FORMAT)
+                else:
+                    session.frame_out = frame
+        # Pacing is done by the pipeline's output clock, not sleep_until_next_frame()
+        with metrics.time('send'):
+            session.virtual_cam.send(session.frame_out)
+    except Exception as e:
+        print(f"\nError sending frame to virtual camera: {e}")
+        print("\nVirtual camera connection lost. Please:")
+        print("1. Open OBS Studio")
+        print("2. Go to Tools -> Virtual Camera")
+        print("3. Click 'Stop' then 'Start'")
+        session.virtual_cam = None
+        raise
+
+metrics = MetricsRegistry('iphone_webcam')
+decoders = DecoderSet()
+frame_pool = FramePool()
+body_buffers = BodyBufferPool(MAX_FRAME_SIZE, max_free=INGEST_QUEUE_SIZE + DECODE_WORKERS + 2)
+scaler = FrameScaler(OUTPUT_WIDTH, OUTPUT_HEIGHT, letterbox=OUTPUT_LETTERBOX,
+                     interpolation=SCALE_INTERPOLATION)
+yuv_decoder = YuvDecoder(scaler, OUTPUT_PIXEL_FORMAT, pool=frame_pool) if OUTPUT_PIXEL_FORMAT != 'rgb' else None
+pipeline = FramePipeline(decode_frame,
+                         decode_workers=DECODE_WORKERS, queue_size=INGEST_QUEUE_SIZE,
+                         fps=OUTPUT_FPS, low_latency=LOW_LATENCY_OUTPUT,
+                         release=frame_pool.release, release_input=body_buffers.release,
+                         observe=metrics.observe, max_age=MAX_FRAME_AGE,
+                         jitter_buffer=JITTER_BUFFER_MAX_DELAY or None)
+admission = AdmissionControl(per_publisher=MAX_UPLOADS_PER_PUBLISHER, total=MAX_UPLOADS_IN_FLIGHT,
+                             max_backlog_delay=MAX_BACKLOG_DELAY)
+
+def collect_pipeline_metrics():
+    """Pipeline, pool and decoder state for /metrics"""
+    stats = pipeline.stats()
+    samples = [(f"pipeline_{name}_total", 'counter', f"Frame pipeline counter '{name}'", stats[name])
+               for name in pipeline.counters]
+    samples += [
+        ('ingest_dropped_total', 'counter', 'Frames dropped from the ingest queue', stats['ingest_dropped']),
+        ('ingest_superseded_total', 'counter', 'Queued frames replaced by a newer frame from the same publisher',
+         stats['ingest_superseded']),
+        ('admission_in_flight', 'gauge', 'Uploads currently admitted', admission.stats()['admission_in_flight']),
+        ('decoded_dropped_total', 'counter', 'Decoded frames replaced before output', stats['decoded_dropped']),
+        ('late_total', 'counter', 'Decoded frames dropped for missing their playout time', stats['late']),
+        ('ingest_depth', 'gauge', 'Frames waiting for a decoder', stats['ingest_depth']),
+        ('decoded_depth', 'gauge', 'Decoded frames waiting for output', stats['decoded_depth']),
+        ('decoder_reduced_total', 'counter', 'Frames decoded at reduced DCT scale', sum(decoders.reduced.values())),
+        ('frame_pool_resident_bytes', 'gauge', 'Bytes held by idle pooled frame buffers',
+         frame_pool.stats()['pool_resident_bytes']),
+        ('sessions_open', 'gauge', 'Publisher sessions currently open', len(sessions)),
+        ('cameras_up', 'gauge', 'Virtual cameras currently open',
+         sum(s.virtual_cam is not None for s in sessions.sessions())),
+    ]
+    if dispatcher is not None:
+        samples.append(('prefork_workers_alive', 'gauge', 'Prefork ingest worker processes running',
+                        sum(w['alive'] for w in dispatcher.stats()['workers'])))
+    return samples
+
+metrics.add_collector(collect_pipeline_metrics)
+
+def start_session(session):
+    """Give a new session its own paced output stage and, in prefork mode, pin it to a worker"""
+    if RESTREAM_ENABLED:
+        session.restream = Broadcaster(session.store, max_viewers=MAX_STREAM_VIEWERS)
+    if worker is not None:
+        # The dispatcher owns the cameras; decoded frames go back to it
+        pipeline.add_output(session.id, lambda job, repeat: publish_frame(session, job, repeat))
+        if RECORD_SESSIONS:
+            start_recording(session)
+        return
+    if FRAME_BUS_ENABLED:
         try:
-            # Convert BGR to RGB for pyvirtualcam
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            virtual_cam.send(frame_rgb)
-            virtual_cam.sleep_until_next_frame()
+            session.bus = FrameBus(f"{FRAME_BUS_NAME}_{session.slot}", OUTPUT_WIDTH * OUTPUT_HEIGHT * 3,
+                                   slots=FRAME_BUS_SLOTS)
         except Exception as e:
-            print(f"\nError sending frame to virtual camera: {e}")
-            print("\nVirtual camera connection lost. Please:")
-            print("1. Open OBS Studio")
-            print("2. Go to Tools -> Virtual Camera")
-            print("3. Click 'Stop' then 'Start'")
-            virtual_cam = None
-            return ('Virtual camera error', 500)
-    
-    return ('', 204)
+            print(f"[Warning] Could not create frame bus for session {session.id}: {e}")
+    pipeline.add_output(session.id, lambda job, repeat: output_frame(session, job, repeat))
+    if dispatcher is not None and session.id != DEFAULT_SESSION:
+        # Skip whatever the slot's previous session left behind
+        session.worker_seq = dispatcher.frames.latest(session.slot)
+        session.worker = dispatcher.open(session.id, session.slot)
+    if RECORD_SESSIONS and session.worker is None:
+        # Sessions pinned to a prefork worker are recorded there, where their JPEGs arrive
+        start_recording(session)
+
+def end_session(session):
+    """Stop a closed session's output stage, then its camera"""
+    pipeline.remove_output(session.id)
+    session.store.close()  # Ends its viewers' streams and long polls
+    stop_recording(session)
+    if session.worker is not None:
+        dispatcher.close(session.id)
+    if session.bus is not None:
+        session.bus.close()
+        session.bus = None
+    session.close_camera()
+    if yuv_decoder is None:
+        frame_pool.release(session.frame_out)
+    session.frame_out = None
+
+sessions = SessionRegistry(
+    lambda: RateController(max_fps=OUTPUT_FPS, window=RATE_CONTROL_WINDOW, decode_capacity=DECODE_WORKERS),
+    max_sessions=MAX_SESSIONS, devices=VIRTUAL_CAMERA_DEVICES, idle_timeout=SESSION_IDLE_TIMEOUT,
+    on_open=start_session, on_close=end_session, frame_pool=frame_pool)
+
+@app.route('/stats')
+def stats():
+    """Pipeline queue depths and drop counters"""
+    stats = {**pipeline.stats(), **scaler.stats(), **frame_pool.stats(),
+             **body_buffers.stats(), 'decoders': decoders.stats(), 'latency': metrics.stage_summary(),
+             **admission.stats(), **sessions.stats(), 'sessions': session_stats()}
+    if dispatcher is not None:
+        stats.update(dispatcher.stats())
+    if capture is not None:
+        stats['capture'] = capture.stats()
+    if yuv_decoder is not None:
+        stats.update(yuv_decoder.stats())
+    else:
+        stats['pixel_format'] = 'rgb'
+    return jsonify(stats)
+
+@app.route('/stream.mjpg')
+def stream_mjpeg():
+    """The session's uploaded JPEGs as an MJPEG stream, e.g. /stream.mjpg?slot=1"""
+    session, error = viewed_session()
+    if session is None:
+        return error
+    body = session.restream.stream()
+    if body is None:
+        return ('Too many viewers', 503, {'Retry-After': '5'})
+    return Response(body, mimetype=f'multipart/x-mixed-replace; boundary={BOUNDARY}',
+                    headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
+
+@app.route('/snapshot.jpg')
+def snapshot():
+    """The session's newest uploaded JPEG, byte for byte"""
+    session, error = viewed_session()
+    if session is None:
+        return error
+    frame = session.store.latest()
+    if frame is None:
+        return ('No JPEG frame received yet', 404)
+    return jpeg_response(frame)
+
+@app.route('/latest')
+def latest_frame():
+    """Long poll: the session's newest JPEG once its sequence number is above ``?after=N``.
+
+    Answers at once when there already is one, else as soon as it arrives,
+    or with 204 after ``?timeout=`` (at most LONG_POLL_TIMEOUT) seconds.
+    Pass the returned X-Frame-Seq as ``after`` to get the frame after it.
+    """
+    session, error = viewed_session()
+    if session is None:
+        return error
+    after = request.args.get('after', 0, type=int)
+    timeout = min(request.args.get('timeout', LONG_POLL_TIMEOUT, type=float), LONG_POLL_TIMEOUT)
+    try:
+        frame = session.store.wait(after=after, timeout=max(0.0, timeout))
+    except EOFError:
+        return ('Session closed', 410)
+    if frame is None:
+        return ('', 204, {'X-Frame-Seq': str(after)})
+    return jpeg_response(frame)
+
+def jpeg_response(frame):
+    return Response(frame.data, mimetype='image/jpeg',
+                    headers={'Cache-Control': 'no-store', 'X-Frame-Seq': str(frame.seq),
+                             'X-Frame-Timestamp': f"{frame.timestamp:.6f}"})
+
+def viewed_session():
+    """The session a restream viewer asked for; see ``requested_session``"""
+    if not RESTREAM_ENABLED:
+        return None, ('Restreaming is disabled', 404)
+    return requested_session()
+
+def requested_session():
+    """The session named by ``?session=`` or ``?slot=``, default the lowest slot.
+
+    Returns ``(session, None)``, or ``(None, response)`` to send instead. In
+    prefork mode a session's uploads only reach its worker, so the request
+    is redirected there.
+    """
+    if 'session' in request.args:
+        session = sessions.get(request.args['session'])
+    elif 'slot' in request.args:
+        session = sessions.by_slot(request.args.get('slot', type=int))
+    else:
+        session = min(sessions.sessions(), key=lambda s: s.slot, default=None)
+    if session is None:
+        return None, ('No such session', 404)
+    if session.worker is not None:
+        query = {k: v for k, v in request.args.items() if k not in ('session', 'slot')}
+        query['session'] = session.id
+        return None, redirect(f"{worker_url(session.worker)}{request.path}?{urlencode(query)}", 307)
+    return session, None
+
+@app.route('/record', methods=['POST'])
+def record():
+    """Start (``{"enabled": true}``) or stop recording a session picked like ``/latest``'s"""
+    session, error = requested_session()
+    if session is None:
+        return error
+    body = request.get_json(silent=True) or {}
+    if body.get('enabled', True):
+        start_recording(session)
+    else:
+        stop_recording(session)
+    recorder = session.recorder
+    return jsonify({'session': session.id, 'recording': recorder is not None,
+                    **({'directory': recorder.directory} if recorder is not None else {})})
+
+def start_recording(session):
+    if session.recorder is None:
+        session.recorder = Recorder(RECORDING_DIR, f"session{session.slot}_{session.id}",
+                                    segment_bytes=RECORDING_SEGMENT_BYTES,
+                                    segment_seconds=RECORDING_SEGMENT_SECONDS,
+                                    queue_frames=RECORDING_QUEUE_FRAMES, buffer_size=RECORDING_BUFFER_SIZE)
+
+def stop_recording(session):
+    recorder, session.recorder = session.recorder, None
+    if recorder is not None:
+        recorder.close()
+
+def close_sessions(timeout=5.0):
+    """Close every session and give their recordings time to be finished on disk"""
+    recorders = [s.recorder for s in sessions.sessions() if s.recorder is not None]
+    sessions.close_all()
+    deadline = time.monotonic() + timeout
+    for recorder in recorders:
+        recorder.join(max(0.0, deadline - time.monotonic()))
+
+def publish_frame(session, job, repeat=False):
+    """Hand a decoded frame to the dispatcher (runs on a prefork worker's output thread)"""
+    if not repeat:
+        session.store.publish(job.image, job.seq, job.timestamp, decoded=True)
+        worker.publish(session.slot, job.image, job.timestamp, job.capture_time)
+
+def start_dispatcher(port):
+    """Start PREFORK_WORKERS ingest worker processes on the ports after ``port``"""
+    global dispatcher
+    ports = []
+    for _ in range(PREFORK_WORKERS):
+        ports.append(find_available_port((ports[-1] if ports else port) + 1))
+    # Workers are spawned, not forked: hand them the decoders benchmarked here instead of rerunning it
+    settings = {'decoders': {fmt: backend.name for fmt, backend in decoders.selected.items()},
+                'decoder_benchmark_ms': decoders.benchmark_ms}
+    dispatcher = Dispatcher(run_worker, ports, MAX_SESSIONS, OUTPUT_WIDTH * OUTPUT_HEIGHT * 3, settings=settings)
+    dispatcher.start()
+    threading.Thread(target=collect_worker_frames, name='prefork-collect', daemon=True).start()
+    return ports
+
+def collect_worker_frames():
+    """Feed the frames decoded by prefork workers to their sessions' output stages"""
+    next_check = time.monotonic()
+    while True:
+        ready = dispatcher.next_frame(timeout=1.0)
+        now = time.monotonic()
+        if now >= next_check:
+            # Uploads go to the workers, so nothing else expires their sessions
+            sessions.expire(now)
+            dispatcher.check()
+            next_check = now + 1.0
+        if ready is None:
+            continue
+        slot, seq = ready
+        session = sessions.by_slot(slot)
+        if session is None or seq <= session.worker_seq:
+            continue
+        frame = dispatcher.frames.read(slot, after=session.worker_seq, acquire=frame_pool.acquire)
+        if frame is None:
+            continue
+        session.worker_seq = frame[0]
+        session.touch(now=now)
+        pipeline.deliver(frame[2], publisher=session.id, timestamp=frame[1], capture_time=frame[3])
+
+def run_worker(index, port, link):
+    """Entry point of a prefork ingest worker process"""
+    global worker
+    worker = link
+    worker.attach()
+    decoders.select(worker.settings.get('decoders', {}), worker.settings.get('decoder_benchmark_ms'))
+    sessions.idle_timeout = None  # The dispatcher decides when sessions end
+    pipeline.low_latency = True  # Publish frames as soon as they are decoded
+    pipeline.jitter_buffer = None  # The dispatcher's output stages buffer them
+    pipeline.start()
+    threading.Thread(target=follow_dispatcher, name='prefork-control', daemon=True).start()
+    threading.Thread(target=report_worker_load, name='prefork-load', daemon=True).start()
+    if CAPTURE_INGEST:
+        start_capture(f"ingest_worker{index}")
+    print(f"[Prefork] Worker {index} (pid {os.getpid()}) ingesting on port {port}")
+    app.run(host='0.0.0.0', port=port, ssl_context=certificate_paths(), threaded=True, use_reloader=False)
+
+def certificate_paths():
+    """``(cert_path, key_path)`` of the certificate the server runs with"""
+    cert_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'certs')
+    return os.path.join(cert_dir, 'cert.pem'), os.path.join(cert_dir, 'key.pem')
+
+def shutdown():
+    """Finish recordings and captures and stop every thread and worker process"""
+    close_sessions()
+    if dispatcher is not None:
+        dispatcher.stop()
+    pipeline.stop()
+    if capture is not None:
+        capture.close(timeout=5.0)
+
+def follow_dispatcher():
+    """Open and close sessions as the dispatcher pins and releases them (prefork worker)"""
+    for message in worker.messages():
+        if message[0] == 'open':
+            sessions.open(message[1], slot=message[2])
+        elif message[0] == 'close':
+            sessions.close(message[1])
+    close_sessions()
+    pipeline.stop()
+    if capture is not None:
+        capture.close(timeout=5.0)
+    os._exit(0)
+
+def report_worker_load():
+    """Publish this worker's load for the dispatcher's /stats (prefork worker)"""
+    cpu, wall = time.process_time(), time.monotonic()
+    while True:
+        time.sleep(WORKER_REPORT_INTERVAL)
+        stats = pipeline.stats()
+        now_cpu, now_wall = time.process_time(), time.monotonic()
+        worker.report(pid=os.getpid(), sessions=len(sessions), frames=stats['submitted'],
+                      decoded=stats['decoded'], dropped=stats['ingest_dropped'] + stats['expired'],
+                      ingest_depth=stats['ingest_depth'], cpu=(now_cpu - cpu) / (now_wall - wall))
+        cpu, wall = now_cpu, now_wall
+
+def session_stats():
+    """Per-session sink, output stage and rate control state for /stats"""
+    return {session.id: {**session.stats(), 'output': pipeline.output_stats(session.id),
+                         'bus': session.bus.stats() if session.bus is not None else None,
+                         'store': session.store.stats(),
+                         'restream': session.restream.stats() if session.restream is not None else None,
+                         'recording': session.recorder.stats() if session.recorder is not None else None,
+                         'capture_latency': pipeline.capture_latency(session.id),
+                         **session.controller.recommendation(), **session.controller.stats()}
+            for session in sessions.sessions()}
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Stage latency histograms and frame counters in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
@@ -413,10 +1232,10 @@ def static_files(filename):
 
 if __name__ == '__main__':
     print("\n🚀 Starting iPhone Webcam Server...")
-    if os.path.exists('/.dockerenv'):
+    if RUNNING_IN_DOCKER:
         print("Running in Docker container - virtual camera will be managed by host")
     else:
-        print("Running on host - virtual camera will be initialized when streaming starts")
+        print(f"Running on host - virtual camera ({OUTPUT_WIDTH}x{OUTPUT_HEIGHT}) will be initialized when streaming starts")
         print("\n📋 IMPORTANT: Before streaming:")
         print("1. Make sure OBS Studio is installed")
         print("2. Start OBS Studio at least once")
@@ -444,25 +1263,31 @@ if __name__ == '__main__':
         print(f"\n⚠️  Automation setup failed: {e}")
         print(f"Manual access: https://localhost:{port}")
     
+    # Pick the fastest installed decoder for each format on this host
+    for fmt, results in decoders.benchmark().items():
+        timings = ", ".join(f"{name} {ms:.2f}ms" for name, ms in sorted(results.items(), key=lambda r: r[1]))
+        print(f"⚙️  {fmt.upper()} decoder: {decoders.selected[fmt].name} ({timings})")
+
+    pipeline.start()
+    if CAPTURE_INGEST:
+        start_capture()
+    if PREFORK_WORKERS:
+        ports = start_dispatcher(port)
+        print(f"⚙️  Prefork ingest: {PREFORK_WORKERS} worker processes on ports {', '.join(map(str, ports))}")
+    playout = (f" (jitter buffer up to {JITTER_BUFFER_MAX_DELAY * 1000:.0f} ms)" if JITTER_BUFFER_MAX_DELAY
+               else ' (low latency)' if LOW_LATENCY_OUTPUT else '')
+    print(f"⚙️  Frame pipeline: {DECODE_WORKERS} decode workers, ingest queue of {INGEST_QUEUE_SIZE}, "
+          f"output {OUTPUT_WIDTH}x{OUTPUT_HEIGHT} {OUTPUT_PIXEL_FORMAT.upper()} at {OUTPUT_FPS} FPS{playout}")
+
     print(f"\n🌟 Server starting on all interfaces (0.0.0.0:{port})...")
     print("Press Ctrl+C to stop the server")
     
     try:
-        # Get paths to SSL certificates
-        cert_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'certs')
-        cert_path = os.path.join(cert_dir, 'cert.pem')
-        key_path = os.path.join(cert_dir, 'key.pem')
-        
-        app.run(host='0.0.0.0', port=port, ssl_context=(cert_path, key_path), 
-                threaded=True, use_reloader=False)
+        app.run(host='0.0.0.0', port=port, ssl_context=certificate_paths(), threaded=True, use_reloader=False)
     except KeyboardInterrupt:
         print("\n\n👋 Server stopped by user")
     except Exception as e:
         print(f"\n❌ Server error: {e}")
     finally:
         print("🧹 Cleaning up...")
-        if virtual_cam:
-            try:
-                virtual_cam.close()
-            except:
-                pass
+        shutdown()
@@ -0,0 +1,221 @@
+"""
+Frame path metrics
+
+Stage timings are recorded into log-linear (HDR-style) histograms: each
+power of two is split into a few linear sub-buckets, so every observation
+costs one integer index computation and a short uncontended lock, and
+percentiles stay within a few percent from microseconds to a minute.
+Everything registered here is rendered in the Prometheus text format by
+``/metrics``.
+"""
+
+import threading
+import time
+from collections import deque
+
+SUB_BUCKET_BITS = 3
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS  # 8 per power of two, <= 12.5% bucket width
+
+# Bucket bounds exported to Prometheus, in seconds
+EXPORT_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.0167, 0.025, 0.0333,
+                 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class LatencyHistogram:
+    """Log-linear histogram of durations in seconds, resolution ``unit`` up to ``highest``"""
+
+    def __init__(self, unit=1e-6, highest=60.0):
+        self.unit = unit
+        self._max_units = int(highest / unit)
+        self._counts = [0] * (self._index(self._max_units) + 1)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.last = None
+
+    def observe(self, seconds):
+        """Record one duration"""
+        index = self._index(min(max(int(seconds / self.unit), 0), self._max_units))
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+            self.last = seconds
+
+    def snapshot(self):
+        """Consistent copy of (bucket counts, count, sum, max)"""
+        with self._lock:
+            return list(self._counts), self.count, self.sum, self.max
+
+    def percentile(self, q, snapshot=None):
+        """Upper bound of the bucket holding the ``q``-th percentile, in seconds"""
+        counts, count, _, maximum = snapshot or self.snapshot()
+        if not count:
+            return 0.0
+        rank = q / 100.0 * count
+        seen = 0
+        for index, n in enumerate(counts):
+            seen += n
+            if n and seen >= rank:
+                return min(self._upper_bound(index) * self.unit, maximum)
+        return maximum
+
+    def cumulative(self, bounds, snapshot=None):
+        """Observation counts at or below each bound (approximated to bucket edges)"""
+        counts, _, _, _ = snapshot or self.snapshot()
+        result = []
+        index, seen = 0, 0
+        for bound in bounds:
+            while index < len(counts) and self._upper_bound(index) * self.unit <= bound:
+                seen += counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+    def summary(self):
+        """Count, mean and tail percentiles in milliseconds, for /stats"""
+        snapshot = self.snapshot()
+        _, count, total, maximum = snapshot
+        return {
+            'count': count,
+            'mean_ms': round(total / count * 1000, 3) if count else 0.0,
+            'p50_ms': round(self.percentile(50, snapshot) * 1000, 3),
+            'p90_ms': round(self.percentile(90, snapshot) * 1000, 3),
+            'p99_ms': round(self.percentile(99, snapshot) * 1000, 3),
+            'max_ms': round(maximum * 1000, 3),
+        }
+
+    @staticmethod
+    def _index(units):
+        if units < SUB_BUCKETS:
+            return units
+        shift = units.bit_length() - SUB_BUCKET_BITS - 1
+        return shift * SUB_BUCKETS + (units >> shift)
+
+    @staticmethod
+    def _upper_bound(index):
+        # Exclusive upper edge of a bucket, in units
+        if index < SUB_BUCKETS:
+            return index + 1
+        shift = index // SUB_BUCKETS - 1
+        return (index - shift * SUB_BUCKETS + 1) << shift
+
+
+class LatencyWindow:
+    """The most recent ``size`` durations, for percentiles that follow what is happening now"""
+
+    def __init__(self, size=120):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(max(seconds, 0.0))
+
+    def summary(self):
+        """Median and 95th percentile in milliseconds, or None before the first observation"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        pick = lambda q: samples[min(len(samples) - 1, int(q / 100 * len(samples)))]  # noqa: E731
+        return {'p50_ms': round(pick(50) * 1000, 1), 'p95_ms': round(pick(95) * 1000, 1)}
+
+
+class Span:
+    """Context manager that records its duration into a histogram"""
+
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class MetricsRegistry:
+    """Named stage histograms, labelled counters and callback gauges"""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._stages = {}
+        self._counters = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        """The histogram for a stage of the frame path, created on first use"""
+        histogram = self._stages.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._stages.setdefault(name, LatencyHistogram())
+        return histogram
+
+    def observe(self, stage, seconds):
+        self.stage(stage).observe(seconds)
+
+    def last(self, stage):
+        """Most recent duration recorded for a stage, or None"""
+        histogram = self._stages.get(stage)
+        return histogram.last if histogram is not None else None
+
+    def time(self, stage):
+        """``with metrics.time('decode'): ...``"""
+        return Span(self.stage(stage))
+
+    def inc(self, name, n=1, **labels):
+        """Add to a counter; ``labels`` become Prometheus labels"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + n
+
+    def add_collector(self, collect):
+        """Register ``collect() -> [(name, type, help, value)]`` evaluated on every scrape"""
+        self._collectors.append(collect)
+
+    def stage_summary(self):
+        """Per-stage latency percentiles for /stats"""
+        return {name: histogram.summary() for name, histogram in sorted(self._stages.items())}
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        family = f"{self.prefix}_stage_seconds"
+        lines.append(f"# HELP {family} Time spent in each stage of the frame path")
+        lines.append(f"# TYPE {family} histogram")
+        for name, histogram in sorted(self._stages.items()):
+            snapshot = histogram.snapshot()
+            _, count, total, _ = snapshot
+            for bound, seen in zip(EXPORT_BOUNDS, histogram.cumulative(EXPORT_BOUNDS, snapshot)):
+                lines.append(f'{family}_bucket{{stage="{name}",le="{bound}"}} {seen}')
+            lines.append(f'{family}_bucket{{stage="{name}",le="+Inf"}} {count}')
+            lines.append(f'{family}_sum{{stage="{name}"}} {total:.6f}')
+            lines.append(f'{family}_count{{stage="{name}"}} {count}')
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+        typed = set()
+        for (name, labels), value in counters:
+            metric = f"{self.prefix}_{name}_total"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f"{metric}{{{label_text}}} {value}" if label_text else f"{metric} {value}")
+
+        for collect in self._collectors:
+            for name, kind, help_text, value in collect():
+                metric = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} {kind}")
+                lines.append(f"{metric} {value}")
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,606 @@
+"""
+Staged frame pipeline: ingest -> decode -> output
+
+Request threads only enqueue the compressed bytes they received. A small
+pool of decoder threads (cv2 releases the GIL while decoding) turns them
+into images, and each frame sink has a paced output thread that hands it
+the newest image of its publisher; that thread is the only code that touches
+its virtual camera. The output clock runs at a fixed rate independent of
+network jitter and repeats the last image when nothing new has arrived.
+
+Frames whose publisher reported when they were captured (in the server's
+clock, see /clock) are also timed from capture to decode and to output.
+
+An optional jitter buffer between decode and output absorbs the bursts a
+Wi-Fi link delivers frames in: it holds frames back by a delay that follows
+the measured jitter and releases them on the output clock at their
+presentation time, trading a bounded amount of latency for an even cadence.
+"""
+
+import bisect
+import threading
+import time
+from collections import deque
+
+from metrics import LatencyWindow
+
+
+class LatestRing:
+    """Bounded FIFO that evicts its oldest entry instead of blocking producers.
+
+    With ``key``, a new item replaces a queued item with the same key
+    (latest wins) before anything else is evicted.
+    """
+
+    def __init__(self, capacity, key=None):
+        self.capacity = capacity
+        self.dropped = 0
+        self.superseded = 0
+        self._key = key
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def put(self, item):
+        """Append an item; returns the superseded or evicted oldest item, if any"""
+        with self._cond:
+            evicted = self._supersede(item) if self._key is not None else None
+            if evicted is not None:
+                self.superseded += 1
+            elif len(self._items) >= self.capacity:
+                evicted = self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+            return evicted
+
+    def get(self, timeout=None):
+        """Pop the oldest item, waiting up to ``timeout`` seconds; None on timeout or close"""
+        with self._cond:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self._items and not self._closed:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            if not self._items:
+                return None
+            return self._items.popleft()
+
+    def close(self):
+        """Wake up every waiting consumer; subsequent gets drain and then return None"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+    def _supersede(self, item):
+        key = self._key(item)
+        if key is None:
+            return None
+        for queued in self._items:
+            if self._key(queued) == key:
+                self._items.remove(queued)
+                return queued
+        return None
+
+
+class FrameJob:
+    """One frame travelling through the pipeline"""
+
+    __slots__ = ('seq', 'data', 'buffer', 'publisher', 'received_at', 'timestamp', 'capture_time', 'image',
+                 'delivered_at')
+
+    def __init__(self, seq, data, buffer=None, publisher=None, timestamp=None, capture_time=None):
+        self.seq = seq
+        self.data = data
+        self.buffer = buffer
+        self.publisher = publisher
+        self.received_at = time.monotonic()
+        self.timestamp = time.time() if timestamp is None else timestamp  # Wall-clock capture time
+        self.capture_time = capture_time  # When the publisher captured it, in our clock; None if unknown
+        self.image = None
+        self.delivered_at = None  # When it reached its output stage (monotonic)
+
+    @property
+    def presentation_time(self):
+        """Capture time if the publisher reported one, otherwise when the frame was received (wall clock)"""
+        return self.capture_time if self.capture_time is not None else self.timestamp
+
+
+class JitterBuffer:
+    """Decoded frames held back until their presentation time plus a playout offset.
+
+    The offset is the transit time (arrival minus presentation time) that
+    ``QUANTILE`` of the recent frames beat, capped at ``max_delay`` above the
+    fastest of them, so the delay the buffer adds follows the network's
+    jitter but never exceeds ``max_delay``. When frames start arriving after
+    their playout time the offset grows at once (the output repeats a frame
+    once); otherwise it moves towards the target a little per frame, which
+    shows as a slight change of pace rather than a stall or a skip.
+    """
+
+    WINDOW = 90  # Transit times the offset is chosen from (3 s at 30 FPS)
+    QUANTILE = 0.95
+    ADAPT = 0.02  # Fraction of the distance to the target offset covered per frame
+
+    def __init__(self, max_delay, capacity):
+        self.max_delay = max_delay
+        self.capacity = capacity
+        self.offset = None  # Seconds from presentation time to playout time
+        self.dropped = 0
+        self._transits = deque(maxlen=self.WINDOW)
+        self._frames = []  # (presentation time, seq, job), oldest first
+        self._played = None  # Presentation time of the last frame handed out
+        self._lock = threading.Lock()
+
+    def put(self, job, now):
+        """Buffer a job that arrived at wall-clock time ``now``; returns the jobs that must be dropped.
+
+        Those are ``job`` itself if a later frame was already played out, or
+        the oldest buffered job if the buffer is full.
+        """
+        pts = job.presentation_time
+        with self._lock:
+            self._adapt(now - pts)
+            if self._played is not None and pts <= self._played:
+                return [job]
+            bisect.insort(self._frames, (pts, job.seq, job))
+            if len(self._frames) > self.capacity:
+                self.dropped += 1
+                return [self._frames.pop(0)[2]]
+            return []
+
+    def pop(self, now):
+        """The newest job due at wall-clock time ``now``, or None, and the older due jobs it overtook"""
+        with self._lock:
+            due = 0
+            while due < len(self._frames) and self._frames[due][0] + self.offset <= now:
+                due += 1
+            if not due:
+                return None, []
+            entries = self._frames[:due]
+            del self._frames[:due]
+            self._played = entries[-1][0]
+            return entries[-1][2], [entry[2] for entry in entries[:-1]]
+
+    def drain(self):
+        """Remove and return every buffered job"""
+        with self._lock:
+            jobs = [entry[2] for entry in self._frames]
+            self._frames = []
+            return jobs
+
+    def delay(self):
+        """Seconds the buffer currently adds over the fastest recent frame"""
+        with self._lock:
+            if self.offset is None:
+                return 0.0
+            return max(0.0, self.offset - min(self._transits))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._frames)
+
+    def _adapt(self, transit):
+        self._transits.append(transit)
+        transits = sorted(self._transits)
+        target = min(transits[int(self.QUANTILE * (len(transits) - 1))], transits[0] + self.max_delay)
+        if self.offset is None or (transit > self.offset and target > self.offset):
+            self.offset = target
+        else:
+            self.offset += (target - self.offset) * self.ADAPT
+
+
+class OutputStage:
+    """Paced output for one frame sink.
+
+    A single thread runs the output clock: on every tick it hands the newest
+    decoded job to ``output(job, repeat)``, or repeats the previous one when
+    nothing new has arrived. With a ``jitter_buffer`` of N seconds decoded
+    jobs wait in a JitterBuffer adding at most N seconds, and each tick
+    hands out the newest one that is due instead; ``low_latency`` is ignored
+    then.
+    """
+
+    COUNTERS = ('output', 'output_failed', 'stale', 'late', 'repeated', 'skipped_ticks')
+
+    def __init__(self, key, output, fps, low_latency, release, observe, jitter_buffer=None):
+        self.key = key
+        self.fps = fps
+        self.low_latency = low_latency and not jitter_buffer
+        self.decoded = LatestRing(1)
+        # Room for max_delay of frames arriving at up to the output rate
+        self.jitter = JitterBuffer(jitter_buffer, int(jitter_buffer * fps) + 2) if jitter_buffer else None
+        self._output = output
+        self._release = release
+        self._observe = observe
+        self._lock = threading.Lock()
+        self._last_output = None  # Sequence number, or presentation time with a jitter buffer
+        self._thread = None
+        self._running = False
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.capture_latency = LatencyWindow()  # Capture to output of the most recent frames
+        self.ingest_dropped = 0  # Frames of this publisher dropped before they were decoded
+        self.decode_time = None  # Latest decode duration of one of its frames
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._output_loop, name=f"pipeline-output-{self.key}", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        self._running = False
+        self.decoded.close()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def deliver(self, job):
+        """Hand over a decoded job; an undelivered older one is released"""
+        job.delivered_at = time.monotonic()
+        if self.jitter is not None:
+            late = self.jitter.put(job, time.time())
+            if job in late:
+                self._count('late')
+            for dropped in late:
+                self._release(dropped.image)
+            return
+        evicted = self.decoded.put(job)
+        if evicted is not None:
+            self._release(evicted.image)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        if self.jitter is not None:
+            return {'decoded_depth': len(self.jitter), 'decoded_dropped': self.jitter.dropped, **counters}
+        return {'decoded_depth': len(self.decoded), 'decoded_dropped': self.decoded.dropped, **counters}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def _next_due(self):
+        job, overtaken = self.jitter.pop(time.time())
+        if overtaken:
+            # They missed their tick; showing them now would only delay the newer one
+            self._count('late', len(overtaken))
+            for late in overtaken:
+                self._release(late.image)
+        if job is not None:
+            self._observe('jitter_buffer', time.monotonic() - job.delivered_at)
+        return job
+
+    def _output_loop(self):
+        interval = 1.0 / self.fps
+        next_tick = time.monotonic()
+        last_job = None
+        last_played = None  # (output time, presentation time) of the last new frame
+        while self._running:
+            now = time.monotonic()
+            if self.low_latency:
+                # Block until a new frame arrives or the tick for a repeat is due
+                job = self.decoded.get(timeout=max(0.0, next_tick - now))
+            else:
+                if next_tick > now:
+                    time.sleep(next_tick - now)
+                    self._observe('pace', time.monotonic() - now)
+                job = self._next_due() if self.jitter is not None else self.decoded.get(timeout=0)
+
+            # Decoders may finish out of order; never step the output backwards. The jitter buffer
+            # hands frames out by presentation time, which may reorder them against their arrival
+            if job is not None:
+                order = job.presentation_time if self.jitter is not None else job.seq
+            if job is not None and self._last_output is not None and order <= self._last_output:
+                self._count('stale')
+                self._release(job.image)
+                job = None
+
+            if job is not None:
+                self._last_output = order
+                previous, last_job = last_job, job
+                self._send(job, repeat=False)
+                sent = time.monotonic()
+                self._observe('end_to_end', sent - job.received_at)
+                if last_played is not None:
+                    # How far the output cadence strays from the capture cadence
+                    self._observe('playout_jitter', abs((sent - last_played[0])
+                                                        - (job.presentation_time - last_played[1])))
+                last_played = (sent, job.presentation_time)
+                if job.capture_time is not None:
+                    latency = time.time() - job.capture_time
+                    self._observe('capture_to_output', latency)
+                    self.capture_latency.observe(latency)
+                if previous is not None:
+                    self._release(previous.image)
+            elif time.monotonic() < next_tick:
+                continue
+            elif last_job is not None:
+                self._send(last_job, repeat=True)
+
+            # Advance on absolute deadlines so sleep overshoot does not accumulate
+            now = time.monotonic()
+            if self.low_latency and job is not None:
+                next_tick = now + interval
+            else:
+                next_tick += interval
+                if now - next_tick > interval:
+                    # Fell more than a frame behind (e.g. camera re-init); resync
+                    missed = int((now - next_tick) / interval)
+                    self._count('skipped_ticks', missed)
+                    next_tick += missed * interval
+
+        # Stopped: hand every buffer back
+        if last_job is not None:
+            self._release(last_job.image)
+        for job in self.jitter.drain() if self.jitter is not None else ():
+            self._release(job.image)
+        job = self.decoded.get(timeout=0)
+        while job is not None:
+            self._release(job.image)
+            job = self.decoded.get(timeout=0)
+
+    def _send(self, job, repeat):
+        started = time.monotonic()
+        try:
+            self._output(job, repeat)
+            self._count('repeated' if repeat else 'output')
+        except Exception as e:
+            print(f"[Pipeline] Output error ({self.key}): {e}")
+            self._count('output_failed')
+        self._observe('output', time.monotonic() - started)
+
+
+class FramePipeline:
+    """Decouples frame decode and output from the threads that receive frames.
+
+    ``decode(data)`` runs on the decoder pool and returns an image or None.
+    Decoded frames go to the output stage registered with ``add_output``
+    under the frame's ``publisher`` key; ``output``, if given, is registered
+    for frames without one. An output stage calls ``output(job, repeat)``
+    once per output tick on its own thread, with the decoded image in
+    ``job.image``; ``repeat`` is True when the previous job is sent again.
+    With ``low_latency`` new images are pushed as soon as they are decoded
+    instead of waiting for the next tick.
+    ``release(image)``, if given, is called once the pipeline no longer needs
+    an image so its buffer can be recycled; ``release_input(buffer)`` does
+    the same for the buffer that backed a job's compressed bytes.
+    ``observe(stage, seconds)``, if given, receives the queue wait, decode,
+    output, pacing and end-to-end timings, how far the output cadence strays
+    from the capture cadence (``playout_jitter``), and for frames submitted
+    with a ``capture_time`` the time from capture to decode and to output.
+    With ``jitter_buffer`` (seconds, the most latency it may add) every output
+    stage plays frames out at their presentation time through a JitterBuffer,
+    and the time frames spend in it is observed as ``jitter_buffer``.
+
+    The decoders are shared by all publishers. Each publisher has at most
+    one frame waiting for a decoder (a newer one replaces it) and waiting
+    frames are decoded oldest first, so a publisher sending faster than the
+    others can't take more than its turn. Frames that waited longer than
+    ``max_age`` seconds are dropped instead of decoded.
+    """
+
+    def __init__(self, decode, output=None, decode_workers=2, queue_size=2, fps=30, low_latency=False,
+                 release=None, release_input=None, observe=None, max_age=None, jitter_buffer=None):
+        self._decode = decode
+        self._observe = observe or (lambda stage, seconds: None)
+        self._release = release or (lambda image: None)
+        self._release_input = release_input or (lambda buffer: None)
+        self._decode_workers = decode_workers
+        self._queue_size = queue_size
+        self.fps = fps
+        self.low_latency = low_latency
+        self.jitter_buffer = jitter_buffer
+        self.max_age = max_age
+        self.ingest = LatestRing(queue_size, key=lambda job: job.publisher)
+        self._outputs = {}
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._decode_time = 0.0
+        self._threads = []
+        self._running = False
+        self.counters = {
+            'submitted': 0,
+            'decoded': 0,
+            'decode_failed': 0,
+            'expired': 0,
+            'unrouted': 0,
+        }
+        if output is not None:
+            self.add_output(None, output)
+
+    def start(self):
+        """Start the decoder pool and the output stages"""
+        if self._running:
+            return
+        self._running = True
+        for i in range(self._decode_workers):
+            self._spawn(self._decode_loop, f"decode-{i}")
+        with self._lock:
+            stages = list(self._outputs.values())
+        for stage in stages:
+            stage.start()
+
+    def stop(self, timeout=2.0):
+        """Stop all stages and wait briefly for them to exit"""
+        self._running = False
+        self.ingest.close()
+        with self._lock:
+            stages = list(self._outputs.values())
+        for stage in stages:
+            stage.stop(timeout)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def add_output(self, key, output):
+        """Register the frame sink for frames submitted with ``publisher=key``"""
+        stage = OutputStage(key, output, self.fps, self.low_latency, self._release, self._observe,
+                            self.jitter_buffer)
+        with self._lock:
+            if key in self._outputs:
+                raise ValueError(f"Output '{key}' already registered")
+            self._outputs[key] = stage
+            # One waiting frame per publisher must always fit
+            self.ingest.capacity = max(self._queue_size, len(self._outputs))
+        if self._running:
+            stage.start()
+        return stage
+
+    def remove_output(self, key, timeout=2.0):
+        """Stop and forget the output stage of ``key``; its pending frames are dropped"""
+        with self._lock:
+            stage = self._outputs.pop(key, None)
+            self.ingest.capacity = max(self._queue_size, len(self._outputs))
+        if stage is not None:
+            stage.stop(timeout)
+
+    def submit(self, data, buffer=None, publisher=None, timestamp=None, capture_time=None):
+        """Queue compressed frame bytes for decoding and return the frame sequence number.
+
+        ``buffer`` is the recyclable object ``data`` points into, if any; it is
+        handed to ``release_input`` once the frame is decoded or dropped.
+        ``timestamp`` is the frame's wall-clock capture time, by default now.
+        ``capture_time`` is the capture time the publisher reported, if any.
+        """
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            self.counters['submitted'] += 1
+        evicted = self.ingest.put(FrameJob(seq, data, buffer, publisher, timestamp, capture_time))
+        if evicted is not None:
+            self._lost(evicted)
+            self._drop_input(evicted)
+        return seq
+
+    def deliver(self, image, publisher=None, timestamp=None, capture_time=None):
+        """Hand an image decoded elsewhere (e.g. another process) straight to its output stage"""
+        with self._lock:
+            self._seq += 1
+            job = FrameJob(self._seq, None, publisher=publisher, timestamp=timestamp, capture_time=capture_time)
+        job.image = image
+        self._route(job)
+        return job.seq
+
+    def backlog_delay(self):
+        """Estimated seconds until a frame submitted now would start decoding"""
+        return len(self.ingest) * self._decode_time / self._decode_workers
+
+    def publisher_load(self, key):
+        """How many of ``key``'s frames were dropped before decoding, and its latest decode time (or None)"""
+        with self._lock:
+            stage = self._outputs.get(key)
+            return (stage.ingest_dropped, stage.decode_time) if stage is not None else (0, None)
+
+    def capture_latency(self, key):
+        """Capture to output percentiles of the recent frames of ``key``, or None"""
+        with self._lock:
+            stage = self._outputs.get(key)
+        return stage.capture_latency.summary() if stage is not None else None
+
+    def output_stats(self, key):
+        """Counters of one output stage, or None if ``key`` has none"""
+        with self._lock:
+            stage = self._outputs.get(key)
+        if stage is None:
+            return None
+        stats = stage.stats()
+        if stage.jitter is not None:
+            stats['jitter_delay_ms'] = round(stage.jitter.delay() * 1000, 1)
+        return stats
+
+    def stats(self):
+        """Snapshot of queue depths and drop counters, output stages summed"""
+        with self._lock:
+            counters = dict(self.counters)
+            stages = list(self._outputs.values())
+        totals = {'decoded_depth': 0, 'decoded_dropped': 0}
+        for stage in stages:
+            for name, value in stage.stats().items():
+                totals[name] = totals.get(name, 0) + value
+        for name in OutputStage.COUNTERS:
+            totals.setdefault(name, 0)
+        return {
+            'ingest_depth': len(self.ingest),
+            'ingest_capacity': self.ingest.capacity,
+            'ingest_dropped': self.ingest.dropped,
+            'ingest_superseded': self.ingest.superseded,
+            'decode_workers': self._decode_workers,
+            'output_stages': len(stages),
+            'output_fps': self.fps,
+            'low_latency': self.low_latency,
+            'jitter_buffer_ms': round(self.jitter_buffer * 1000) if self.jitter_buffer else 0,
+            **counters,
+            **totals,
+        }
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def _lost(self, job):
+        # Charge a frame dropped before decoding to its own publisher
+        with self._lock:
+            stage = self._outputs.get(job.publisher)
+            if stage is not None:
+                stage.ingest_dropped += 1
+
+    def _drop_input(self, job):
+        job.data = None
+        buffer, job.buffer = job.buffer, None
+        if buffer is not None:
+            self._release_input(buffer)
+
+    def _spawn(self, target, name):
+        thread = threading.Thread(target=target, name=f"pipeline-{name}", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _decode_loop(self):
+        while self._running:
+            job = self.ingest.get(timeout=0.5)
+            if job is None:
+                continue
+            started = time.monotonic()
+            self._observe('queue_wait', started - job.received_at)
+            if self.max_age is not None and started - job.received_at > self.max_age:
+                # Too old to be worth decoding; a newer frame is on its way
+                self._count('expired')
+                self._lost(job)
+                self._drop_input(job)
+                continue
+            try:
+                job.image = self._decode(job.data)
+            except Exception as e:
+                print(f"[Pipeline] Decode error: {e}")
+                job.image = None
+            elapsed = time.monotonic() - started
+            self._observe('decode', elapsed)
+            # Smoothed decode time for backlog_delay()
+            self._decode_time += (elapsed - self._decode_time) / 8
+            with self._lock:
+                stage = self._outputs.get(job.publisher)
+                if stage is not None:
+                    stage.decode_time = elapsed
+            self._drop_input(job)
+            if job.image is None:
+                self._count('decode_failed')
+                continue
+            self._count('decoded')
+            if job.capture_time is not None:
+                self._observe('capture_to_decoded', time.time() - job.capture_time)
+            self._route(job)
+
+    def _route(self, job):
+        with self._lock:
+            stage = self._outputs.get(job.publisher)
+        if stage is None:
+            # The publisher went away while its frame was decoding
+            self._count('unrouted')
+            self._release(job.image)
+            return
+        stage.deliver(job)
@@ -0,0 +1,273 @@
+"""
+Prefork ingest
+
+One interpreter decoding every phone's frames runs out of GIL long before it
+runs out of cores. In prefork mode the server process becomes a dispatcher
+and frame sink: N worker processes each accept uploads and WebSockets on a
+port of their own, with their own decoder pool, admission control and rate
+controllers, and hand decoded frames back through shared memory to the one
+process that owns the virtual cameras. A session is pinned to the worker
+with the fewest sessions when it opens and stays there until it closes;
+``/session`` tells the phone which port to stream to.
+
+Every session slot in shared memory holds two frame buffers. A worker
+writes the one the dispatcher isn't reading and guards it with a seqlock
+(odd while writing), so the reader can detect a torn copy and try again.
+"""
+
+import math
+import multiprocessing
+import queue
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from framebus import _attach
+
+HEADER_SIZE = 64  # Bytes reserved for each header; keeps frame data aligned
+SLOT_HEADER = struct.Struct('<Q')  # Sequence number of the newest complete frame in the slot
+# Per buffer: seqlock, frame sequence number, timestamp, publisher's capture time (NaN if unknown),
+# height, width, channels (0 for 2-D frames)
+BUFFER_HEADER = struct.Struct('<QQddIII')
+SEQLOCK = struct.Struct('<Q')
+READ_ATTEMPTS = 3
+
+# Per-worker load reported through shared memory, in this order
+LOAD_FIELDS = ('pid', 'sessions', 'frames', 'decoded', 'dropped', 'ingest_depth', 'cpu', 'updated')
+
+
+class SharedFrameSlots:
+    """Double-buffered decoded frames, one slot per session, in a shared memory block.
+
+    The creating process owns the block and unlinks it on ``close``; other
+    processes attach by ``name``. Each slot must have a single writer.
+    """
+
+    def __init__(self, slots, frame_bytes, name=None):
+        self.slots = slots
+        self.frame_bytes = frame_bytes
+        self._buffer_size = HEADER_SIZE + frame_bytes
+        self._slot_size = HEADER_SIZE + 2 * self._buffer_size
+        self._owner = name is None
+        if self._owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=slots * self._slot_size)
+        else:
+            # Workers are spawned by the owner and share its resource tracker
+            self.shm = _attach(name, shared_tracker=True)
+        self.name = self.shm.name
+        self.torn = 0
+
+    def write(self, slot, image, timestamp=None, capture_time=None):
+        """Publish a uint8 image into ``slot`` and return its sequence number"""
+        if image.nbytes > self.frame_bytes:
+            raise ValueError(f"Frame of {image.nbytes} bytes exceeds the {self.frame_bytes} byte slot")
+        buf = self.shm.buf
+        base = slot * self._slot_size
+        (seq,) = SLOT_HEADER.unpack_from(buf, base)
+        seq += 1
+        offset = self._buffer_offset(slot, seq)
+        (lock,) = SEQLOCK.unpack_from(buf, offset)
+        SEQLOCK.pack_into(buf, offset, lock + 1)
+        dst = np.ndarray(image.shape, np.uint8, buffer=buf, offset=offset + HEADER_SIZE)
+        np.copyto(dst, image)
+        del dst
+        channels = image.shape[2] if image.ndim == 3 else 0
+        BUFFER_HEADER.pack_into(buf, offset, lock + 2, seq, time.time() if timestamp is None else timestamp,
+                                math.nan if capture_time is None else capture_time,
+                                image.shape[0], image.shape[1], channels)
+        SLOT_HEADER.pack_into(buf, base, seq)
+        return seq
+
+    def latest(self, slot):
+        """Sequence number of the newest frame written to ``slot``"""
+        return SLOT_HEADER.unpack_from(self.shm.buf, slot * self._slot_size)[0]
+
+    def read(self, slot, after=0, acquire=None):
+        """Copy out the newest frame of ``slot`` if it is newer than ``after``.
+
+        Returns ``(seq, timestamp, image, capture_time)`` or None. The copy lands in
+        ``acquire(shape)`` when given, e.g. a frame pool.
+        """
+        buf = self.shm.buf
+        for _ in range(READ_ATTEMPTS):
+            (seq,) = SLOT_HEADER.unpack_from(buf, slot * self._slot_size)
+            if seq <= after:
+                return None
+            offset = self._buffer_offset(slot, seq)
+            lock, frame_seq, timestamp, capture_time, height, width, channels = BUFFER_HEADER.unpack_from(buf, offset)
+            if lock % 2 == 0 and frame_seq == seq:
+                shape = (height, width, channels) if channels else (height, width)
+                out = acquire(shape) if acquire is not None else np.empty(shape, np.uint8)
+                src = np.ndarray(shape, np.uint8, buffer=buf, offset=offset + HEADER_SIZE)
+                np.copyto(out, src)
+                del src
+                if SEQLOCK.unpack_from(buf, offset)[0] == lock:
+                    return seq, timestamp, out, None if math.isnan(capture_time) else capture_time
+            # The writer lapped us; the slot header now points at a newer frame
+            self.torn += 1
+        return None
+
+    def close(self):
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
+    def _buffer_offset(self, slot, seq):
+        return slot * self._slot_size + HEADER_SIZE + (seq % 2) * self._buffer_size
+
+
+class WorkerLink:
+    """What a worker process gets from the dispatcher: its control queue, the frame slots and its load row"""
+
+    def __init__(self, index, slots_name, slots, frame_bytes, control, ready, load, settings=None):
+        self.index = index
+        self.settings = settings or {}  # Picklable values the dispatcher hands every worker
+        self._slots_name = slots_name
+        self._slots = slots
+        self._frame_bytes = frame_bytes
+        self._control = control
+        self._ready = ready
+        self._load = load
+        self.frames = None
+
+    def attach(self):
+        """Map the dispatcher's frame slots; call once in the worker process"""
+        self.frames = SharedFrameSlots(self._slots, self._frame_bytes, name=self._slots_name)
+
+    def publish(self, slot, image, timestamp=None, capture_time=None):
+        """Hand a decoded frame to the dispatcher"""
+        seq = self.frames.write(slot, image, timestamp, capture_time)
+        self._ready.put((slot, seq))
+
+    def messages(self):
+        """Control messages from the dispatcher until it asks this worker to stop"""
+        while True:
+            message = self._control.get()
+            if message[0] == 'stop':
+                return
+            yield message
+
+    def report(self, **values):
+        """Publish this worker's load; keys are LOAD_FIELDS"""
+        row = self.index * len(LOAD_FIELDS)
+        values['updated'] = time.time()
+        for name, value in values.items():
+            self._load[row + LOAD_FIELDS.index(name)] = value
+
+
+class Dispatcher:
+    """Starts the ingest workers, pins sessions to them and collects their frames.
+
+    ``target(index, port, link)`` is the worker entry point; it runs in a
+    freshly spawned interpreter, so it must be importable from the main module.
+    Nothing the dispatcher set up at runtime is inherited; what the workers
+    need from it goes in ``settings`` and arrives as ``link.settings``.
+    """
+
+    def __init__(self, target, ports, slots, frame_bytes, settings=None):
+        self._ctx = multiprocessing.get_context('spawn')
+        self._target = target
+        self._settings = settings
+        self.ports = list(ports)
+        self.frames = SharedFrameSlots(slots, frame_bytes)
+        self.ready = self._ctx.Queue()
+        self._load = self._ctx.Array('d', len(self.ports) * len(LOAD_FIELDS), lock=False)
+        self._controls = [self._ctx.Queue() for _ in self.ports]
+        self._processes = [None] * len(self.ports)
+        self._pinned = [{} for _ in self.ports]  # Per worker: session id -> slot
+        self._lock = threading.Lock()
+        self._stopping = False
+        self.restarts = 0
+
+    def start(self):
+        for index in range(len(self.ports)):
+            self._spawn(index)
+
+    def stop(self, timeout=2.0):
+        self._stopping = True
+        for control in self._controls:
+            control.put(('stop',))
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout)
+                if process.is_alive():
+                    process.terminate()
+        self.frames.close()
+
+    def worker_for(self, session_id):
+        """Index of the worker a session is pinned to, or None"""
+        with self._lock:
+            return next((i for i, pinned in enumerate(self._pinned) if session_id in pinned), None)
+
+    def open(self, session_id, slot):
+        """Pin a session to the least busy worker and tell it; returns the worker index"""
+        with self._lock:
+            index = min(range(len(self.ports)), key=lambda i: len(self._pinned[i]))
+            self._pinned[index][session_id] = slot
+        self._controls[index].put(('open', session_id, slot))
+        return index
+
+    def close(self, session_id):
+        index = self.worker_for(session_id)
+        if index is None:
+            return
+        with self._lock:
+            self._pinned[index].pop(session_id, None)
+        self._controls[index].put(('close', session_id))
+
+    def next_frame(self, timeout=None):
+        """``(slot, seq)`` of the next frame a worker published, or None on timeout"""
+        try:
+            return self.ready.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def check(self):
+        """Restart workers that died and hand them their sessions again"""
+        if self._stopping:
+            return
+        for index, process in enumerate(self._processes):
+            if process is not None and not process.is_alive():
+                print(f"[Prefork] Worker {index} exited with code {process.exitcode}, restarting")
+                self.restarts += 1
+                self._spawn(index)
+                with self._lock:
+                    pinned = dict(self._pinned[index])
+                for session_id, slot in pinned.items():
+                    self._controls[index].put(('open', session_id, slot))
+
+    def stats(self):
+        """Per-worker load as last reported by each worker"""
+        now = time.time()
+        workers = []
+        for index, port in enumerate(self.ports):
+            row = index * len(LOAD_FIELDS)
+            load = dict(zip(LOAD_FIELDS, self._load[row:row + len(LOAD_FIELDS)]))
+            process = self._processes[index]
+            with self._lock:
+                pinned = len(self._pinned[index])
+            workers.append({
+                'worker': index,
+                'port': port,
+                'pid': int(load['pid']),
+                'alive': process is not None and process.is_alive(),
+                'pinned_sessions': pinned,
+                'frames': int(load['frames']),
+                'decoded': int(load['decoded']),
+                'dropped': int(load['dropped']),
+                'ingest_depth': int(load['ingest_depth']),
+                'cpu_percent': round(load['cpu'] * 100, 1),
+                'report_age_s': round(now - load['updated'], 1) if load['updated'] else None,
+            })
+        return {'workers': workers, 'worker_restarts': self.restarts, 'torn_reads': self.frames.torn}
+
+    def _spawn(self, index):
+        link = WorkerLink(index, self.frames.name, self.frames.slots, self.frames.frame_bytes,
+                          self._controls[index], self.ready, self._load, self._settings)
+        process = self._ctx.Process(target=self._target, args=(index, self.ports[index], link),
+                                    name=f"ingest-worker-{index}", daemon=True)
+        process.start()
+        self._processes[index] = process
@@ -0,0 +1,181 @@
+"""
+Server-driven rate control for publishers
+
+Each publisher gets a RateController that watches what actually reaches the
+server -- frame inter-arrival times and their jitter, frame sizes, and how
+many of its own frames the shared pipeline dropped and how long they took
+to decode -- and recommends the JPEG quality, frame rate and capture scale
+the phone should use next.
+
+It is an AIMD loop evaluated over short windows. A clean window adds a small
+step to quality, then frame rate, then capture scale. A window in which
+frames arrive late or bunched up (the network can't carry what was asked
+for) cuts quality first and frame rate after that. A window in which the
+server falls behind (ingest drops, or decode time that doesn't fit the frame
+budget) cuts frame rate and capture scale, which is what costs decode time.
+After a cut the controller holds for a window so it doesn't oscillate.
+"""
+
+import threading
+
+# An achieved frame rate below this share of the recommended one counts as congestion
+LATE_RATIO = 0.8
+# Inter-arrival jitter above this share of the frame interval counts as congestion
+JITTER_RATIO = 0.5
+# Decode load (seconds of decode per second) above this share of the decoders counts as overload
+DECODE_HEADROOM = 0.9
+
+QUALITY_STEP = 0.05
+FPS_STEP = 2
+DECREASE_FACTOR = 0.8
+QUALITY_DECREASE_FACTOR = 0.85
+SCALE_UP_WINDOWS = 4  # Clean windows at full quality and rate before capturing larger
+
+
+class RateController:
+    """AIMD quality/frame-rate/capture-scale controller for one publisher.
+
+    Call ``on_frame`` for every accepted frame; ``recommendation()`` is what
+    gets sent back to the publisher.
+    """
+
+    def __init__(self, max_fps=30, min_fps=10, quality=0.7, min_quality=0.3, max_quality=0.9,
+                 scales=(0.5, 0.75, 1.0), window=0.25, decode_capacity=1):
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self.fps_limit = max_fps
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.scales = scales
+        self.window = window
+        self.decode_capacity = decode_capacity
+
+        self.quality = quality
+        self.fps = float(max(min_fps, min(max_fps, 20)))
+        self.scale_index = len(scales) - 1
+
+        self.jitter = 0.0
+        self.throughput = 0.0
+        self.last_arrival = None
+        self.state = 'start'
+        self.counters = {'windows': 0, 'increase': 0, 'hold': 0, 'congested': 0, 'overloaded': 0}
+        self._lock = threading.Lock()
+        self._window_start = None
+        self._window_frames = 0
+        self._window_bytes = 0
+        self._window_dropped = 0
+        self._clean_windows = 0
+        self._hold = False
+
+    def on_frame(self, size, now, dropped=0, decode_time=None):
+        """Account for one arriving frame and re-evaluate at the end of each window.
+
+        ``now`` is a monotonic timestamp, ``dropped`` the running count of
+        this publisher's frames dropped before decoding and ``decode_time``
+        the latest decode duration of one of its frames.
+        """
+        with self._lock:
+            if self.last_arrival is not None:
+                # RFC 3550 style running estimate of inter-arrival jitter
+                deviation = abs((now - self.last_arrival) - 1.0 / self.fps)
+                self.jitter += (deviation - self.jitter) / 16
+            self.last_arrival = now
+
+            if self._window_start is None:
+                self._start_window(now, dropped)
+                return
+            self._window_frames += 1
+            self._window_bytes += size
+            elapsed = now - self._window_start
+            if elapsed >= self.window:
+                self._decide(elapsed, dropped - self._window_dropped, decode_time)
+                self._start_window(now, dropped)
+
+    def set_max_fps(self, fps):
+        """Cap the recommended frame rate at what the publisher is set to send at most"""
+        with self._lock:
+            self.max_fps = max(self.min_fps, min(self.fps_limit, fps))
+            self.fps = min(self.fps, self.max_fps)
+
+    def recommendation(self):
+        """Recommended JPEG quality (0-1), frame rate and capture scale of the selected size"""
+        with self._lock:
+            return {
+                'quality': round(self.quality, 2),
+                'fps': int(self.fps),
+                'scale': self.scales[self.scale_index],
+            }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'jitter_ms': round(self.jitter * 1000, 2),
+                'throughput_kbps': round(self.throughput * 8 / 1000, 1),
+                **self.counters,
+            }
+
+    def _start_window(self, now, dropped):
+        self._window_start = now
+        self._window_frames = 0
+        self._window_bytes = 0
+        self._window_dropped = dropped
+
+    def _decide(self, elapsed, new_drops, decode_time):
+        self.counters['windows'] += 1
+        self.throughput = self._window_bytes / elapsed
+        achieved_fps = self._window_frames / elapsed
+        interval = 1.0 / self.fps
+
+        overloaded = new_drops > 0 or (
+            decode_time is not None and decode_time * self.fps > self.decode_capacity * DECODE_HEADROOM)
+        congested = achieved_fps < self.fps * LATE_RATIO or self.jitter > interval * JITTER_RATIO
+
+        if overloaded:
+            self._decrease_load(decode_time)
+            self.state = 'overloaded'
+        elif congested:
+            self._decrease_bitrate()
+            self.state = 'congested'
+        elif self._hold:
+            self._hold = False
+            self.state = 'hold'
+        else:
+            self._increase()
+            self.state = 'increase'
+        self.counters[self.state] += 1
+
+    def _decrease_load(self, decode_time):
+        self._hold = True
+        self._clean_windows = 0
+        too_slow_at_min_fps = decode_time is not None and decode_time * self.min_fps > self.decode_capacity
+        if self.fps > self.min_fps and not too_slow_at_min_fps:
+            self.fps = max(self.min_fps, self.fps * DECREASE_FACTOR)
+        elif self.scale_index > 0:
+            self.scale_index -= 1
+
+    def _decrease_bitrate(self):
+        self._hold = True
+        self._clean_windows = 0
+        if self.quality > self.min_quality:
+            self.quality = max(self.min_quality, self.quality * QUALITY_DECREASE_FACTOR)
+        elif self.fps > self.min_fps:
+            self.fps = max(self.min_fps, self.fps * DECREASE_FACTOR)
+        elif self.scale_index > 0:
+            self.scale_index -= 1
+
+    def _increase(self):
+        if self.quality < self.max_quality:
+            self.quality = min(self.max_quality, self.quality + QUALITY_STEP)
+        elif self.fps < self.max_fps:
+            self.fps = min(self.max_fps, self.fps + FPS_STEP)
+        elif self.scale_index < len(self.scales) - 1:
+            self._clean_windows += 1
+            if self._clean_windows >= SCALE_UP_WINDOWS:
+                self._clean_windows = 0
+                self.scale_index += 1
+
+
+def format_recommendation(recommendation):
+    """Render a recommendation as an ``X-Rate-Recommendation`` header value"""
+    return ', '.join(f"{name}={value}" for name, value in recommendation.items())
@@ -0,0 +1,306 @@
+"""
+Passthrough session recording
+
+A session's uploaded JPEGs are appended, byte for byte, to Matroska files
+(codec V_MJPEG) with each frame's capture timestamp, so recording costs disk
+bandwidth rather than an encoder's worth of CPU. The ingest thread only puts
+the frame on a bounded queue -- when the disk falls behind, frames are
+dropped from the recording, never held back from the live path. A writer
+thread gathers about a second of frames into a cluster and writes it in one
+go through a large buffer, starts a new file when the current one reaches
+the size or duration limit, and finishes each file with an index (Cues) so
+players can seek. A file cut short by a crash still plays up to its last
+complete cluster.
+"""
+
+import os
+import queue
+import struct
+import threading
+import time
+from datetime import datetime
+
+from decoders import jpeg_size
+
+CLUSTER_DURATION_MS = 1000  # A cluster holds about this much video ...
+CLUSTER_MAX_BYTES = 8 << 20  # ... or this many bytes, whichever comes first
+IDLE_FLUSH_INTERVAL = 1.0  # Seconds without frames after which the open cluster is written anyway
+SEEK_HEAD_SPACE = 96  # Bytes reserved at the start of a file for the seek index
+
+# Matroska element ids
+EBML = 0x1A45DFA3
+SEGMENT = 0x18538067
+SEEK_HEAD, SEEK, SEEK_ID, SEEK_POSITION = 0x114D9B74, 0x4DBB, 0x53AB, 0x53AC
+INFO, TIMESTAMP_SCALE, DURATION, MUXING_APP, WRITING_APP = 0x1549A966, 0x2AD7B1, 0x4489, 0x4D80, 0x5741
+TRACKS, TRACK_ENTRY, TRACK_NUMBER, TRACK_UID, TRACK_TYPE = 0x1654AE6B, 0xAE, 0xD7, 0x73C5, 0x83
+FLAG_LACING, CODEC_ID, VIDEO, PIXEL_WIDTH, PIXEL_HEIGHT = 0x9C, 0x86, 0xE0, 0xB0, 0xBA
+CLUSTER, CLUSTER_TIMESTAMP, SIMPLE_BLOCK = 0x1F43B675, 0xE7, 0xA3
+CUES, CUE_POINT, CUE_TIME, CUE_TRACK_POSITIONS, CUE_TRACK, CUE_CLUSTER_POSITION = (
+    0x1C53BB6B, 0xBB, 0xB3, 0xB7, 0xF7, 0xF1)
+VOID = 0xEC
+UNKNOWN_SIZE = b'\x01\xff\xff\xff\xff\xff\xff\xff'
+
+
+def _id(element_id):
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big')
+
+
+def _size(n, length=None):
+    """EBML variable-length size; ``length`` forces the encoded width (1-8 bytes)"""
+    if length is None:
+        length = 1
+        while n >= (1 << (7 * length)) - 1:
+            length += 1
+    return ((1 << (7 * length)) | n).to_bytes(length, 'big')
+
+
+def _element(element_id, payload):
+    return _id(element_id) + _size(len(payload)) + payload
+
+
+def _uint(element_id, value, length=None):
+    length = length or max(1, (value.bit_length() + 7) // 8)
+    return _element(element_id, value.to_bytes(length, 'big'))
+
+
+def _string(element_id, value):
+    return _element(element_id, value.encode('utf-8'))
+
+
+def _void(total):
+    """A Void element filling exactly ``total`` bytes (at least 9)"""
+    return _id(VOID) + _size(total - 9, 8) + bytes(total - 9)
+
+
+class MatroskaWriter:
+    """One MJPEG Matroska file, written sequentially and finished by ``close``"""
+
+    def __init__(self, path, width, height, buffer_size=1 << 20):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.bytes = 0
+        self.frames = 0
+        self._file = open(path, 'wb', buffering=buffer_size)
+        self._cluster = []
+        self._cluster_bytes = 0
+        self._cluster_start = None
+        self._first_ms = None
+        self._last_ms = 0
+        self._cues = []  # (cluster timestamp, cluster position)
+
+        self._write(_element(EBML, b''.join([
+            _uint(0x4286, 1), _uint(0x42F7, 1), _uint(0x42F2, 4), _uint(0x42F3, 8),
+            _string(0x4282, 'matroska'), _uint(0x4287, 4), _uint(0x4285, 2),
+        ])))
+        # The segment's size is filled in on close; until then it reads as "unknown"
+        self._write(_id(SEGMENT))
+        self._segment_size_at = self.bytes
+        self._write(UNKNOWN_SIZE)
+        self._segment_start = self.bytes
+        self._seek_head_at = self.bytes
+        self._write(_void(SEEK_HEAD_SPACE))
+        self._info_at = self.bytes - self._segment_start
+        info_head = _uint(TIMESTAMP_SCALE, 1000000) + _string(MUXING_APP, 'iphone-webcam')
+        duration = _element(DURATION, struct.pack('>d', 0.0))
+        info_tail = _string(WRITING_APP, 'iphone-webcam recorder')
+        info = _element(INFO, info_head + duration + info_tail)
+        # Duration is patched on close, so remember where its 8-byte float lands
+        self._duration_at = self.bytes + len(info) - len(info_tail) - 8
+        self._write(info)
+        self._tracks_at = self.bytes - self._segment_start
+        self._write(_element(TRACKS, _element(TRACK_ENTRY, b''.join([
+            _uint(TRACK_NUMBER, 1), _uint(TRACK_UID, 1), _uint(TRACK_TYPE, 1), _uint(FLAG_LACING, 0),
+            _string(CODEC_ID, 'V_MJPEG'),
+            _element(VIDEO, _uint(PIXEL_WIDTH, width) + _uint(PIXEL_HEIGHT, height)),
+        ]))))
+
+    @property
+    def duration(self):
+        """Milliseconds of video written so far"""
+        return 0 if self._first_ms is None else self._last_ms - self._first_ms
+
+    def add(self, data, timestamp):
+        """Append one JPEG captured at ``timestamp`` (seconds since the epoch)"""
+        ms = int(timestamp * 1000)
+        if self._first_ms is None:
+            self._first_ms = ms
+        # Keep timestamps monotonic; concurrent uploads can arrive slightly out of order
+        ms = max(ms - self._first_ms, self._last_ms - self._first_ms)
+        if self._cluster and (ms - self._cluster_start >= CLUSTER_DURATION_MS
+                              or self._cluster_bytes >= CLUSTER_MAX_BYTES):
+            self.flush()
+        if not self._cluster:
+            self._cluster_start = ms
+        # Track 1, timestamp relative to the cluster, keyframe flag
+        block = (_id(SIMPLE_BLOCK) + _size(len(data) + 4) + b'\x81'
+                 + struct.pack('>hB', ms - self._cluster_start, 0x80))
+        self._cluster.append(block)
+        self._cluster.append(data)
+        self._cluster_bytes += len(block) + len(data)
+        self._last_ms = ms + self._first_ms
+        self.frames += 1
+
+    def flush(self):
+        """Write the open cluster"""
+        if not self._cluster:
+            return
+        self._cues.append((self._cluster_start, self.bytes - self._segment_start))
+        timestamp = _uint(CLUSTER_TIMESTAMP, self._cluster_start)
+        self._write(_id(CLUSTER) + _size(len(timestamp) + self._cluster_bytes))
+        self._write(timestamp)
+        for part in self._cluster:
+            self._write(part)
+        self._cluster = []
+        self._cluster_bytes = 0
+
+    def close(self):
+        """Write the remaining frames and the seek index, then patch the header"""
+        self.flush()
+        cues_at = self.bytes - self._segment_start
+        self._write(_element(CUES, b''.join(
+            _element(CUE_POINT, _uint(CUE_TIME, start) + _element(
+                CUE_TRACK_POSITIONS, _uint(CUE_TRACK, 1) + _uint(CUE_CLUSTER_POSITION, position)))
+            for start, position in self._cues)))
+        seek_head = _element(SEEK_HEAD, b''.join(
+            _element(SEEK, _element(SEEK_ID, _id(element_id)) + _uint(SEEK_POSITION, position, 8))
+            for element_id, position in ((INFO, self._info_at), (TRACKS, self._tracks_at), (CUES, cues_at))))
+        segment_size = self.bytes - self._segment_start
+        self._file.seek(self._seek_head_at)
+        self._file.write(seek_head + _void(SEEK_HEAD_SPACE - len(seek_head)))
+        self._file.seek(self._duration_at)
+        self._file.write(struct.pack('>d', float(self.duration)))
+        self._file.seek(self._segment_size_at)
+        self._file.write(_size(segment_size, 8))
+        self._file.close()
+
+    def abort(self):
+        """Close the file as it is, e.g. after a write failed; the file plays up to its last complete cluster"""
+        try:
+            self._file.close()
+        except OSError:
+            pass
+
+    def _write(self, data):
+        self._file.write(data)
+        self.bytes += len(data)
+
+
+class Recorder:
+    """Records a stream of JPEGs into rotating Matroska files on a background thread.
+
+    Files are named ``<name>_<start time>.mkv`` in ``directory``; a new one
+    is started once the current file holds ``segment_bytes`` or
+    ``segment_seconds`` of video, and when the JPEG dimensions change, as
+    a track has one size. ``write`` never blocks: frames that find
+    ``queue_frames`` frames already waiting are dropped from the recording.
+    """
+
+    def __init__(self, directory, name, segment_bytes=1 << 30, segment_seconds=900, queue_frames=90,
+                 buffer_size=1 << 20):
+        self.directory = directory
+        self.name = name
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.buffer_size = buffer_size
+        self._queue = queue.Queue(queue_frames)
+        self._writer = None
+        self.files = []
+        self.frames = 0
+        self.dropped = 0
+        self.bytes = 0
+        self.failed = False
+        os.makedirs(directory, exist_ok=True)
+        # Not a daemon, so the interpreter waits for the current file to be finished before exiting
+        self._thread = threading.Thread(target=self._run, name=f"recorder-{name}")
+        self._thread.start()
+
+    def write(self, data, timestamp=None):
+        """Queue a JPEG (bytes the caller won't modify) for the recording; False if it was dropped"""
+        if self.failed:
+            self.dropped += 1
+            return False
+        try:
+            self._queue.put_nowait((data, time.time() if timestamp is None else timestamp))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self):
+        """Stop recording; the frames already queued are still written"""
+        while True:
+            try:
+                self._queue.put_nowait(None)
+                return
+            except queue.Full:
+                # Backed up disk: give up on the oldest waiting frame rather than on finishing the file
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            'file': self._writer.path if self._writer is not None else None,
+            'files': len(self.files),
+            'frames': self.frames,
+            'dropped': self.dropped,
+            'bytes': self.bytes,
+            'queued': self._queue.qsize(),
+            'failed': self.failed,
+        }
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=IDLE_FLUSH_INTERVAL)
+            except queue.Empty:
+                item = False
+            try:
+                if item is None:
+                    self._finish()
+                    return
+                if item is False:
+                    if self._writer is not None:
+                        self._writer.flush()
+                    continue
+                self._record(*item)
+            except OSError as e:
+                print(f"[Recorder] {self.name}: {e}; recording stopped")
+                self.failed = True
+                if self._writer is not None:
+                    writer, self._writer = self._writer, None
+                    writer.abort()
+                if item is None:
+                    return
+
+    def _record(self, data, timestamp):
+        writer = self._writer
+        size = jpeg_size(data)
+        if writer is not None and (writer.bytes >= self.segment_bytes
+                                   or writer.duration >= self.segment_seconds * 1000
+                                   or (size is not None and size != (writer.width, writer.height))):
+            self._finish()
+            writer = None
+        if writer is None:
+            width, height = size or (0, 0)
+            stamp = datetime.fromtimestamp(timestamp).strftime('%Y%m%d-%H%M%S')
+            path = os.path.join(self.directory, f"{self.name}_{stamp}.mkv")
+            if os.path.exists(path):
+                path = os.path.join(self.directory, f"{self.name}_{stamp}_{len(self.files)}.mkv")
+            writer = self._writer = MatroskaWriter(path, width, height, self.buffer_size)
+            self.files.append(path)
+            print(f"[Recorder] Recording {self.name} to {path}")
+        writer.add(data, timestamp)
+        self.frames += 1
+        self.bytes += len(data)
+
+    def _finish(self):
+        if self._writer is not None:
+            writer, self._writer = self._writer, None
+            writer.close()
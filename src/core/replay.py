@@ -0,0 +1,182 @@
+"""
+Replay an ingest capture through the server's frame path
+
+    python replay.py ../../captures/ingest_20250101-120000.ipwc   # at the recorded speed
+    python replay.py CAPTURE --speed 4                           # four times as fast
+    python replay.py CAPTURE --fast                              # as fast as the server takes them
+
+Frames go through the same admission control, process_frame(), decoder pool
+and per-session output stages as live uploads, with the server's settings
+from main.py; only the virtual cameras are left out unless --camera is
+given. HTTP bodies are read -- and inflated, if they were sent compressed --
+into pooled body buffers by the upload route's read_body(). Capture times
+keep their distance from the frame's arrival, so the capture latency stages
+are measured too. At the end the throughput, the frame counters and the
+latency percentiles of every stage are printed (--json prints them as JSON,
+for comparing runs).
+"""
+
+import argparse
+import io
+import json
+import sys
+import time
+
+import main as server
+from capture import CaptureReader
+from ingest import IngestError, read_body
+
+DRAIN_TIMEOUT = 5.0  # Seconds to wait for queued frames to be decoded and output after the last one
+
+
+def submit(frame, clock_offset=0.0):
+    """Hand one captured frame to the server the way its route would; returns the HTTP status.
+
+    ``clock_offset`` is how much later than recorded the frame is replayed;
+    its capture time is moved by as much.
+    """
+    session = server.sessions.open(frame.session or server.DEFAULT_SESSION)
+    if session is None:
+        return 503
+    headers = frame.headers
+    max_fps = headers.get('X-Max-FPS')
+    if max_fps and max_fps.isdigit() and int(max_fps) > 0:
+        session.controller.set_max_fps(int(max_fps))
+    capture_time = None
+    if 'X-Capture-Time' in headers:
+        try:
+            capture_ms = float(headers['X-Capture-Time']) + clock_offset * 1000
+        except ValueError:
+            capture_ms = None
+        capture_time = server.capture_time_from(capture_ms)
+    rejection = server.admission.enter(session.id, server.pipeline.backlog_delay())
+    if rejection is not None:
+        server.metrics.inc('frames_shed', reason=rejection.reason)
+        return rejection.status
+    try:
+        if headers.get('transport') == 'ws':
+            # A WebSocket frame is a view into the message it arrived in
+            return server.process_frame(memoryview(bytes(frame.body)), session=session,
+                                        capture_time=capture_time)[1]
+        content_length = headers.get('Content-Length', '')
+        buf = server.body_buffers.acquire()
+        try:
+            length = read_body(io.BytesIO(frame.body), buf, server.MAX_FRAME_SIZE,
+                               content_length=int(content_length) if content_length.isdigit() else None,
+                               encoding=headers.get('Content-Encoding'))
+        except IngestError as e:
+            server.body_buffers.release(buf)
+            server.metrics.inc('frames_rejected', reason=server.INGEST_REJECT_REASONS.get(e.status, 'invalid_body'))
+            return e.status
+        return server.process_frame(memoryview(buf)[:length], session=session, buffer=buf,
+                                    capture_time=capture_time)[1]
+    finally:
+        server.admission.leave(session.id)
+
+
+def replay(reader, speed=1.0, loops=1):
+    """Submit every frame of ``reader`` ``loops`` times; ``speed`` None means as fast as possible"""
+    if speed is not None and speed <= 0:
+        raise ValueError('speed must be above 0, or None for as fast as possible')
+    statuses = {}
+    first = reader[0].arrival
+    # Loops follow each other at the capture's mean frame interval
+    period = reader.duration() * len(reader) / max(1, len(reader) - 1)
+    started = time.perf_counter()
+    for loop in range(loops):
+        for frame in reader:
+            if speed is not None:
+                delay = started + (loop * period + frame.arrival - first) / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            status = submit(frame, time.time() - frame.arrival)
+            statuses[status] = statuses.get(status, 0) + 1
+    submitted = time.perf_counter() - started
+    drain()
+    return statuses, submitted, time.perf_counter() - started
+
+
+def drain():
+    """Wait until no frame is waiting for a decoder or for its output stage"""
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    while time.monotonic() < deadline:
+        stats = server.pipeline.stats()
+        if stats['ingest_depth'] == 0 and stats['decoded_depth'] == 0:
+            break
+        time.sleep(0.01)
+    # Let the output stages pick up what the decoders just finished
+    time.sleep(2.0 / server.OUTPUT_FPS)
+
+
+def report(reader, statuses, submitted, elapsed, speed, loops):
+    stats = server.pipeline.stats()
+    frames = len(reader) * loops
+    payload = sum(len(frame.body) for frame in reader) * loops
+    return {
+        'capture': reader.path,
+        'speed': 'fast' if speed is None else speed,
+        'frames': frames,
+        'sessions': len({frame.session for frame in reader}),
+        'submit_seconds': round(submitted, 3),
+        'elapsed_seconds': round(elapsed, 3),
+        'frames_per_second': round(frames / submitted, 1) if submitted else None,
+        'megabytes_per_second': round(payload / submitted / 1e6, 2) if submitted else None,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'pipeline': {name: stats[name] for name in ('submitted', 'decoded', 'decode_failed', 'expired', 'unrouted',
+                                                    'ingest_dropped', 'ingest_superseded', 'decoded_dropped',
+                                                    'output', 'output_failed', 'stale', 'repeated')},
+        'latency': server.metrics.stage_summary(),
+    }
+
+
+def print_report(result):
+    print(f"\nReplayed {result['frames']} frames from {result['sessions']} session(s) "
+          f"at {result['speed']}{'x' if result['speed'] != 'fast' else ''} speed")
+    print(f"Submitted in {result['submit_seconds']:.2f}s: {result['frames_per_second']} frames/s, "
+          f"{result['megabytes_per_second']} MB/s (done after {result['elapsed_seconds']:.2f}s)")
+    print("Statuses: " + ", ".join(f"{status} x{count}" for status, count in result['statuses'].items()))
+    print("Pipeline: " + ", ".join(f"{name} {value}" for name, value in result['pipeline'].items()))
+    print(f"\n{'stage':<14}{'count':>8}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}  (ms)")
+    for stage, summary in result['latency'].items():
+        print(f"{stage:<14}{summary['count']:>8}{summary['mean_ms']:>10.3f}{summary['p50_ms']:>10.3f}"
+              f"{summary['p90_ms']:>10.3f}{summary['p99_ms']:>10.3f}{summary['max_ms']:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('capture', help='capture file written with CAPTURE_INGEST')
+    pace = parser.add_mutually_exclusive_group()
+    pace.add_argument('--speed', type=float, default=1.0, help='multiple of the recorded speed (default 1)')
+    pace.add_argument('--fast', action='store_true', help='submit frames as fast as the server takes them')
+    parser.add_argument('--loops', type=int, default=1, help='play the capture this many times')
+    parser.add_argument('--camera', action='store_true', help='send frames to the virtual cameras too')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+    if not args.fast and args.speed <= 0:
+        parser.error('--speed must be above 0; use --fast to replay as fast as the server takes frames')
+
+    reader = CaptureReader(args.capture)
+    if not len(reader):
+        sys.exit(f"{args.capture} holds no frames")
+    if reader.truncated:
+        print(f"[Warning] {args.capture} ends in an incomplete frame; replaying the {len(reader)} complete ones")
+    speed = None if args.fast else args.speed
+
+    server.VIRTUAL_CAMERA_ENABLED = args.camera
+    server.sessions.idle_timeout = None  # A slow replay must not expire its own sessions
+    server.decoders.benchmark()  # Pick decoders the way the server does at startup
+    server.pipeline.start()
+    try:
+        statuses, submitted, elapsed = replay(reader, speed, args.loops)
+        result = report(reader, statuses, submitted, elapsed, speed, args.loops)
+    finally:
+        server.close_sessions()
+        server.pipeline.stop()
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == '__main__':
+    main()
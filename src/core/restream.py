@@ -0,0 +1,78 @@
+"""
+JPEG passthrough restream
+
+Viewers of ``/stream.mjpg`` get the phone's JPEG bytes exactly as they were
+uploaded -- nothing is decoded or re-encoded for them. Every viewer thread
+waits on the session's FrameStore and writes the newest frame to its own
+socket at its own pace. A viewer still busy writing when newer frames arrive
+skips straight to the newest one, so a slow viewer never holds up the
+uploads or the other viewers.
+"""
+
+import threading
+
+BOUNDARY = 'frame'
+KEEPALIVE_INTERVAL = 5.0  # Seconds without frames after which a viewer is sent the last one again
+
+
+class Broadcaster:
+    """MJPEG streams of the encoded frames in a FrameStore, for up to ``max_viewers`` viewers"""
+
+    def __init__(self, store, max_viewers=8):
+        self.store = store
+        self.max_viewers = max_viewers
+        self._lock = threading.Lock()
+        self.viewers = 0
+        self.refused = 0
+        self.sent = 0
+        self.skipped = 0
+
+    def stream(self):
+        """A ``multipart/x-mixed-replace`` response body for one viewer, or None when there are too many.
+
+        The viewer only takes a slot once the body is iterated, so a response
+        that is never sent doesn't hold one.
+        """
+        with self._lock:
+            if self.viewers >= self.max_viewers:
+                self.refused += 1
+                return None
+        return self._parts()
+
+    def stats(self):
+        return {'viewers': self.viewers, 'viewers_refused': self.refused,
+                'frames_sent': self.sent, 'frames_skipped': self.skipped}
+
+    def _parts(self):
+        with self._lock:
+            if self.viewers >= self.max_viewers:
+                # Others took the last slots since stream() was called; end the body straight away
+                self.refused += 1
+                return
+            self.viewers += 1
+        last = None
+        try:
+            yield b''  # Send the headers now rather than with the first frame
+            while True:
+                try:
+                    frame = self.store.wait(after=last.seq if last else 0, timeout=KEEPALIVE_INTERVAL)
+                except EOFError:
+                    return
+                if frame is None:
+                    # Nothing new for a while; repeating the last frame shows whether the viewer is still there
+                    frame = last
+                    if frame is None:
+                        continue
+                else:
+                    with self._lock:
+                        self.sent += 1
+                        if last is not None:
+                            self.skipped += frame.index - last.index - 1
+                    last = frame
+                yield (f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                       f"Content-Length: {len(frame.data)}\r\n\r\n").encode('ascii')
+                yield frame.data
+                yield b'\r\n'
+        finally:
+            with self._lock:
+                self.viewers -= 1
@@ -0,0 +1,123 @@
+"""
+Fixed-resolution output scaling
+
+The virtual camera is opened once at a fixed resolution. Frames of any
+incoming size are scaled (and optionally letterboxed) into it, so a
+resolution change on the phone costs one resize instead of a device re-init.
+"""
+
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+MAX_PLANS = 8  # Input sizes whose plans are kept; clients choose the sizes, so the least recent go
+
+
+class ScalePlan:
+    """Cached scaling parameters for one input size"""
+
+    __slots__ = ('width', 'height', 'x', 'y', 'interpolation', 'letterboxed')
+
+    def __init__(self, width, height, x, y, interpolation, letterboxed):
+        self.width = width
+        self.height = height
+        self.x = x
+        self.y = y
+        self.interpolation = interpolation
+        self.letterboxed = letterboxed
+
+
+class FrameScaler:
+    """Fits frames of any size into a fixed output resolution.
+
+    ``interpolation`` is ``'fast'`` (bilinear) or ``'quality'`` (area when
+    shrinking, bicubic when enlarging). With ``letterbox`` the aspect ratio
+    is kept and the borders are black; otherwise the frame is stretched.
+    """
+
+    INTERPOLATIONS = ('fast', 'quality')
+
+    def __init__(self, width, height, letterbox=True, interpolation='fast'):
+        if interpolation not in self.INTERPOLATIONS:
+            raise ValueError(f"Unknown interpolation '{interpolation}', expected one of {self.INTERPOLATIONS}")
+        self.width = width
+        self.height = height
+        self.letterbox = letterbox
+        self.interpolation = interpolation
+        self._plans = OrderedDict()  # Least recently used first
+        self._lock = threading.Lock()
+
+    def plan(self, in_width, in_height):
+        """Return the (cached) scaling plan for an input size"""
+        key = (in_width, in_height)
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                return plan
+        plan = self._make_plan(in_width, in_height)
+        with self._lock:
+            self._plans[key] = plan
+            if len(self._plans) > MAX_PLANS:
+                self._plans.popitem(last=False)
+        return plan
+
+    def scale(self, img, out=None):
+        """Scale an image to the output resolution, into ``out`` when given.
+
+        Images that already have the output size are returned as-is.
+        """
+        in_height, in_width = img.shape[:2]
+        if (in_width, in_height) == (self.width, self.height):
+            return img
+
+        plan = self.plan(in_width, in_height)
+        if out is None:
+            out = np.empty((self.height, self.width) + img.shape[2:], dtype=img.dtype)
+        if plan.letterboxed:
+            self._clear_borders(out, plan)
+        region = out[plan.y:plan.y + plan.height, plan.x:plan.x + plan.width]
+        cv2.resize(img, (plan.width, plan.height), dst=region, interpolation=plan.interpolation)
+        return out
+
+    def stats(self):
+        """Output geometry and the number of cached input sizes"""
+        return {
+            'output_resolution': f"{self.width}x{self.height}",
+            'letterbox': self.letterbox,
+            'interpolation': self.interpolation,
+            'cached_plans': len(self._plans),
+        }
+
+    @staticmethod
+    def _clear_borders(out, plan):
+        # Only the bars need clearing; recycled buffers may hold an older frame
+        bottom = plan.y + plan.height
+        right = plan.x + plan.width
+        out[:plan.y] = 0
+        out[bottom:] = 0
+        out[plan.y:bottom, :plan.x] = 0
+        out[plan.y:bottom, right:] = 0
+
+    def _make_plan(self, in_width, in_height):
+        if self.letterbox:
+            ratio = min(self.width / in_width, self.height / in_height)
+            width = min(self.width, max(1, round(in_width * ratio)))
+            height = min(self.height, max(1, round(in_height * ratio)))
+        else:
+            ratio = min(self.width / in_width, self.height / in_height)
+            width, height = self.width, self.height
+        x = (self.width - width) // 2
+        y = (self.height - height) // 2
+
+        if self.interpolation == 'fast':
+            interpolation = cv2.INTER_LINEAR
+        elif ratio < 1:
+            interpolation = cv2.INTER_AREA
+        else:
+            interpolation = cv2.INTER_CUBIC
+
+        letterboxed = (width, height) != (self.width, self.height)
+        return ScalePlan(width, height, x, y, interpolation, letterboxed)
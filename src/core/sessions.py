@@ -0,0 +1,191 @@
+"""
+Publisher sessions
+
+Every phone negotiates a session when its page loads and sends the session
+id with each frame. A session owns what used to be global server state: its
+rate controller, its virtual camera and the camera's conversion buffers, and
+its counters, so several phones can stream at once without fighting over
+one camera. Each session takes the lowest free slot, and slot N outputs to
+the N-th configured camera device.
+"""
+
+import re
+import secrets
+import threading
+import time
+
+from framestore import FrameStore
+
+# Client-supplied ids are echoed into logs and stats; keep them tame
+SESSION_ID = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+
+class Session:
+    """State of one publisher and the frame sink it feeds"""
+
+    def __init__(self, session_id, slot, device, controller, frame_pool=None):
+        self.id = session_id
+        self.slot = slot
+        self.device = device
+        self.controller = controller
+        self.worker = None  # Prefork worker the session is pinned to
+        self.worker_seq = 0  # Newest frame taken from its shared memory slot
+        self.created = self.last_seen = time.monotonic()
+        self.frames = 0
+        self.bytes = 0
+        self.store = FrameStore(frame_pool)  # Newest uploaded and decoded frame, for consumers inside the server
+        # Frame sink state, only touched by the session's output thread
+        self.virtual_cam = None
+        self.last_shape = None
+        self.frame_out = None
+        self.camera_retry_at = 0.0
+        self.bus = None  # Frame bus other local processes read the decoded frames from
+        self.restream = None  # Hands the uploaded JPEGs to /stream.mjpg and /snapshot.jpg viewers
+        self.recorder = None  # Writes the uploaded JPEGs to disk while the session is recorded
+
+    @property
+    def camera_name(self):
+        return self.device or f"default #{self.slot}"
+
+    def touch(self, size=0, now=None):
+        """Record activity; ``size`` is the byte count of an accepted frame"""
+        self.last_seen = time.monotonic() if now is None else now
+        if size:
+            self.frames += 1
+            self.bytes += size
+
+    def close_camera(self):
+        if self.virtual_cam is not None:
+            try:
+                self.virtual_cam.close()
+            except Exception:
+                pass
+            self.virtual_cam = None
+
+    def stats(self, now=None):
+        now = time.monotonic() if now is None else now
+        return {
+            'slot': self.slot,
+            'camera': self.camera_name,
+            'camera_up': self.virtual_cam is not None,
+            'frames': self.frames,
+            'bytes': self.bytes,
+            'age_s': round(now - self.created, 1),
+            'idle_s': round(now - self.last_seen, 1),
+        }
+
+
+class SessionRegistry:
+    """Live sessions by id, bounded to ``max_sessions`` and expired when idle.
+
+    ``on_open(session)`` runs under the registry lock before the session can
+    be looked up, so frames never arrive ahead of its sink; ``on_close``
+    runs outside the lock after the session has been removed. Decoded
+    frames in the sessions' stores come from ``frame_pool``.
+    """
+
+    def __init__(self, controller_factory, max_sessions=4, devices=(), idle_timeout=30.0,
+                 on_open=None, on_close=None, frame_pool=None):
+        self._controller_factory = controller_factory
+        self._frame_pool = frame_pool
+        self.max_sessions = max_sessions
+        self.devices = tuple(devices)
+        self.idle_timeout = idle_timeout
+        self._on_open = on_open or (lambda session: None)
+        self._on_close = on_close or (lambda session: None)
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.expired = 0
+        self.refused = 0
+
+    def open(self, session_id=None, now=None, slot=None):
+        """The live session ``session_id``, (re)created if unknown; None when all slots are taken.
+
+        Without an id the session gets a freshly generated one. A malformed
+        id raises ValueError rather than opening a session of its own, so a
+        bad client can't take a slot per request. ``slot`` forces the slot
+        of a new session, e.g. one assigned by another process.
+        """
+        if session_id is not None and not SESSION_ID.fullmatch(session_id):
+            raise ValueError('Malformed session id')
+        now = time.monotonic() if now is None else now
+        self.expire(now)
+        if session_id is None:
+            session_id = secrets.token_urlsafe(8)
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.touch(now=now)
+                return session
+            used = {s.slot for s in self._sessions.values()}
+            if slot is None:
+                slot = next((i for i in range(self.max_sessions) if i not in used), None)
+            elif slot in used:
+                slot = None
+            if slot is None:
+                self.refused += 1
+                return None
+            device = self.devices[slot] if slot < len(self.devices) else None
+            session = Session(session_id, slot, device, self._controller_factory(), self._frame_pool)
+            session.created = session.last_seen = now
+            self._on_open(session)
+            self._sessions[session_id] = session
+            self.opened += 1
+        print(f"[Session] {session_id} opened on slot {slot} ({session.camera_name})")
+        return session
+
+    def get(self, session_id):
+        """The live session ``session_id`` or None"""
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def by_slot(self, slot):
+        with self._lock:
+            return next((s for s in self._sessions.values() if s.slot == slot), None)
+
+    def close(self, session_id):
+        """Close a session now instead of waiting for it to expire"""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            print(f"[Session] {session_id} closed")
+            self._on_close(session)
+
+    def expire(self, now=None):
+        """Close sessions that sent nothing for ``idle_timeout`` seconds (never when it is None)"""
+        if self.idle_timeout is None:
+            return
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            stale = [s for s in self._sessions.values() if now - s.last_seen > self.idle_timeout]
+            for session in stale:
+                del self._sessions[session.id]
+            self.expired += len(stale)
+        for session in stale:
+            print(f"[Session] {session.id} expired after {self.idle_timeout:.0f}s idle")
+            self._on_close(session)
+
+    def close_all(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            self._on_close(session)
+
+    def sessions(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def stats(self):
+        return {
+            'sessions_open': len(self),
+            'sessions_max': self.max_sessions,
+            'sessions_opened': self.opened,
+            'sessions_expired': self.expired,
+            'sessions_refused': self.refused,
+        }
@@ -6,6 +6,22 @@ A complete wireless webcam solution in one file!
 Just run this file and scan the QR code with your iPhone camera.
 No additional files or complex setup required.
 
+This edition deliberately does not import the modules next to it, so it
+keeps its own smaller copies of what src/core/main.py gets from them:
+- RateController for ratecontrol.RateController
+- admit()/release_slot() for admission.AdmissionControl
+- TLSPendingSelector for ingest.TLSPendingSelector
+- Session/open_session() for sessions.SessionRegistry
+- /stream.mjpg for restream.Broadcaster
+- /clock and Session.latency for main.py's /clock and metrics.LatencyWindow
+It decodes inside the request and paces each camera with
+sleep_until_next_frame() instead of running the decode pool and paced
+output stages of pipeline.py; with one upload per phone at a time, the
+pacing sleep is what holds a phone to the camera's frame rate. Fixes to
+the shared modules need carrying over by hand, and so do changes to the
+page, which is a copy of the client in web/templates/index.html (as is
+the legacy iphone.html).
+
 Author: nightfury3128
 License: MIT
 Version: 2.0.0
@@ -13,6 +29,7 @@ Version: 2.0.0
 
 # ============================================================================
 # EMBEDDED HTML TEMPLATE
+# Kept in step with web/templates/index.html by hand (see the module docstring)
 # ============================================================================
 
 HTML_TEMPLATE = '''<!DOCTYPE html>
@@ -91,7 +108,7 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
       </div>
       <div class="metric">
         <div id="latencyValue" class="metric-value">--</div>
-        <div class="metric-label">Latency (ms)</div>
+        <div id="latencyLabel" class="metric-label">Latency (ms)</div>
       </div>
       <div class="metric">
         <div id="qualityValue" class="metric-value">--</div>
@@ -116,6 +133,7 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
     // Metric displays
     const fpsValue = document.getElementById('fpsValue');
     const latencyValue = document.getElementById('latencyValue');
+    const latencyLabel = document.getElementById('latencyLabel');
     const qualityValue = document.getElementById('qualityValue');
     const sizeValue = document.getElementById('sizeValue');
     
@@ -134,6 +152,9 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
     let frameSkipCounter = 0;
     let compressionLevel = 0.7;
     let dynamicResolution = false;
+    let serverRateControl = false;  // Set once the server sends rate recommendations
+    let lastSendTime = 0;
+    let retryAfterUntil = 0;  // Back-off requested by the server's admission control
     let currentWidth = 1280;
     let currentHeight = 720;
     let useWebP = false;
@@ -141,11 +162,254 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
 
     // Server URL
     const SERVER_URL = window.location.href.replace(/\\/$/, '') + '/upload';
+    const SESSION_URL = window.location.href.replace(/\\/$/, '') + '/session';
+
+    // Each phone gets its own server session and virtual camera, kept across reloads of this tab
+    let sessionId = sessionStorage.getItem('sessionId');
+
+    async function negotiateSession() {
+      try {
+        const response = await fetch(SESSION_URL, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ resume: sessionId })
+        });
+        const session = await response.json();
+        if (!response.ok) {
+          status.textContent = session.error || 'No free session on the server';
+          return;
+        }
+        sessionId = session.session;
+        sessionStorage.setItem('sessionId', sessionId);
+      } catch (err) {
+        console.log('Session negotiation failed, using the shared session');
+      }
+    }
+    const sessionReady = negotiateSession();
+
+    // Glass-to-glass latency: frames carry their capture time in the server's clock and the server
+    // answers with the capture-to-virtual-camera percentiles of the recent frames
+    const CLOCK_URL = window.location.href.replace(/\\/$/, '') + '/clock';
+    const CLOCK_SYNC_SAMPLES = 8;  // Round trips per sync; the shortest one gives the offset
+    const CLOCK_SYNC_INTERVAL = 60000;  // Re-sync every minute as the phone's clock drifts
+    let clockOffset = null;  // Server clock minus ours, in ms; null until synced
+    let clockSyncTimer = null;
+    let videoFrameTime = null;  // Capture time of the video's current frame (performance.now() clock)
+    let trackingVideoFrames = false;
+    let captureLatency = null;  // { p50_ms, p95_ms } from the server
+
+    function clockNow() {
+      return performance.timeOrigin + performance.now();
+    }
+
+    // NTP-style: the offset from the request/reply pair with the shortest round trip
+    async function syncClock() {
+      let best = null;
+      for (let i = 0; i < CLOCK_SYNC_SAMPLES; i++) {
+        try {
+          const t0 = clockNow();
+          const response = await fetch(CLOCK_URL, { cache: 'no-store' });
+          const { receive, transmit } = await response.json();
+          const t3 = clockNow();
+          const rtt = (t3 - t0) - (transmit - receive);
+          if (!best || rtt < best.rtt) {
+            best = { rtt, offset: ((receive - t0) + (transmit - t3)) / 2 };
+          }
+        } catch (err) {
+          break;
+        }
+      }
+      if (best) clockOffset = best.offset;
+    }
+
+    // captureTime is when the sensor took the frame, where the browser knows it
+    function trackVideoFrames() {
+      if (trackingVideoFrames || !('requestVideoFrameCallback' in HTMLVideoElement.prototype)) return;
+      trackingVideoFrames = true;
+      const onVideoFrame = (now, metadata) => {
+        videoFrameTime = metadata.captureTime || metadata.presentationTime || now;
+        video.requestVideoFrameCallback(onVideoFrame);
+      };
+      video.requestVideoFrameCallback(onVideoFrame);
+    }
+
+    // Capture time of the frame being drawn now, in ms since the epoch by the server's clock
+    function captureTimeNow() {
+      if (clockOffset === null) return null;
+      return performance.timeOrigin + (videoFrameTime !== null ? videoFrameTime : performance.now()) + clockOffset;
+    }
+
+    // Capture to virtual camera once the server reports it, the upload round trip until then
+    function showLatency() {
+      if (captureLatency) {
+        latencyValue.textContent = `${Math.round(captureLatency.p50_ms)}/${Math.round(captureLatency.p95_ms)}`;
+        latencyLabel.textContent = 'Latency p50/p95 (ms)';
+      } else {
+        latencyValue.textContent = Math.round(networkLatency);
+        latencyLabel.textContent = 'Round trip (ms)';
+      }
+    }
+
+    // Persistent WebSocket ingest, POST fallback
+    const WS_URL = (window.location.protocol === 'https:' ? 'wss://' : 'ws://') + window.location.host + '/ws';
+    const WS_MAX_IN_FLIGHT = 2;
+    let frameSocket = null;
+    let wsReady = false;
+    let wsPending = [];
+    let wsStalled = false;
+    let wsRetryTimer = null;
+
+    function connectWebSocket() {
+      if (!('WebSocket' in window) || frameSocket) return;
+      let socket;
+      try {
+        // timestamps=1: every frame header carries the capture time
+        socket = new WebSocket(WS_URL + '?timestamps=1' + (sessionId ? '&session=' + encodeURIComponent(sessionId) : ''));
+      } catch (err) {
+        console.log('WebSocket unavailable, using HTTP POST');
+        return;
+      }
+      socket.binaryType = 'arraybuffer';
+      frameSocket = socket;
+
+      socket.onopen = () => {
+        wsReady = true;
+        wsPending = [];
+        console.log('WebSocket ingest connected');
+        sendMaxFps();
+      };
+
+      socket.onmessage = (event) => {
+        const pending = wsPending.shift();
+        if (!pending) return;
+        let ack = {};
+        try { ack = JSON.parse(event.data); } catch (err) {}
+        if (ack.retry_after_ms) {
+          // Shed by the server; back off without touching quality
+          retryAfterUntil = Date.now() + ack.retry_after_ms;
+        } else {
+          applyRecommendation(ack.recommend);
+          if (ack.latency) captureLatency = ack.latency;
+          onFrameDelivered(Date.now() - pending.startTime, pending.size, ack.server_ms || 0);
+        }
+        if (wsStalled && streaming) {
+          wsStalled = false;
+          sendFrame();
+        }
+      };
+
+      socket.onclose = () => {
+        if (wsReady) console.log('WebSocket closed, falling back to HTTP POST');
+        frameSocket = null;
+        wsReady = false;
+        wsPending = [];
+        if (streaming && !wsRetryTimer) {
+          wsRetryTimer = setTimeout(() => {
+            wsRetryTimer = null;
+            if (streaming) connectWebSocket();
+          }, 5000);
+        }
+        if (wsStalled && streaming) {
+          wsStalled = false;
+          sendFrame();
+        }
+      };
+    }
+
+    function disconnectWebSocket() {
+      if (wsRetryTimer) {
+        clearTimeout(wsRetryTimer);
+        wsRetryTimer = null;
+      }
+      if (frameSocket) frameSocket.close();
+      wsStalled = false;
+    }
+
+    async function sendFrameOverWebSocket(blob, startTime, captureTime) {
+      // 4-byte big-endian length + 8-byte capture time (NaN if unknown) + frame bytes
+      const payload = new Uint8Array(await blob.arrayBuffer());
+      const message = new Uint8Array(12 + payload.byteLength);
+      const header = new DataView(message.buffer);
+      header.setUint32(0, payload.byteLength);
+      header.setFloat64(4, captureTime === null ? NaN : captureTime);
+      message.set(payload, 12);
+      wsPending.push({ startTime, size: blob.size });
+      frameSocket.send(message.buffer);
+    }
+
+    // Parse 'quality=0.7, fps=24, scale=1' from the X-Rate-Recommendation header (or another header like it)
+    function recommendationFrom(response, name = 'X-Rate-Recommendation') {
+      const header = response.headers.get(name);
+      if (!header) return null;
+      const rec = {};
+      header.split(',').forEach(part => {
+        const [key, value] = part.trim().split('=');
+        rec[key] = parseFloat(value);
+      });
+      return rec;
+    }
+
+    // Follow the server's rate controller instead of the local latency heuristics
+    function applyRecommendation(rec) {
+      if (!rec) return;
+      serverRateControl = true;
+      if (qualitySelect.value === 'auto') {
+        adaptiveQuality = rec.quality;
+        compressionLevel = rec.quality;
+      }
+      targetFPS = Math.min(parseInt(maxFpsSelect.value), rec.fps);
+      const [w, h] = resolutionSelect.value.split('x').map(Number);
+      currentWidth = Math.round(w * rec.scale);
+      currentHeight = Math.round(h * rec.scale);
+      dynamicResolution = rec.scale < 1;
+    }
+
+    // Tell the server's rate controller the highest frame rate we will send
+    function sendMaxFps() {
+      if (wsReady && frameSocket.readyState === WebSocket.OPEN) {
+        frameSocket.send(JSON.stringify({ max_fps: parseInt(maxFpsSelect.value) }));
+      }
+    }
+
+    // Back-off requested by a 429/503 reply, in ms
+    function retryAfterFrom(response) {
+      const ms = parseInt(response.headers.get('X-Retry-After-Ms'));
+      if (!isNaN(ms)) return ms;
+      const seconds = parseInt(response.headers.get('Retry-After'));
+      return isNaN(seconds) ? 1000 : seconds * 1000;
+    }
+
+    // Time the server spent on a POST after reading its body (the 'app' Server-Timing entry), in ms
+    function serverTimeFrom(response) {
+      const header = response.headers.get('Server-Timing');
+      const match = header && header.match(/(?:^|,)\\s*app;dur=([\\d.]+)/);
+      return match ? parseFloat(match[1]) : 0;
+    }
+
+    // Shared by WebSocket and POST once a frame is acknowledged
+    function onFrameDelivered(responseTime, size, serverTime = 0) {
+      // Only the network share of the round trip should drive the quality controls
+      monitorNetworkPerformance(Math.max(0, responseTime - serverTime));
+      frameDropCount = Math.max(0, frameDropCount - 1);
+
+      sizeValue.textContent = Math.round(size / 1024);
+      updateStatus(`Streaming... (${Math.round(size/1024)}KB, ${responseTime}ms)`, 'good');
+
+      frameCount++;
+      const now = performance.now();
+      if (!lastFrameTime) lastFrameTime = now;
+      if (now - lastFrameTime >= 1000) {
+        fpsValue.textContent = frameCount;
+        frameCount = 0;
+        lastFrameTime = now;
+      }
+    }
     
     // Network monitoring
     function monitorNetworkPerformance(responseTime) {
       networkLatency = responseTime;
-      latencyValue.textContent = Math.round(responseTime);
+      showLatency();
+      if (serverRateControl) return;  // The server's rate controller decides
       
       if (qualitySelect.value === 'auto') {
         if (responseTime > 1000) {
@@ -254,6 +518,7 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
         
         video.srcObject = stream;
         cameraStarted = true;
+        trackVideoFrames();
         updateStatus(`Camera started at ${w}x${h}. Ready to stream.`, 'good');
       } catch (err) {
         console.error('Camera start failed:', err);
@@ -264,6 +529,14 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
     // Send frame
     async function sendFrame() {
       if (!streaming || !cameraStarted || uploading) return;
+      if (Date.now() < retryAfterUntil) {
+        setTimeout(sendFrame, retryAfterUntil - Date.now());
+        return;
+      }
+      if (wsReady && wsPending.length >= WS_MAX_IN_FLIGHT) {
+        wsStalled = true;
+        return;
+      }
       if (video.videoWidth === 0 || video.videoHeight === 0) {
         updateStatus('Waiting for camera...', 'warning');
         setTimeout(sendFrame, 100);
@@ -272,7 +545,7 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
       
       // Frame rate control
       const frameInterval = 1000 / targetFPS;
-      const timeSinceLastFrame = Date.now() - lastSuccessTime;
+      const timeSinceLastFrame = Date.now() - lastSendTime;
       if (timeSinceLastFrame < frameInterval) {
         setTimeout(sendFrame, frameInterval - timeSinceLastFrame);
         return;
@@ -280,7 +553,7 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
       
       // Skip frames if struggling
       frameSkipCounter++;
-      if (networkLatency > 500 && frameSkipCounter % 2 === 0) {
+      if (!serverRateControl && networkLatency > 500 && frameSkipCounter % 2 === 0) {
         setTimeout(sendFrame, 50);
         return;
       }
@@ -303,9 +576,11 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
       } else {
         ctx.drawImage(video, 0, 0, currentWidth, currentHeight);
       }
+      const captureTime = captureTimeNow();
       
       uploading = true;
       const startTime = Date.now();
+      lastSendTime = startTime;
       
       let blob;
       if (useWebP) {
@@ -321,35 +596,49 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
         return;
       }
       
+      if (wsReady && frameSocket.readyState === WebSocket.OPEN) {
+        try {
+          await sendFrameOverWebSocket(blob, startTime, captureTime);
+          lastSuccessTime = Date.now();
+        } catch (e) {
+          console.error('WebSocket send failed:', e);
+        }
+        uploading = false;
+        if (streaming) {
+          setTimeout(sendFrame, Math.max(0, 1000 / targetFPS - (Date.now() - startTime)));
+        }
+        return;
+      }
+
       try {
+        const headers = {
+          'Content-Type': 'application/octet-stream',
+          'Connection': 'keep-alive',
+          'X-Max-FPS': maxFpsSelect.value,
+          'X-Session-Id': sessionId || ''
+        };
+        if (captureTime !== null) headers['X-Capture-Time'] = captureTime.toFixed(1);
         const response = await fetch(SERVER_URL, {
           method: 'POST',
-          headers: { 
-            'Content-Type': 'application/octet-stream',
-            'Connection': 'keep-alive'
-          },
+          headers,
           body: blob,
           signal: AbortSignal.timeout(5000)
         });
         
+        if (response.status === 429 || response.status === 503) {
+          // Shed by the server's admission control; back off as told without touching quality
+          retryAfterUntil = Date.now() + retryAfterFrom(response);
+          updateStatus('Server busy - backing off', 'warning');
+          uploading = false;
+          if (streaming) setTimeout(sendFrame, retryAfterUntil - Date.now());
+          return;
+        }
+        
         const responseTime = Date.now() - startTime;
-        monitorNetworkPerformance(responseTime);
         lastSuccessTime = Date.now();
-        frameDropCount = Math.max(0, frameDropCount - 1);
-        
-        // Update metrics
-        sizeValue.textContent = Math.round(blob.size / 1024);
-        updateStatus(`Streaming... (${Math.round(blob.size/1024)}KB, ${responseTime}ms)`, 'good');
-        
-        // FPS calculation
-        frameCount++;
-        const now = performance.now();
-        if (!lastFrameTime) lastFrameTime = now;
-        if (now - lastFrameTime >= 1000) {
-          fpsValue.textContent = frameCount;
-          frameCount = 0;
-          lastFrameTime = now;
-        }
+        applyRecommendation(recommendationFrom(response));
+        captureLatency = recommendationFrom(response, 'X-Capture-Latency') || captureLatency;
+        onFrameDelivered(responseTime, blob.size, serverTimeFrom(response));
         
       } catch (e) {
         frameDropCount++;
@@ -369,7 +658,7 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
       
       uploading = false;
       if (streaming) {
-        const nextFrameDelay = Math.max(16, 1000 / targetFPS);
+        const nextFrameDelay = Math.max(0, 1000 / targetFPS - (Date.now() - startTime));
         setTimeout(sendFrame, nextFrameDelay);
       }
     }
@@ -385,6 +674,7 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
     };
 
     maxFpsSelect.onchange = () => {
+      sendMaxFps();
       targetFPS = parseInt(maxFpsSelect.value);
     };
 
@@ -428,6 +718,10 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
         startBtn.textContent = '🛑 Stop Streaming';
         startBtn.className = 'stop-btn';
         await requestWakeLock();
+        await sessionReady;
+        connectWebSocket();
+        syncClock();
+        if (!clockSyncTimer) clockSyncTimer = setInterval(syncClock, CLOCK_SYNC_INTERVAL);
         sendFrame();
         
       } else {
@@ -436,10 +730,17 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
         startBtn.className = 'start-btn';
         updateStatus('Stopped', 'warning');
         await releaseWakeLock();
+        disconnectWebSocket();
+        if (clockSyncTimer) {
+          clearInterval(clockSyncTimer);
+          clockSyncTimer = null;
+        }
+        captureLatency = null;
         
         // Reset metrics
         fpsValue.textContent = '--';
         latencyValue.textContent = '--';
+        latencyLabel.textContent = 'Latency (ms)';
         qualityValue.textContent = '--';
         sizeValue.textContent = '--';
       }
@@ -460,11 +761,19 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
 
 import sys
 import os
+import itertools
+import json
+import re
+import secrets
+import selectors
 import socket
+import ssl
+import struct
 import threading
 import time
 import webbrowser
 import subprocess
+from collections import deque
 from contextlib import closing
 from datetime import datetime, timedelta
 
@@ -473,6 +782,8 @@ try:
     import cv2
     import numpy as np
     from flask import Flask, request, Response, make_response
+    from flask_sock import Sock
+    from simple_websocket import ConnectionClosed
     import pyvirtualcam
     from OpenSSL import crypto
     import qrcode
@@ -482,7 +793,7 @@ except ImportError as e:
     print("📦 Installing required packages...")
     
     packages = [
-        "flask", "opencv-python", "numpy", "pyvirtualcam", 
+        "flask", "flask-sock", "opencv-python", "numpy", "pyvirtualcam", 
         "pyOpenSSL", "qrcode[pil]", "pillow"
     ]
     
@@ -498,11 +809,35 @@ except ImportError as e:
 
 # Global variables
 app = Flask(__name__)
-frame = None
-virtual_cam = None
-last_shape = None
+sock = Sock(app)
+frame_seq = itertools.count(1)  # Sequence number of accepted frames
 ENABLE_COMPRESSION = True
 MAX_FRAME_SIZE = 1024 * 1024  # 1MB
+FRAME_HEADER = struct.Struct('>I')  # WebSocket frame length prefix
+TIMED_FRAME_HEADER = struct.Struct('>Id')  # With /ws?timestamps=1: length and capture time (ms since the epoch)
+RATE_CONTROL_WINDOW = 0.25  # Seconds of arrivals per rate controller decision
+MAX_UPLOADS_PER_PUBLISHER = 1  # Frames from one phone processed at once; more get 429
+MAX_UPLOADS_IN_FLIGHT = 4  # Frames processed at once overall; more get 503
+RETRY_AFTER = 0.05  # Seconds a shed publisher is asked to wait
+MAX_SESSIONS = 4  # Phones streaming at once, each to its own virtual camera
+SESSION_IDLE_TIMEOUT = 30  # Seconds of silence before a session and its camera are closed
+SESSION_ID = re.compile(r'[A-Za-z0-9_-]{1,64}')  # Client-supplied ids are echoed into logs and stats
+MAX_STREAM_VIEWERS = 8  # /stream.mjpg viewers per session
+LATENCY_WINDOW = 120  # Recent frames the capture latency percentiles are taken over
+MAX_CAPTURE_AGE = 60  # Capture times further than this many seconds from now are ignored as a failed sync
+uploads_in_flight = {}
+uploads_lock = threading.Lock()
+shed_counts = {'publisher_busy': 0, 'server_busy': 0}
+
+class TLSPendingSelector(selectors.DefaultSelector):
+    """Also reports TLS sockets holding decrypted bytes, which select() can't see"""
+    def select(self, timeout=None):
+        ready = [(key, selectors.EVENT_READ) for key in self.get_map().values()
+                 if isinstance(key.fileobj, ssl.SSLSocket) and key.fileobj.pending()]
+        return ready or super().select(timeout)
+
+app.config['SOCK_SERVER_OPTIONS'] = {'ping_interval': 25, 'selector_class': TLSPendingSelector,
+                                     'max_message_size': 4 * (MAX_FRAME_SIZE + 4)}
 
 def get_local_ip():
     """Get local IP address"""
@@ -591,31 +926,25 @@ def open_browser_after_delay(url, delay=3):
             pass
     threading.Thread(target=delayed_open, daemon=True).start()
 
-def init_virtual_camera(width, height):
-    """Initialize virtual camera"""
-    global virtual_cam, last_shape
+def init_virtual_camera(session, width, height):
+    """Initialize the virtual camera of a session"""
     try:
-        if virtual_cam:
-            try:
-                virtual_cam.close()
-            except:
-                pass
-            virtual_cam = None
+        session.close_camera()
         
         backends = ['obs', 'unitycapture', 'windows'] if os.name == 'nt' else ['v4l2loopback']
         for backend in backends:
             try:
-                virtual_cam = pyvirtualcam.Camera(width=width, height=height, fps=30, backend=backend)
-                print(f"✅ Virtual camera initialized: {backend}")
+                session.virtual_cam = pyvirtualcam.Camera(width=width, height=height, fps=30, backend=backend)
+                print(f"✅ Virtual camera initialized: {backend} ({session.virtual_cam.device}, session {session.id})")
                 break
             except Exception:
                 continue
         
-        if virtual_cam is None:
+        if session.virtual_cam is None:
             print("⚠️  Virtual camera failed. Install OBS Studio for best results.")
             return False
         
-        last_shape = (width, height)
+        session.last_shape = (width, height)
         return True
     except Exception as e:
         print(f"⚠️  Virtual camera error: {e}")
@@ -625,45 +954,452 @@ def init_virtual_camera(width, height):
 def add_cors_headers(response):
     response.headers['Access-Control-Allow-Origin'] = '*'
     response.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, X-Max-FPS, X-Session-Id, X-Capture-Time'
+    response.headers['Access-Control-Expose-Headers'] = ('Server-Timing, X-Frame-Seq, X-Rate-Recommendation, '
+                                                         'X-Capture-Latency, Retry-After, X-Retry-After-Ms')
+    response.headers['Timing-Allow-Origin'] = '*'
     return response
 
 @app.route('/upload', methods=['POST', 'OPTIONS'])
 def upload():
-    global frame, virtual_cam, last_shape
     if request.method == 'OPTIONS':
         return make_response('', 204)
     
-    img_bytes = request.data
+    try:
+        session = open_session(request.headers.get('X-Session-Id') or None)
+    except ValueError as e:
+        return (str(e), 400)
+    if session is None:
+        return ('All session slots are taken', 503, {'Retry-After': str(SESSION_IDLE_TIMEOUT)})
+    
+    # Shed instead of queueing behind frames that are already being processed
+    publisher = session.id
+    status = admit(publisher)
+    if status:
+        return ('Server busy', status, retry_after_headers())
+    
+    started = time.perf_counter()
+    controller = session.controller
+    max_fps = request.headers.get('X-Max-FPS', type=int)
+    if max_fps:
+        controller.set_max_fps(max_fps)
+    try:
+        img_bytes = request.data
+        received = time.perf_counter()
+        message, status, timings = process_frame(img_bytes, session,
+                                                 capture_time_from(request.headers.get('X-Capture-Time')))
+    finally:
+        release_slot(publisher)
+    timings['recv'] = received - started
+    timings['app'] = time.perf_counter() - received
+    headers = {'Server-Timing': server_timing(timings)}
+    if status == 204:
+        headers['X-Frame-Seq'] = str(next(frame_seq))
+        controller.on_frame(len(img_bytes), time.monotonic(), busy_time(timings))
+        headers['X-Rate-Recommendation'] = ', '.join(f"{k}={v}" for k, v in controller.recommendation().items())
+        latency = session.capture_latency('output')
+        if latency:
+            headers['X-Capture-Latency'] = ', '.join(f"{k}={v}" for k, v in latency.items())
+    return (message, status, headers)
+
+def admit(publisher):
+    """Take an upload slot; returns None, or 429/503 when the upload must be shed"""
+    with uploads_lock:
+        if sum(uploads_in_flight.values()) >= MAX_UPLOADS_IN_FLIGHT:
+            shed_counts['server_busy'] += 1
+            return 503
+        if uploads_in_flight.get(publisher, 0) >= MAX_UPLOADS_PER_PUBLISHER:
+            shed_counts['publisher_busy'] += 1
+            return 429
+        uploads_in_flight[publisher] = uploads_in_flight.get(publisher, 0) + 1
+        return None
+
+def release_slot(publisher):
+    with uploads_lock:
+        uploads_in_flight[publisher] -= 1
+        if not uploads_in_flight[publisher]:
+            del uploads_in_flight[publisher]
+
+def retry_after_headers():
+    return {'Retry-After': '1', 'X-Retry-After-Ms': str(int(RETRY_AFTER * 1000))}
+
+@app.route('/stats')
+def stats():
+    """Uploads in flight, shed so far and open sessions"""
+    with uploads_lock:
+        uploads = {'in_flight': sum(uploads_in_flight.values()), 'shed': dict(shed_counts)}
+    with sessions_lock:
+        uploads['sessions'] = {s.id: {'slot': s.slot, 'frames': s.frames, 'camera_up': s.virtual_cam is not None,
+                                      **s.controller.recommendation(),
+                                      'capture_latency': {stage: s.capture_latency(stage) for stage in s.latency}}
+                               for s in sessions.values()}
+    return uploads
+
+@app.route('/clock')
+def clock():
+    """NTP-style clock sync: when this request arrived and when its reply left, in ms since the epoch"""
+    receive = time.time() * 1000
+    return ({'receive': receive, 'transmit': time.time() * 1000}, 200, {'Cache-Control': 'no-store'})
+
+def capture_time_from(value):
+    """A phone's capture time in ms since the epoch (our clock) as seconds, or None if unusable"""
+    try:
+        seconds = float(value) / 1000
+    except (TypeError, ValueError):
+        return None
+    return seconds if abs(time.time() - seconds) <= MAX_CAPTURE_AGE else None
+
+def server_timing(timings):
+    """Format stage durations in seconds as a Server-Timing header value"""
+    return ', '.join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items())
+
+def busy_time(timings):
+    """Server CPU time for a frame, leaving out the virtual camera's pacing sleep"""
+    return sum(timings.get(stage, 0.0) for stage in ('decode', 'convert', 'send'))
+
+class RateController:
+    """AIMD quality/FPS/capture-scale recommendation for one publisher.
+
+    Every window of arrivals is judged: frames arriving slower or more
+    irregularly than recommended cut quality (then FPS, then scale), a server
+    that can't keep up cuts FPS (then scale), and a clean window steps
+    quality, then FPS, then scale back up.
+    """
+
+    SCALES = (0.5, 0.75, 1.0)
+
+    def __init__(self, max_fps=30, min_fps=10, min_quality=0.3, max_quality=0.9):
+        self.min_fps, self.max_fps, self.fps_limit = min_fps, max_fps, max_fps
+        self.min_quality, self.max_quality = min_quality, max_quality
+        self.quality, self.fps, self.scale_index = 0.7, 20.0, len(self.SCALES) - 1
+        self.jitter = 0.0
+        self.last_arrival = None
+        self.lock = threading.Lock()
+        self.window_start, self.window_frames, self.window_busy = None, 0, 0.0
+        self.clean_windows, self.hold = 0, False
+
+    def set_max_fps(self, fps):
+        with self.lock:
+            self.max_fps = max(self.min_fps, min(self.fps_limit, fps))
+            self.fps = min(self.fps, self.max_fps)
+
+    def on_frame(self, size, now, busy):
+        with self.lock:
+            if self.last_arrival is not None:
+                self.jitter += (abs(now - self.last_arrival - 1.0 / self.fps) - self.jitter) / 16
+            self.last_arrival = now
+            if self.window_start is None:
+                self.window_start, self.window_frames, self.window_busy = now, 0, 0.0
+                return
+            self.window_frames += 1
+            self.window_busy += busy
+            elapsed = now - self.window_start
+            if elapsed >= RATE_CONTROL_WINDOW:
+                self._decide(self.window_frames / elapsed, self.window_busy / elapsed)
+                self.window_start, self.window_frames, self.window_busy = now, 0, 0.0
+
+    def recommendation(self):
+        with self.lock:
+            return {'quality': round(self.quality, 2), 'fps': int(self.fps), 'scale': self.SCALES[self.scale_index]}
+
+    def _decide(self, achieved_fps, load):
+        if load > 0.9:
+            # Decode and camera output alone fill the frame budget
+            self.hold, self.clean_windows = True, 0
+            if self.fps > self.min_fps:
+                self.fps = max(self.min_fps, self.fps * 0.8)
+            elif self.scale_index > 0:
+                self.scale_index -= 1
+        elif achieved_fps < self.fps * 0.8 or self.jitter > 0.5 / self.fps:
+            self.hold, self.clean_windows = True, 0
+            if self.quality > self.min_quality:
+                self.quality = max(self.min_quality, self.quality * 0.85)
+            elif self.fps > self.min_fps:
+                self.fps = max(self.min_fps, self.fps * 0.8)
+            elif self.scale_index > 0:
+                self.scale_index -= 1
+        elif self.hold:
+            self.hold = False
+        elif self.quality < self.max_quality:
+            self.quality = min(self.max_quality, self.quality + 0.05)
+        elif self.fps < self.max_fps:
+            self.fps = min(self.max_fps, self.fps + 2)
+        elif self.scale_index < len(self.SCALES) - 1:
+            self.clean_windows += 1
+            if self.clean_windows >= 4:
+                self.clean_windows = 0
+                self.scale_index += 1
+
+class Session:
+    """One phone: its rate controller and its own virtual camera"""
+
+    def __init__(self, session_id, slot):
+        self.id, self.slot = session_id, slot
+        self.controller = RateController()
+        self.virtual_cam, self.last_shape = None, None
+        self.frames, self.last_seen = 0, time.monotonic()
+        self.lock = threading.Lock()  # Serializes the camera between HTTP and WebSocket frames
+        # Newest uploaded JPEG for /stream.mjpg, /snapshot.jpg and /latest, passed through untouched;
+        # jpeg_count is its sequence number, swapped together with it under jpeg_ready
+        self.jpeg, self.jpeg_count, self.jpeg_time, self.viewers = None, 0, 0.0, 0
+        self.jpeg_ready = threading.Condition()
+        # Seconds from capture on the phone to each stage here, for the frames that came with a capture time
+        self.latency = {stage: deque(maxlen=LATENCY_WINDOW) for stage in ('received', 'decoded', 'output')}
+
+    def capture_latency(self, stage):
+        """p50/p95 in ms of the recent capture to ``stage`` latencies, or None"""
+        samples = sorted(self.latency[stage])
+        if not samples:
+            return None
+        pick = lambda q: max(0.0, samples[min(len(samples) - 1, int(q * len(samples)))])
+        return {'p50_ms': round(pick(0.5) * 1000, 1), 'p95_ms': round(pick(0.95) * 1000, 1)}
+
+    def publish_jpeg(self, data):
+        with self.jpeg_ready:
+            self.jpeg, self.jpeg_time = data, time.time()
+            self.jpeg_count += 1
+            self.jpeg_ready.notify_all()
+
+    def close_camera(self):
+        if self.virtual_cam:
+            try:
+                self.virtual_cam.close()
+            except:
+                pass
+            self.virtual_cam = None
+
+sessions = {}
+sessions_lock = threading.Lock()
+
+def open_session(session_id=None):
+    """The session ``session_id``, (re)created if unknown; None when all slots are taken.
+
+    None means the shared default session and '' a new one. A malformed id
+    raises ValueError instead of taking a slot of its own.
+    """
+    if session_id and not SESSION_ID.fullmatch(session_id):
+        raise ValueError('Malformed session id')
+    if not session_id:
+        session_id = 'default' if session_id is None else secrets.token_urlsafe(8)
+    now = time.monotonic()
+    with sessions_lock:
+        expired = [s for s in sessions.values() if now - s.last_seen > SESSION_IDLE_TIMEOUT]
+        for stale in expired:
+            del sessions[stale.id]
+        session = sessions.get(session_id)
+        if session is None:
+            used = {s.slot for s in sessions.values()}
+            slot = next((i for i in range(MAX_SESSIONS) if i not in used), None)
+            if slot is not None:
+                session = sessions[session_id] = Session(session_id, slot)
+                print(f"📱 Session {session_id} on slot {slot}")
+        if session is not None:
+            session.last_seen = now
+    for stale in expired:
+        with stale.lock:
+            stale.close_camera()
+    return session
+
+@app.route('/session', methods=['POST'])
+def negotiate_session():
+    """Open a session for a phone; ``{"resume": id}`` keeps the previous one"""
+    resume = (request.get_json(silent=True) or {}).get('resume')
+    if not isinstance(resume, str) or not SESSION_ID.fullmatch(resume):
+        resume = ''  # Not one of ours; start a new session
+    session = open_session(resume)
+    if session is None:
+        return ({'error': 'All session slots are taken'}, 503, {'Retry-After': str(SESSION_IDLE_TIMEOUT)})
+    return {'session': session.id, 'slot': session.slot}
+
+@sock.route('/ws')
+def ws_ingest(ws):
+    """WebSocket ingest of length-prefixed frames, one JSON ack per frame.
+
+    With ``?timestamps=1`` every length is followed by the frame's capture time.
+    """
+    try:
+        session = open_session(request.args.get('session') or None)
+    except ValueError as e:
+        ws.send(json.dumps({'status': 400, 'error': str(e)}))
+        ws.close(reason=1008, message=str(e))
+        return
+    if session is None:
+        ws.close(reason=1013, message='All session slots are taken')
+        return
+    publisher = session.id
+    controller = session.controller
+    header = TIMED_FRAME_HEADER if request.args.get('timestamps') == '1' else FRAME_HEADER
+    try:
+        while True:
+            data = ws.receive()
+            if isinstance(data, str):
+                # Control message, e.g. {"max_fps": 30}
+                try:
+                    max_fps = json.loads(data).get('max_fps')
+                except (ValueError, AttributeError):
+                    max_fps = None
+                if isinstance(max_fps, int) and max_fps > 0:
+                    controller.set_max_fps(max_fps)
+                continue
+            if not isinstance(data, (bytes, bytearray)):
+                continue
+            view = memoryview(data)
+            offset = 0
+            while offset < len(view):
+                if offset + header.size > len(view):
+                    ws.send(json.dumps({'status': 400, 'error': 'Truncated frame'}))
+                    break
+                length, *capture_ms = header.unpack_from(view, offset)
+                offset += header.size
+                shed = admit(publisher)
+                if shed:
+                    ws.send(json.dumps({'status': shed, 'error': 'Server busy',
+                                        'retry_after_ms': int(RETRY_AFTER * 1000)}))
+                    offset += length
+                    continue
+                started = time.perf_counter()
+                try:
+                    message, status, timings = process_frame(view[offset:offset + length], session,
+                                                             capture_time_from(capture_ms[0]) if capture_ms else None)
+                finally:
+                    release_slot(publisher)
+                ack = {'status': status, 'server_ms': round((time.perf_counter() - started) * 1000, 2)}
+                if status == 204:
+                    ack['seq'] = next(frame_seq)
+                    controller.on_frame(length, time.monotonic(), busy_time(timings))
+                    ack['recommend'] = controller.recommendation()
+                    latency = session.capture_latency('output')
+                    if latency:
+                        ack['latency'] = latency
+                offset += length
+                if message:
+                    ack['error'] = message
+                ws.send(json.dumps(ack))
+    except ConnectionClosed:
+        pass
+
+def process_frame(img_bytes, session, capture_time=None):
+    """Decode a frame and forward it to the session's virtual camera.
+
+    Returns ``(message, status, timings)`` with the time spent per stage in seconds.
+    ``capture_time`` is when the phone captured the frame, in our clock.
+    """
+    timings = {}
+    if capture_time is not None:
+        session.latency['received'].append(time.time() - capture_time)
     if not img_bytes or len(img_bytes) > MAX_FRAME_SIZE:
-        return ('Invalid frame', 400)
+        return ('Invalid frame', 400, timings)
     
     img_np = np.frombuffer(img_bytes, dtype=np.uint8)
     if img_np.size == 0:
-        return ('Empty buffer', 400)
+        return ('Empty buffer', 400, timings)
     
+    started = time.perf_counter()
     img = cv2.imdecode(img_np, cv2.IMREAD_COLOR)
+    timings['decode'] = time.perf_counter() - started
     if img is None:
-        return ('Decode failed', 400)
+        return ('Decode failed', 400, timings)
+    if capture_time is not None:
+        session.latency['decoded'].append(time.time() - capture_time)
     
-    frame = img
+    session.frames += 1
+    session.last_seen = time.monotonic()
+    if bytes(img_bytes[:3]) == b'\xff\xd8\xff':
+        session.publish_jpeg(bytes(img_bytes))
     
     # Update virtual camera
     if not os.path.exists('/.dockerenv'):
-        height, width = frame.shape[:2]
+        height, width = img.shape[:2]
         
-        if virtual_cam is None or last_shape != (width, height):
-            init_virtual_camera(width, height)
-        
-        if virtual_cam:
-            try:
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                virtual_cam.send(frame_rgb)
-                virtual_cam.sleep_until_next_frame()
-            except Exception:
-                virtual_cam = None
+        with session.lock:
+            if session.virtual_cam is None or session.last_shape != (width, height):
+                init_virtual_camera(session, width, height)
+            
+            if session.virtual_cam:
+                try:
+                    started = time.perf_counter()
+                    frame_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+                    converted = time.perf_counter()
+                    session.virtual_cam.send(frame_rgb)
+                    sent = time.perf_counter()
+                    if capture_time is not None:
+                        session.latency['output'].append(time.time() - capture_time)
+                    session.virtual_cam.sleep_until_next_frame()
+                    timings['convert'] = converted - started
+                    timings['send'] = sent - converted
+                    timings['pace'] = time.perf_counter() - sent
+                except Exception:
+                    session.virtual_cam = None
     
-    return ('', 204)
+    return ('', 204, timings)
+
+def viewed_session():
+    """The session asked for with ``?slot=N``, by default the lowest slot"""
+    slot = request.args.get('slot', type=int)
+    with sessions_lock:
+        candidates = sorted((s for s in sessions.values() if slot is None or s.slot == slot), key=lambda s: s.slot)
+    return candidates[0] if candidates else None
+
+@app.route('/stream.mjpg')
+def stream_mjpeg():
+    """The phone's own JPEGs as MJPEG; a slow viewer skips to the newest frame"""
+    session = viewed_session()
+    if session is None:
+        return ('No such session', 404)
+    with session.jpeg_ready:
+        if session.viewers >= MAX_STREAM_VIEWERS:
+            return ('Too many viewers', 503, {'Retry-After': '5'})
+
+    def parts():
+        # Take the viewer slot only once the body is sent, so an unsent response doesn't hold one
+        with session.jpeg_ready:
+            if session.viewers >= MAX_STREAM_VIEWERS:
+                return
+            session.viewers += 1
+        sent = 0
+        try:
+            yield b''  # Headers now, not with the first frame
+            while sessions.get(session.id) is session:
+                with session.jpeg_ready:
+                    session.jpeg_ready.wait_for(lambda: session.jpeg_count > sent, timeout=5)
+                    data, count = session.jpeg, session.jpeg_count
+                if data is None:
+                    continue
+                sent = count
+                yield b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n' % len(data)
+                yield data
+                yield b'\r\n'
+        finally:
+            with session.jpeg_ready:
+                session.viewers -= 1
+
+    return Response(parts(), mimetype='multipart/x-mixed-replace; boundary=frame',
+                    headers={'Cache-Control': 'no-store'})
+
+@app.route('/snapshot.jpg')
+def snapshot():
+    """The phone's newest JPEG, byte for byte"""
+    session = viewed_session()
+    if session is None or session.jpeg is None:
+        return ('No frame yet', 404)
+    with session.jpeg_ready:
+        data, seq, stamp = session.jpeg, session.jpeg_count, session.jpeg_time
+    return Response(data, mimetype='image/jpeg',
+                    headers={'Cache-Control': 'no-store', 'X-Frame-Seq': str(seq), 'X-Frame-Timestamp': f"{stamp:.6f}"})
+
+@app.route('/latest')
+def latest_frame():
+    """Long poll for the newest JPEG with a sequence number above ``?after=N``; 204 after 10s without one"""
+    session = viewed_session()
+    if session is None:
+        return ('No such session', 404)
+    after = request.args.get('after', 0, type=int)
+    with session.jpeg_ready:
+        if not session.jpeg_ready.wait_for(lambda: session.jpeg_count > after, timeout=10):
+            return ('', 204)
+        data, seq, stamp = session.jpeg, session.jpeg_count, session.jpeg_time
+    return Response(data, mimetype='image/jpeg',
+                    headers={'Cache-Control': 'no-store', 'X-Frame-Seq': str(seq), 'X-Frame-Timestamp': f"{stamp:.6f}"})
 
 @app.route('/')
 def index():
@@ -734,11 +1470,9 @@ def main():
         print(f"\n❌ Server error: {e}")
     finally:
         print("🧹 Cleaning up...")
-        if virtual_cam:
-            try:
-                virtual_cam.close()
-            except:
-                pass
+        with sessions_lock:
+            for session in sessions.values():
+                session.close_camera()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
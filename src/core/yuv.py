@@ -0,0 +1,183 @@
+"""
+YUV-native frame decoding for the virtual camera
+
+Browsers encode 4:2:0 JPEGs, which are already planar YCbCr inside. With
+libjpeg-turbo (PyTurboJPEG) we decode straight to those planes and hand them
+to pyvirtualcam as I420 or NV12, skipping the JPEG -> BGR -> RGB conversions
+and the RGB -> YUV conversion the virtual camera driver would do after that.
+Frames that libjpeg-turbo can't take this way (WebP, other subsampling, no
+library installed) are decoded by OpenCV and converted once.
+"""
+
+import threading
+
+import cv2
+import numpy as np
+
+from decoders import reduction_factor
+
+try:
+    from turbojpeg import TurboJPEG, TJSAMP_420
+except ImportError:
+    TurboJPEG = None
+    TJSAMP_420 = 2
+
+PIXEL_FORMATS = ('i420', 'nv12')
+
+# Full-range black, matching the JPEG YCbCr planes
+LUMA_BLACK = 0
+CHROMA_NEUTRAL = 128
+
+
+def load_turbojpeg():
+    """Return a TurboJPEG instance, or None when the binding or the library is missing"""
+    if TurboJPEG is None:
+        return None
+    try:
+        return TurboJPEG()
+    except Exception as e:
+        print(f"[Info] libjpeg-turbo not available, YUV frames will be converted by OpenCV: {e}")
+        return None
+
+
+def yuv_to_rgb(frame, pixel_format):
+    """Convert a planar I420/NV12 frame back to RGB"""
+    code = cv2.COLOR_YUV2RGB_I420 if pixel_format == 'i420' else cv2.COLOR_YUV2RGB_NV12
+    return cv2.cvtColor(frame, code)
+
+
+class YuvDecoder:
+    """Decodes compressed frames into planar I420 or NV12 at a fixed output size.
+
+    Output frames are 2-D ``uint8`` arrays of shape ``(height * 3 // 2, width)``,
+    the layout pyvirtualcam expects for ``PixelFormat.I420``/``NV12``.
+    Letterboxing follows ``scaler``, the FrameScaler used for RGB output.
+    """
+
+    def __init__(self, scaler, pixel_format='i420', pool=None):
+        if pixel_format not in PIXEL_FORMATS:
+            raise ValueError(f"Unknown pixel format '{pixel_format}', expected one of {PIXEL_FORMATS}")
+        if scaler.width % 2 or scaler.height % 2:
+            raise ValueError("YUV 4:2:0 output needs an even width and height")
+        self.scaler = scaler
+        self.pixel_format = pixel_format
+        self.width = scaler.width
+        self.height = scaler.height
+        self._turbo = load_turbojpeg()
+        self._pool = pool
+        self.counters = {'turbo': 0, 'turbo_failed': 0, 'fallback': 0}
+        self._lock = threading.Lock()  # decode runs on the pipeline's decode threads
+
+    def decode(self, data):
+        """Decode frame bytes to an I420/NV12 frame, or None if undecodable"""
+        frame = None
+        if self._turbo is not None:
+            try:
+                frame = self._decode_turbo(data)
+            except Exception:
+                # libjpeg-turbo rejects some frames (e.g. truncated) that OpenCV still decodes
+                self._count('turbo_failed')
+        if frame is not None:
+            self._count('turbo')
+            return frame
+
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            return None
+        self._count('fallback')
+        i420 = cv2.cvtColor(self.scaler.scale(img), cv2.COLOR_BGR2YUV_I420)
+        return i420 if self.pixel_format == 'i420' else self._i420_to_nv12(i420)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {
+            'pixel_format': self.pixel_format,
+            'turbojpeg': self._turbo is not None,
+            'yuv_turbo_frames': counters['turbo'],
+            'yuv_turbo_failures': counters['turbo_failed'],
+            'yuv_fallback_frames': counters['fallback'],
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _decode_turbo(self, data):
+        try:
+            width, height, subsample, _ = self._turbo.decode_header(data)
+        except Exception:
+            # Not a JPEG (e.g. WebP); let OpenCV handle it
+            return None
+        if subsample != TJSAMP_420:
+            return None
+
+        if (width, height) == (self.width, self.height) and self.pixel_format == 'i420':
+            # Unpadded 4:2:0 output from libjpeg-turbo is exactly the I420 layout
+            buf, _ = self._turbo.decode_to_yuv(data, pad=1)
+            return np.frombuffer(buf, dtype=np.uint8).reshape(self.height * 3 // 2, self.width)
+
+        # Let libjpeg-turbo do most of a large downscale in the DCT domain
+        target = self.scaler.plan(width, height)
+        factor = reduction_factor(width, height, target.width, target.height)
+        scaling_factor = (1, factor) if factor > 1 else None
+        y, u, v = self._turbo.decode_to_yuv_planes(data, scaling_factor=scaling_factor)
+        shape = (self.height * 3 // 2, self.width)
+        out = self._pool.acquire(shape) if self._pool is not None else np.empty(shape, dtype=np.uint8)
+        try:
+            self._fill(out, y, u, v)
+        except Exception:
+            if self._pool is not None:
+                self._pool.release(out)
+            raise
+        return out
+
+    def _fill(self, out, y, u, v):
+        """Scale decoded planes into an output frame"""
+        height, width = y.shape
+        flat = out.reshape(-1)
+        luma_size = self.width * self.height
+        chroma_w, chroma_h = self.width // 2, self.height // 2
+        out_y = flat[:luma_size].reshape(self.height, self.width)
+
+        plan = self.scaler.plan(width, height)
+        self._fit(y, out_y, plan.x, plan.y, plan.width, plan.height, plan, LUMA_BLACK)
+
+        # Chroma planes follow the luma rectangle at half resolution
+        cx, cy = plan.x // 2, plan.y // 2
+        cw, ch = max(1, plan.width // 2), max(1, plan.height // 2)
+        if self.pixel_format == 'i420':
+            chroma_size = chroma_w * chroma_h
+            out_u = flat[luma_size:luma_size + chroma_size].reshape(chroma_h, chroma_w)
+            out_v = flat[luma_size + chroma_size:].reshape(chroma_h, chroma_w)
+            self._fit(u, out_u, cx, cy, cw, ch, plan, CHROMA_NEUTRAL)
+            self._fit(v, out_v, cx, cy, cw, ch, plan, CHROMA_NEUTRAL)
+        else:
+            out_u = np.empty((chroma_h, chroma_w), dtype=np.uint8)
+            out_v = np.empty((chroma_h, chroma_w), dtype=np.uint8)
+            self._fit(u, out_u, cx, cy, cw, ch, plan, CHROMA_NEUTRAL)
+            self._fit(v, out_v, cx, cy, cw, ch, plan, CHROMA_NEUTRAL)
+            out_uv = flat[luma_size:].reshape(chroma_h, chroma_w, 2)
+            cv2.merge((out_u, out_v), dst=out_uv)
+
+    @staticmethod
+    def _fit(plane, out, x, y, width, height, plan, fill):
+        if plan.letterboxed:
+            out.fill(fill)
+        region = out[y:y + height, x:x + width]
+        if plane.shape == region.shape:
+            np.copyto(region, plane)
+        else:
+            cv2.resize(plane, (width, height), dst=region, interpolation=plan.interpolation)
+
+    def _i420_to_nv12(self, i420):
+        luma_size = self.width * self.height
+        chroma_size = luma_size // 4
+        flat = i420.reshape(-1)
+        nv12 = np.empty_like(i420)
+        nv12_flat = nv12.reshape(-1)
+        nv12_flat[:luma_size] = flat[:luma_size]
+        uv = nv12_flat[luma_size:].reshape(-1, 2)
+        uv[:, 0] = flat[luma_size:luma_size + chroma_size]
+        uv[:, 1] = flat[luma_size + chroma_size:]
+        return nv12
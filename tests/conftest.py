@@ -0,0 +1,6 @@
+"""The server's modules import each other as siblings, the way src/core/main.py runs them"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'core'))
@@ -0,0 +1,42 @@
+from admission import AdmissionControl
+
+
+def test_publisher_limit_is_429():
+    admission = AdmissionControl(per_publisher=1, total=4)
+    assert admission.enter('a') is None
+    rejection = admission.enter('a')
+    assert rejection.status == 429 and rejection.reason == 'publisher_busy'
+    assert admission.enter('b') is None  # Other publishers are unaffected
+
+
+def test_server_limit_is_503():
+    admission = AdmissionControl(per_publisher=2, total=2)
+    assert admission.enter('a') is None
+    assert admission.enter('b') is None
+    assert admission.enter('c').status == 503
+    admission.leave('a')
+    assert admission.enter('c') is None
+
+
+def test_backlog_is_refused_for_as_long_as_it_lasts():
+    admission = AdmissionControl(max_backlog_delay=0.25)
+    rejection = admission.enter('a', backlog_delay=2.5)
+    assert rejection.status == 503 and rejection.reason == 'backlog'
+    assert rejection.headers() == {'Retry-After': '3', 'X-Retry-After-Ms': '2500'}
+    assert admission.stats()['admission_in_flight'] == 0
+
+
+def test_short_retry_delays_round_up_to_a_second():
+    rejection = AdmissionControl(per_publisher=0, retry_after=0.05).enter('a')
+    assert rejection.headers() == {'Retry-After': '1', 'X-Retry-After-Ms': '50'}
+
+
+def test_leave_never_goes_negative():
+    admission = AdmissionControl(per_publisher=1, total=1)
+    admission.leave('a')
+    assert admission.enter('a') is None
+    admission.leave('a')
+    admission.leave('a')
+    stats = admission.stats()
+    assert stats['admission_in_flight'] == 0
+    assert stats['admitted'] == 1
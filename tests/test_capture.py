@@ -0,0 +1,114 @@
+import gzip
+import time
+
+import pytest
+
+import capture
+from capture import CaptureReader, CaptureWriter
+
+
+def write_capture(path, frames):
+    writer = CaptureWriter(str(path))
+    for session, headers, body, arrival in frames:
+        assert writer.write(session, headers, body, arrival)
+    writer.close(timeout=5)
+    return writer
+
+
+def test_frames_read_back_in_order(tmp_path):
+    path = tmp_path / 'a.ipwc'
+    writer = write_capture(path, [('abc', {'transport': 'http'}, b'one', 10.0),
+                                  (None, {'transport': 'ws', 'X-Capture-Time': '9990.5'}, b'two', 10.5)])
+    assert writer.frames == 2 and writer.bytes == path.stat().st_size
+    with CaptureReader(str(path)) as reader:
+        assert len(reader) == 2 and not reader.truncated
+        first, second = reader
+        assert (first.arrival, first.session, first.headers, bytes(first.body)) == (
+            10.0, 'abc', {'transport': 'http'}, b'one')
+        assert (second.session, second.headers['X-Capture-Time'], bytes(second.body)) == (None, '9990.5', b'two')
+        assert reader.duration() == 0.5
+        del first, second
+
+
+def test_truncated_capture_reads_its_complete_frames(tmp_path):
+    path = tmp_path / 'a.ipwc'
+    write_capture(path, [('s', {}, b'x' * 100, 1.0), ('s', {}, b'y' * 100, 2.0)])
+    path.write_bytes(path.read_bytes()[:-10])
+    with CaptureReader(str(path)) as reader:
+        assert len(reader) == 1 and reader.truncated
+
+
+def test_other_versions_are_refused(tmp_path):
+    path = tmp_path / 'a.ipwc'
+    path.write_bytes(capture.FILE_HEADER.pack(capture.MAGIC, capture.VERSION - 1))
+    with pytest.raises(ValueError):
+        CaptureReader(str(path))
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    server = pytest.importorskip('main')
+    writer = CaptureWriter(str(tmp_path / 'server.ipwc'))
+    monkeypatch.setattr(server, 'capture', writer)
+    yield server
+    writer.close(timeout=5)
+
+
+def captured(server):
+    server.capture.close(timeout=5)
+    return CaptureReader(server.capture.path)
+
+
+def test_uploads_are_captured_as_sent(server):
+    body = gzip.compress(b'\xff\xd8' + bytes(1000) + b'\xff\xd9')
+    sent_ms = repr(time.time() * 1000)
+    server.app.test_client().post('/upload', data=body, headers={
+        'Content-Encoding': 'gzip', 'X-Capture-Time': sent_ms, 'X-Session-Id': 'capture-test'})
+    with captured(server) as reader:
+        (frame,) = reader
+        assert bytes(frame.body) == body
+        assert frame.session == 'capture-test'
+        assert frame.headers['Content-Encoding'] == 'gzip'
+        assert frame.headers['X-Capture-Time'] == sent_ms
+        assert frame.headers['transport'] == 'http'
+        del frame
+
+
+def test_rejected_bodies_are_captured_too(server):
+    body = gzip.compress(b'\xff\xd8' + bytes(1000))[:-8]  # Cut short
+    response = server.app.test_client().post('/upload', data=body, headers={'Content-Encoding': 'gzip'})
+    assert response.status_code == 400
+    with captured(server) as reader:
+        assert [bytes(frame.body) for frame in reader] == [body]
+
+
+def test_replay_inflates_and_carries_the_capture_time(tmp_path, monkeypatch):
+    server = pytest.importorskip('main')
+    replay = pytest.importorskip('replay')
+    seen = {}
+
+    def process_frame(img_bytes, session, buffer=None, capture_time=None):
+        seen.update(body=bytes(img_bytes), capture_time=capture_time)
+        server.body_buffers.release(buffer)
+        return '', 204, {}
+
+    monkeypatch.setattr(server, 'process_frame', process_frame)
+    jpeg = b'\xff\xd8' + bytes(1000) + b'\xff\xd9'
+    arrival = time.time() - 3600  # Recorded an hour ago, 40 ms after its capture
+    frames = [('replay-test', {'transport': 'http', 'Content-Encoding': 'gzip',
+                               'X-Capture-Time': repr((arrival - 0.04) * 1000)}, gzip.compress(jpeg), arrival),
+              ('replay-test', {'transport': 'http', 'Content-Encoding': 'gzip'}, b'not gzip', arrival)]
+    write_capture(tmp_path / 'a.ipwc', frames)
+    with CaptureReader(str(tmp_path / 'a.ipwc')) as reader:
+        first, second = reader
+        assert replay.submit(first, clock_offset=3600) == 204
+        assert seen['body'] == jpeg
+        assert seen['capture_time'] == pytest.approx(arrival + 3600 - 0.04, abs=1e-3)
+        assert replay.submit(second, clock_offset=3600) == 400
+        del first, second
+
+
+def test_replay_refuses_a_zero_speed():
+    replay = pytest.importorskip('replay')
+    with pytest.raises(ValueError):
+        replay.replay([], speed=0)
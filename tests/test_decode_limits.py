@@ -0,0 +1,35 @@
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+server = pytest.importorskip('main')
+
+
+def jpeg_header(width, height):
+    """Just enough of a JPEG to declare its dimensions"""
+    return b'\xff\xd8\xff\xc0' + struct.pack('>HBHHB', 17, 8, height, width, 3) + bytes(9) + b'\xff\xd9'
+
+
+def test_declared_dimensions_above_the_limit_are_refused():
+    response = server.app.test_client().post('/upload', data=jpeg_header(65535, 65535))
+    assert response.status_code == 413
+    assert response.get_data() == b'Frame dimensions too large'
+
+
+def test_decode_does_not_plan_or_allocate_for_oversized_headers(monkeypatch):
+    def fail(*args):
+        raise AssertionError('sized something for an oversized frame')
+
+    monkeypatch.setattr(server.scaler, 'plan', fail)
+    monkeypatch.setattr(server.frame_pool, 'acquire', fail)
+    assert server.decode_frame(jpeg_header(65535, 65535)) is None
+
+
+def test_sizes_within_the_limit_are_decodable():
+    assert server.decodable_size(None)
+    assert server.decodable_size((3840, 2160))
+    assert not server.decodable_size((server.MAX_DECODE_PIXELS + 1, 1))
+    jpeg = cv2.imencode('.jpg', np.zeros((48, 64, 3), np.uint8))[1].tobytes()
+    assert server.decode_frame(jpeg) is not None
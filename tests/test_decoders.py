@@ -0,0 +1,98 @@
+import cv2
+import numpy as np
+import pytest
+
+from decoders import (DecodeTimer, DecoderBackend, DecoderSet, OpenCVDecoder, TurboJpegDecoder, frame_size,
+                      reduction_factor, sniff_format)
+
+
+def encode(fmt, width=64, height=48):
+    image = np.zeros((height, width, 3), np.uint8)
+    image[:, :, 1] = 200
+    return cv2.imencode(f'.{fmt}', image)[1].tobytes()
+
+
+class OldTurboJPEG:
+    """PyTurboJPEG 1.x: decode() has no dst parameter"""
+
+    def decode(self, jpeg_buf, pixel_format=0, scaling_factor=None, flags=0):
+        return cv2.imdecode(np.frombuffer(jpeg_buf, np.uint8), cv2.IMREAD_COLOR)
+
+
+def test_frame_size_reads_headers():
+    assert sniff_format(encode('jpg')) == 'jpeg'
+    assert frame_size(encode('jpg')) == (64, 48)
+    assert frame_size(encode('webp')) == (64, 48)
+    assert frame_size(b'not an image') is None
+
+
+def test_reduction_factor_keeps_at_least_the_output_size():
+    assert reduction_factor(3840, 2160, 1280, 720) == 2
+    assert reduction_factor(3840, 2160, 960, 540) == 4
+    assert reduction_factor(1280, 720, 1280, 720) == 1
+    # libjpeg rounds up, so 1283 / 2 still covers 642
+    assert reduction_factor(1283, 720, 642, 360) == 2
+
+
+def test_turbojpeg_without_dst_copies_into_the_buffer():
+    backend = TurboJpegDecoder(OldTurboJPEG(), {'bgr': 0}, decode_into=False)
+    dst = np.empty((48, 64, 3), np.uint8)
+    assert backend.decode(encode('jpg'), dst=dst) is dst
+    assert dst[0, 0, 1] > 150
+
+
+def test_turbojpeg_decodes_into_the_buffer():
+    backend = TurboJpegDecoder.load()
+    if backend is None:
+        pytest.skip('PyTurboJPEG or libjpeg-turbo is not installed')
+    dst = np.empty((48, 64, 3), np.uint8)
+    assert backend.decode(encode('jpg'), dst=dst) is dst
+    assert dst[0, 0, 1] > 150
+
+
+class RejectingDecoder(DecoderBackend):
+    """A fast backend that gives up on every frame"""
+
+    name = 'rejecting'
+    formats = ('jpeg',)
+    layouts = ('bgr',)
+    decode_into = True
+    reduced_formats = ('jpeg',)
+
+    def __init__(self, error=None):
+        self.error = error
+
+    def decode(self, data, layout='bgr', dst=None, scale=1):
+        if self.error is not None:
+            raise self.error
+        return None
+
+
+@pytest.mark.parametrize('error', [None, ValueError('Unsupported JPEG')])
+def test_fallback_decodes_reduced_into_the_callers_buffer(error):
+    decoders = DecoderSet(backends=(OpenCVDecoder,))
+    decoders.backends = {'rejecting': RejectingDecoder(error), **decoders.backends}
+    decoders.selected['jpeg'] = decoders.backends['rejecting']
+    decoders._timers['rejecting'] = DecodeTimer()
+    dst = np.zeros((48, 64, 3), np.uint8)  # Sized for a 1/2 decode of 128x96
+    assert decoders.decode(encode('jpg', 128, 96), dst=dst, scale=2) is dst
+    assert dst[0, 0, 1] > 150
+    assert decoders.stats()['timings']['rejecting']['failures'] == 1
+
+
+def test_fallback_resizes_formats_opencv_cannot_reduce():
+    decoders = DecoderSet(backends=(OpenCVDecoder,))
+    dst = np.zeros((48, 64, 3), np.uint8)
+    data = encode('jpg', 128, 96)
+    assert decoders._fallback('webp', data, 'bgr', dst, 2) is dst
+    assert dst[0, 0, 1] > 150
+    assert decoders._fallback('jpeg', b'\xff\xd8garbage', 'bgr', dst, 2) is None
+
+
+def test_select_adopts_a_selection_made_elsewhere():
+    decoders = DecoderSet(backends=(OpenCVDecoder,))
+    decoders.backends = {'rejecting': RejectingDecoder(), **decoders.backends}
+    decoders.select({'jpeg': 'rejecting', 'webp': 'not-installed'}, {'jpeg': {'rejecting': 0.5}})
+    assert decoders.selected['jpeg'].name == 'rejecting'
+    assert decoders.selected['webp'].name == 'opencv'
+    assert decoders.stats()['benchmark_ms'] == {'jpeg': {'rejecting': 0.5}}
@@ -0,0 +1,98 @@
+import uuid
+
+import numpy as np
+import pytest
+
+import framebus
+from framebus import SEQLOCK, FrameBus, FrameBusReader
+
+
+@pytest.fixture(autouse=True)
+def same_process_tracker(monkeypatch):
+    # Readers here share the writer's resource tracker, like the prefork workers
+    attach = framebus._attach
+    monkeypatch.setattr(framebus, '_attach', lambda name: attach(name, shared_tracker=True))
+
+
+@pytest.fixture
+def bus():
+    bus = FrameBus(f'test_bus_{uuid.uuid4().hex[:8]}', frame_bytes=4 * 4 * 3, slots=4)
+    yield bus
+    bus.close()
+
+
+def frame(value):
+    return np.full((4, 4, 3), value, np.uint8)
+
+
+def test_reader_returns_each_published_frame(bus):
+    with FrameBusReader(bus.name) as reader:
+        assert reader.next_frame(timeout=0) is None
+        bus.publish(frame(1), timestamp=10.0)
+        got = reader.next_frame(timeout=0)
+        assert (got.seq, got.timestamp, got.width, got.height, got.pixel_format) == (1, 10.0, 4, 4, 'bgr')
+        assert (got.image == 1).all()
+        assert reader.next_frame(timeout=0) is None
+
+
+def test_slow_reader_skips_to_the_newest_frame(bus):
+    with FrameBusReader(bus.name) as reader:
+        bus.publish(frame(1))
+        reader.next_frame(timeout=0)
+        for value in (2, 3, 4):
+            bus.publish(frame(value))
+        got = reader.next_frame(timeout=0)
+        assert got.seq == 4 and (got.image == 4).all()
+        assert reader.missed == 2
+
+
+def test_frame_detects_being_overwritten(bus):
+    with FrameBusReader(bus.name) as reader:
+        bus.publish(frame(1))
+        got = reader.next_frame(timeout=0)
+        assert got.valid() and (got.copy() == 1).all()
+        for value in range(2, 2 + bus.slots):  # Laps the ring back onto the slot of frame 1
+            bus.publish(frame(value))
+        assert not got.valid()
+        assert got.copy() is None
+
+
+def test_slot_being_written_is_not_returned(bus):
+    with FrameBusReader(bus.name) as reader:
+        bus.publish(frame(1))
+        offset = bus._offset(1)
+        (lock,) = SEQLOCK.unpack_from(bus.shm.buf, offset)
+        SEQLOCK.pack_into(bus.shm.buf, offset, lock + 1)  # As if the writer were midway through it
+        assert reader._read(1) is None
+        SEQLOCK.pack_into(bus.shm.buf, offset, lock)
+        assert reader._read(1).seq == 1
+
+
+def test_planar_frames_keep_their_dimensions(bus):
+    with FrameBusReader(bus.name) as reader:
+        bus.publish(np.zeros((6, 4), np.uint8), pixel_format='i420')
+        got = reader.next_frame(timeout=0)
+        assert (got.width, got.height, got.image.shape) == (4, 4, (6, 4))
+
+
+def test_closed_bus_ends_the_stream():
+    bus = FrameBus(f'test_bus_{uuid.uuid4().hex[:8]}', frame_bytes=4 * 4 * 3, slots=4)
+    reader = FrameBusReader(bus.name, poll_interval=0.0001)
+    try:
+        bus.publish(frame(1))
+        bus.close()
+        assert reader.next_frame(timeout=0).seq == 1
+        with pytest.raises(EOFError):
+            reader.next_frame(timeout=1)
+    finally:
+        reader.close()
+
+
+def test_attaching_to_something_else_fails():
+    other = FrameBus(f'test_bus_{uuid.uuid4().hex[:8]}', frame_bytes=16, slots=1)
+    try:
+        other.shm.buf[:4] = b'XXXX'
+        with pytest.raises(ValueError):
+            FrameBusReader(other.name)
+    finally:
+        other.close()
@@ -0,0 +1,68 @@
+import threading
+
+import numpy as np
+import pytest
+
+from buffers import FramePool
+from framestore import FrameStore
+
+
+def test_older_frames_are_ignored():
+    store = FrameStore()
+    assert store.publish(b'2', seq=2, timestamp=0)
+    assert not store.publish(b'1', seq=1, timestamp=0)
+    assert store.latest().data == b'2'
+    assert store.latest().index == 1
+
+
+def test_wait_returns_newer_frame_or_times_out():
+    store = FrameStore()
+    assert store.wait(after=0, timeout=0.01) is None
+    threading.Timer(0.02, store.publish, (b'jpeg', 1, 0)).start()
+    assert store.wait(after=0, timeout=2).seq == 1
+
+
+def test_close_wakes_waiters():
+    store = FrameStore()
+    threading.Timer(0.02, store.close).start()
+    with pytest.raises(EOFError):
+        store.wait(after=0, timeout=2)
+
+
+def test_decoded_buffer_is_recycled_only_after_store_and_pipeline_released_it():
+    pool = FramePool()
+    store = FrameStore(pool)
+    first = pool.acquire((4, 4, 3))
+    store.publish(first, seq=1, timestamp=0, decoded=True)
+
+    pool.release(first)  # The output stage is done with it, but the store still holds it
+    assert pool.acquire((4, 4, 3)) is not first
+
+    second = pool.acquire((4, 4, 3))
+    store.publish(second, seq=2, timestamp=0, decoded=True)  # Releases the store's hold on the first
+    assert pool.acquire((4, 4, 3)) is first
+
+
+def test_copy_decoded_only_copies_the_current_frame():
+    pool = FramePool()
+    store = FrameStore(pool)
+    image = np.full((2, 2, 3), 7, np.uint8)
+    store.publish(image, seq=1, timestamp=0, decoded=True)
+    frame = store.latest(decoded=True)
+    copy = store.copy_decoded(frame)
+    assert copy is not image and (copy == 7).all()
+
+    store.publish(np.zeros((2, 2, 3), np.uint8), seq=2, timestamp=0, decoded=True)
+    assert store.copy_decoded(frame) is None
+
+
+def test_close_releases_the_decoded_frame():
+    pool = FramePool()
+    store = FrameStore(pool)
+    image = pool.acquire((4, 4, 3))
+    store.publish(image, seq=1, timestamp=0, decoded=True)
+    pool.release(image)
+    store.close()
+    assert store.latest(decoded=True) is None
+    assert pool.acquire((4, 4, 3)) is image
+    assert not store.publish(image, seq=2, timestamp=0, decoded=True)
@@ -0,0 +1,95 @@
+import gzip
+import io
+import zlib
+
+import pytest
+
+from ingest import CHUNK_SIZE, BodyBufferPool, IngestError, read_body
+
+MAX_SIZE = 1000
+
+
+class EndlessGzip(io.RawIOBase):
+    """A gzip stream of zeros that never ends, counting how many compressed bytes were read"""
+
+    def __init__(self):
+        deflate = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        zeros = bytes(1 << 20)
+        self.pending = deflate.compress(zeros) + deflate.flush(zlib.Z_FULL_FLUSH)
+        # After a full flush the same input compresses to the same bytes, so this repeats forever
+        self.segment = deflate.compress(zeros) + deflate.flush(zlib.Z_FULL_FLUSH)
+        self.consumed = 0
+
+    def readinto(self, b):
+        while len(self.pending) < len(b):
+            self.pending += self.segment
+        n = len(b)
+        b[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        self.consumed += n
+        return n
+
+
+def read(body, encoding=None, content_length=None, max_size=MAX_SIZE):
+    buf = bytearray(max_size + 1)
+    length = read_body(io.BytesIO(body), buf, max_size, content_length, encoding)
+    return bytes(buf[:length])
+
+
+def test_identity_body():
+    assert read(b'frame') == b'frame'
+
+
+@pytest.mark.parametrize('encoding, compress', [
+    ('gzip', gzip.compress),
+    ('x-gzip', gzip.compress),
+    ('deflate', zlib.compress),
+])
+def test_compressed_bodies_are_inflated(encoding, compress):
+    frame = bytes(range(256)) * 3
+    assert read(compress(frame), encoding) == frame
+    assert read(compress(frame), encoding.upper() + ' ') == frame
+
+
+def test_declared_oversize_body_is_refused_unread():
+    with pytest.raises(IngestError) as e:
+        read(b'x', content_length=MAX_SIZE + 1)
+    assert e.value.status == 413
+
+
+def test_oversize_body_is_refused():
+    with pytest.raises(IngestError) as e:
+        read(b'x' * (MAX_SIZE + 1))
+    assert e.value.status == 413
+    assert read(b'x' * MAX_SIZE) == b'x' * MAX_SIZE
+
+
+def test_gzip_bomb_stops_at_the_limit():
+    bomb = EndlessGzip()
+    with pytest.raises(IngestError) as e:
+        read_body(bomb, bytearray(MAX_SIZE + 1), MAX_SIZE, encoding='gzip')
+    assert e.value.status == 413
+    assert bomb.consumed <= CHUNK_SIZE
+
+
+@pytest.mark.parametrize('body', [gzip.compress(b'frame' * 100)[:-12], b'not gzip at all'])
+def test_broken_compressed_bodies_are_bad_requests(body):
+    with pytest.raises(IngestError) as e:
+        read(body, 'gzip')
+    assert e.value.status == 400
+
+
+def test_unknown_encoding_is_unsupported():
+    with pytest.raises(IngestError) as e:
+        read(b'frame', 'br')
+    assert e.value.status == 415
+
+
+def test_body_buffers_are_recycled_up_to_max_free():
+    pool = BodyBufferPool(MAX_SIZE, max_free=1)
+    first, second = pool.acquire(), pool.acquire()
+    assert len(first) == MAX_SIZE + 1
+    pool.release(first)
+    pool.release(second)
+    assert pool.acquire() is first
+    assert pool.stats()['body_buffer_hits'] == 1
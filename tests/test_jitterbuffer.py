@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+
+import pytest
+
+from pipeline import JitterBuffer
+
+
+def job(seq, pts):
+    return SimpleNamespace(seq=seq, presentation_time=pts)
+
+
+def test_frames_play_out_at_presentation_time_plus_offset():
+    buffer = JitterBuffer(max_delay=0.5, capacity=8)
+    first = job(1, 100.0)
+    assert buffer.put(first, now=100.05) == []
+    assert buffer.offset == pytest.approx(0.05)
+    assert buffer.pop(now=100.04) == (None, [])
+    assert buffer.pop(now=100.05) == (first, [])
+    assert len(buffer) == 0
+
+
+def test_pop_hands_out_the_newest_due_frame_and_the_ones_it_overtook():
+    buffer = JitterBuffer(max_delay=0.5, capacity=8)
+    jobs = [job(seq, 100.0 + seq / 30) for seq in range(4)]
+    for j in jobs:
+        buffer.put(j, now=j.presentation_time + 0.05)
+    newest, overtaken = buffer.pop(now=jobs[2].presentation_time + 0.05)
+    assert newest is jobs[2] and overtaken == jobs[:2]
+    assert len(buffer) == 1
+
+
+def test_frames_arriving_out_of_order_play_in_presentation_order():
+    buffer = JitterBuffer(max_delay=0.5, capacity=8)
+    late, early = job(2, 100.1), job(1, 100.0)
+    buffer.put(late, now=100.15)
+    buffer.put(early, now=100.16)
+    assert buffer.pop(now=100.0 + buffer.offset) == (early, [])
+    assert buffer.pop(now=100.1 + buffer.offset) == (late, [])
+
+
+def test_frame_older_than_the_last_played_is_dropped():
+    buffer = JitterBuffer(max_delay=0.5, capacity=8)
+    buffer.put(job(2, 100.1), now=100.1)
+    assert buffer.pop(now=100.2)[0].seq == 2
+    stale = job(1, 100.0)
+    assert buffer.put(stale, now=100.25) == [stale]
+    assert len(buffer) == 0
+
+
+def test_full_buffer_drops_its_oldest_frame():
+    buffer = JitterBuffer(max_delay=0.5, capacity=2)
+    jobs = [job(seq, 100.0 + seq) for seq in range(3)]
+    assert buffer.put(jobs[0], now=100.0) == []
+    assert buffer.put(jobs[1], now=101.0) == []
+    assert buffer.put(jobs[2], now=102.0) == [jobs[0]]
+    assert buffer.dropped == 1 and len(buffer) == 2
+
+
+def test_offset_jumps_up_when_frames_turn_late_and_eases_down():
+    buffer = JitterBuffer(max_delay=1.0, capacity=8)
+    pts = 100.0
+
+    def feed(transit):
+        nonlocal pts
+        pts += 0.033
+        buffer.put(job(0, pts), now=pts + transit)
+        buffer.drain()
+        return buffer.offset
+
+    for _ in range(20):
+        feed(0.02)
+    assert buffer.offset == pytest.approx(0.02)
+    assert feed(0.3) == pytest.approx(0.02)  # One late frame is within the quantile
+    offsets = [feed(0.3) for _ in range(9)]  # The network slows down for a while
+    assert offsets[-1] == pytest.approx(0.3)
+    assert all(offset in (pytest.approx(0.02), pytest.approx(0.3)) for offset in offsets)  # A jump, not a ramp
+
+    offsets = [feed(0.02) for _ in range(400)]
+    # Once the late frames have left the window, it moves back down gradually
+    assert all(b <= a for a, b in zip(offsets, offsets[1:]))
+    assert offsets[0] == pytest.approx(0.3) and offsets[-1] == pytest.approx(0.02, abs=0.005)
+
+
+def test_delay_is_capped_above_the_fastest_frame():
+    buffer = JitterBuffer(max_delay=0.1, capacity=8)
+    pts = 100.0
+    for transit in [0.01] * 5 + [2.0] * 5:
+        pts += 0.033
+        buffer.put(job(0, pts), now=pts + transit)
+        buffer.drain()
+    assert buffer.offset == pytest.approx(0.11)
+    assert buffer.delay() == pytest.approx(0.1)
+
+
+def test_drain_returns_every_buffered_frame():
+    buffer = JitterBuffer(max_delay=0.5, capacity=8)
+    assert buffer.delay() == 0.0
+    jobs = [job(seq, 100.0 + seq / 30) for seq in range(3)]
+    for j in jobs:
+        buffer.put(j, now=100.0)
+    assert buffer.drain() == jobs
+    assert len(buffer) == 0
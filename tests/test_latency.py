@@ -0,0 +1,38 @@
+import math
+import struct
+import time
+
+import pytest
+
+server = pytest.importorskip('main')
+
+
+def test_clock_reports_receive_and_transmit_times():
+    before = time.time() * 1000
+    reply = server.app.test_client().get('/clock')
+    after = time.time() * 1000
+    assert reply.headers['Cache-Control'] == 'no-store'
+    assert before <= reply.json['receive'] <= reply.json['transmit'] <= after
+
+
+@pytest.mark.parametrize('value', [None, '', 'soon', 'nan', math.nan, 'inf'])
+def test_unusable_capture_times_are_ignored(value):
+    assert server.capture_time_from(value) is None
+
+
+def test_capture_times_outside_the_sync_tolerance_are_ignored():
+    now_ms = time.time() * 1000
+    assert server.capture_time_from(repr(now_ms - 40)) == pytest.approx(now_ms / 1000 - 0.04)
+    assert server.capture_time_from(now_ms - (server.MAX_CAPTURE_AGE + 5) * 1000) is None
+    assert server.capture_time_from(now_ms + (server.MAX_CAPTURE_AGE + 5) * 1000) is None
+
+
+def test_timed_websocket_frames_carry_their_capture_time():
+    message = (server.TIMED_FRAME_HEADER.pack(3, 1234.5) + b'abc'
+               + server.TIMED_FRAME_HEADER.pack(2, math.nan) + b'de')
+    frames = [(bytes(frame), capture_ms) for frame, capture_ms in server.split_frames(message, timed=True)]
+    assert frames[0] == (b'abc', 1234.5)
+    assert frames[1][0] == b'de' and math.isnan(frames[1][1])
+    assert [capture_ms for _, capture_ms in server.split_frames(struct.pack('>I', 1) + b'x')] == [None]
+    with pytest.raises(ValueError):
+        list(server.split_frames(server.TIMED_FRAME_HEADER.pack(5, 0.0) + b'ab', timed=True))
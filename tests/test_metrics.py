@@ -0,0 +1,86 @@
+import random
+
+import pytest
+
+from metrics import SUB_BUCKETS, LatencyHistogram, LatencyWindow, MetricsRegistry
+
+
+def test_every_duration_lands_in_a_bucket_that_contains_it():
+    histogram = LatencyHistogram()
+    for units in list(range(200)) + [random.randrange(1, 60_000_000) for _ in range(2000)]:
+        index = histogram._index(units)
+        assert histogram._upper_bound(index - 1) <= units < histogram._upper_bound(index)
+
+
+def test_buckets_are_at_most_one_sub_bucket_wide():
+    histogram = LatencyHistogram()
+    for units in (SUB_BUCKETS, 1000, 123_456, 59_999_999):
+        index = histogram._index(units)
+        width = histogram._upper_bound(index) - histogram._upper_bound(index - 1)
+        assert width / units <= 1 / SUB_BUCKETS
+
+
+def test_percentiles_are_within_bucket_resolution():
+    histogram = LatencyHistogram()
+    for ms in range(1, 101):
+        histogram.observe(ms / 1000)
+    assert histogram.percentile(50) == pytest.approx(0.050, rel=1 / SUB_BUCKETS)
+    assert histogram.percentile(99) == pytest.approx(0.099, rel=1 / SUB_BUCKETS)
+    assert histogram.percentile(100) == pytest.approx(0.1)
+    summary = histogram.summary()
+    assert summary['count'] == 100 and summary['max_ms'] == 100.0
+    assert summary['mean_ms'] == pytest.approx(50.5)
+
+
+def test_out_of_range_durations_are_clamped():
+    histogram = LatencyHistogram(highest=1.0)
+    histogram.observe(-1.0)
+    histogram.observe(3600.0)
+    assert histogram.count == 2
+    assert histogram.max == 3600.0
+    # Percentiles saturate at the highest bucket instead of growing the histogram
+    assert 1.0 <= histogram.percentile(100) < 1.0 * (1 + 1 / SUB_BUCKETS)
+    assert histogram.percentile(50) == histogram.unit
+
+
+def test_cumulative_counts_per_bound():
+    histogram = LatencyHistogram()
+    for seconds in (0.0005, 0.002, 0.002, 0.3):
+        histogram.observe(seconds)
+    assert histogram.cumulative((0.001, 0.01, 1.0)) == [1, 3, 4]
+
+
+def test_registry_renders_prometheus_text():
+    registry = MetricsRegistry('app')
+    registry.observe('decode', 0.004)
+    with registry.time('output'):
+        pass
+    registry.inc('rejected', reason='oversize')
+    registry.inc('rejected', 2, reason='oversize')
+    registry.inc('frames')
+    registry.add_collector(lambda: [('sessions', 'gauge', 'Open sessions', 3)])
+    text = registry.render()
+    assert 'app_stage_seconds_bucket{stage="decode",le="0.005"} 1' in text
+    assert 'app_stage_seconds_bucket{stage="decode",le="+Inf"} 1' in text
+    assert 'app_stage_seconds_count{stage="output"} 1' in text
+    assert 'app_rejected_total{reason="oversize"} 3' in text
+    assert 'app_frames_total 1' in text
+    assert '# TYPE app_sessions gauge\napp_sessions 3' in text
+    assert registry.last('decode') == 0.004 and registry.last('missing') is None
+
+
+def test_latency_window_follows_the_recent_samples():
+    window = LatencyWindow(size=10)
+    assert window.summary() is None
+    for _ in range(10):
+        window.observe(1.0)
+    for ms in range(1, 11):
+        window.observe(ms / 1000)  # Pushes every 1 s sample out
+    assert window.summary() == {'p50_ms': 6.0, 'p95_ms': 10.0}
+
+
+def test_latency_window_clamps_negative_samples():
+    # A capture time slightly in our future, within the clock sync's error
+    window = LatencyWindow()
+    window.observe(-0.002)
+    assert window.summary() == {'p50_ms': 0.0, 'p95_ms': 0.0}
@@ -0,0 +1,106 @@
+import threading
+import time
+
+from pipeline import FrameJob, FramePipeline, LatestRing, OutputStage
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.005)
+
+
+def test_ring_evicts_oldest_when_full():
+    ring = LatestRing(2)
+    assert ring.put(1) is None
+    assert ring.put(2) is None
+    assert ring.put(3) == 1
+    assert ring.dropped == 1
+    assert [ring.get(timeout=0), ring.get(timeout=0), ring.get(timeout=0)] == [2, 3, None]
+
+
+def test_ring_supersedes_same_key_before_evicting():
+    ring = LatestRing(2, key=lambda item: item[0])
+    ring.put(('a', 1))
+    ring.put(('b', 1))
+    assert ring.put(('a', 2)) == ('a', 1)
+    assert ring.superseded == 1 and ring.dropped == 0
+    # The replacement queues behind the other publisher's frame
+    assert ring.get(timeout=0) == ('b', 1)
+    assert ring.get(timeout=0) == ('a', 2)
+
+
+def test_ring_get_wakes_on_close():
+    ring = LatestRing(1)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(ring.get()))
+    thread.start()
+    ring.close()
+    thread.join(1)
+    assert result == [None]
+
+
+def test_frames_are_decoded_output_and_released_once():
+    sent, released, released_input = [], [], []
+    pipeline = FramePipeline(lambda data: ['image', data], fps=200,
+                             release=lambda image: released.append(image[1]),
+                             release_input=released_input.append)
+    pipeline.add_output('phone', lambda job, repeat: sent.append((job.image[1], repeat)))
+    pipeline.start()
+    try:
+        for n in range(3):
+            pipeline.submit(n, buffer=f"buffer{n}", publisher='phone')
+            wait_for(lambda: any(data == n for data, _ in sent))
+        wait_for(lambda: any(repeat for _, repeat in sent))
+    finally:
+        pipeline.stop()
+    assert [data for data, repeat in sent if not repeat] == [0, 1, 2]
+    assert sorted(released) == [0, 1, 2]
+    assert sorted(released_input) == ['buffer0', 'buffer1', 'buffer2']
+    stats = pipeline.stats()
+    assert stats['decoded'] == 3 and stats['output'] == 3 and stats['repeated'] >= 1
+
+
+def test_frames_of_unknown_publishers_are_released():
+    released = []
+    pipeline = FramePipeline(lambda data: data, release=released.append)
+    pipeline.start()
+    try:
+        pipeline.submit('frame', publisher='gone')
+        wait_for(lambda: pipeline.stats()['unrouted'] == 1)
+    finally:
+        pipeline.stop()
+    assert released == ['frame']
+
+
+def test_failed_decodes_are_counted_not_output():
+    sent = []
+    pipeline = FramePipeline(lambda data: None, output=lambda job, repeat: sent.append(job))
+    pipeline.start()
+    try:
+        pipeline.submit(b'garbage')
+        wait_for(lambda: pipeline.stats()['decode_failed'] == 1)
+    finally:
+        pipeline.stop()
+    assert sent == []
+
+
+def test_jitter_buffered_frames_arriving_out_of_order_are_all_output():
+    sent, released = [], []
+    stage = OutputStage('phone', lambda job, repeat: repeat or sent.append(job.seq), fps=100, low_latency=False,
+                        release=released.append, observe=lambda name, value: None, jitter_buffer=0.5)
+    now = time.time()
+    # Arrival order is sequence order; the second and third frames swapped on the way
+    for seq, capture_time in ((1, now - 0.1), (2, now + 0.1), (3, now + 0.05), (4, now + 0.15)):
+        job = FrameJob(seq, b'', capture_time=capture_time)
+        job.image = seq
+        stage.deliver(job)
+    stage.start()
+    try:
+        wait_for(lambda: len(sent) == 4)
+    finally:
+        stage.stop()
+    assert sent == [1, 3, 2, 4]
+    assert stage.stats()['stale'] == 0 and stage.stats()['late'] == 0
+    assert sorted(released) == [1, 2, 3, 4]
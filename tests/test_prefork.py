@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+import prefork
+from prefork import SEQLOCK, SharedFrameSlots
+
+
+@pytest.fixture
+def slots():
+    slots = SharedFrameSlots(2, frame_bytes=4 * 4 * 3)
+    yield slots
+    slots.close()
+
+
+def frame(value):
+    return np.full((4, 4, 3), value, np.uint8)
+
+
+def test_read_returns_the_newest_frame_once(slots):
+    assert slots.read(0) is None
+    slots.write(0, frame(1), timestamp=5.0, capture_time=4.5)
+    seq, timestamp, image, capture_time = slots.read(0)
+    assert (seq, timestamp, capture_time) == (1, 5.0, 4.5)
+    assert (image == 1).all()
+    assert slots.read(0, after=seq) is None
+
+
+def test_slots_are_independent(slots):
+    slots.write(0, frame(1))
+    slots.write(1, frame(2))
+    slots.write(1, frame(3))
+    assert slots.latest(0) == 1 and slots.latest(1) == 2
+    assert (slots.read(1)[2] == 3).all()
+
+
+def test_read_copies_out_of_shared_memory(slots):
+    slots.write(0, frame(1))
+    image = slots.read(0)[2]
+    slots.write(0, frame(2))
+    slots.write(0, frame(3))  # Reuses the buffer frame 1 was read from
+    assert (image == 1).all()
+
+
+def test_unknown_capture_time_and_planar_frames(slots):
+    slots.write(0, np.zeros((6, 4), np.uint8))
+    _, _, image, capture_time = slots.read(0)
+    assert image.shape == (6, 4) and capture_time is None
+
+
+def test_read_lands_in_acquired_buffer(slots):
+    slots.write(0, frame(7))
+    out = np.empty((4, 4, 3), np.uint8)
+    assert slots.read(0, acquire=lambda shape: out)[2] is out
+    assert (out == 7).all()
+
+
+def test_torn_buffer_is_not_returned(slots):
+    slots.write(0, frame(1))
+    offset = slots._buffer_offset(0, 1)
+    (lock,) = SEQLOCK.unpack_from(slots.shm.buf, offset)
+    SEQLOCK.pack_into(slots.shm.buf, offset, lock + 1)  # As if a worker were midway through writing it
+    assert slots.read(0) is None
+    assert slots.torn == prefork.READ_ATTEMPTS
+
+
+def test_writer_lapping_a_copy_is_detected(slots):
+    slots.write(0, frame(1))
+
+    def acquire(shape):
+        # The worker publishes twice while the dispatcher copies, landing on the same buffer again
+        if slots.latest(0) == 1:
+            slots.write(0, frame(2))
+            slots.write(0, frame(3))
+        return np.empty(shape, np.uint8)
+
+    seq, _, image, _ = slots.read(0, acquire=acquire)
+    assert slots.torn == 1
+    assert seq == 3 and (image == 3).all()
+
+
+def test_oversize_frame_is_refused(slots):
+    with pytest.raises(ValueError):
+        slots.write(0, np.zeros((8, 8, 3), np.uint8))
+
+
+def test_attached_view_sees_the_owner_frames(slots):
+    # Attaching in this process shares the owner's resource tracker, like a spawned worker
+    worker = SharedFrameSlots(2, slots.frame_bytes, name=slots.name)
+    try:
+        worker.write(1, frame(9))
+        assert (slots.read(1)[2] == 9).all()
+    finally:
+        worker.close()
@@ -0,0 +1,52 @@
+from pipeline import FramePipeline
+from ratecontrol import RateController, format_recommendation
+
+
+def stream(controller, seconds, fps=None, size=40_000, dropped=lambda t: 0, decode_time=0.005):
+    """Feed evenly spaced arrivals at ``fps``, or at whatever rate is recommended"""
+    now = 0.0
+    while now < seconds:
+        controller.on_frame(size, now, dropped=dropped(now), decode_time=decode_time)
+        now += 1.0 / (fps or controller.recommendation()['fps'])
+
+
+def test_clean_windows_raise_quality_then_fps():
+    controller = RateController(max_fps=30, quality=0.7, window=0.25)
+    stream(controller, 10)
+    recommendation = controller.recommendation()
+    assert recommendation['quality'] == 0.9
+    assert recommendation['fps'] == 30
+    assert controller.counters['increase'] > 0
+
+
+def test_late_arrivals_cut_quality_first():
+    controller = RateController(max_fps=30, quality=0.7, window=0.25)
+    stream(controller, 2, fps=8)  # Asked for 20 FPS, only 8 arrive
+    assert controller.state in ('congested', 'hold')
+    assert controller.recommendation()['quality'] < 0.7
+    assert controller.counters['overloaded'] == 0
+
+
+def test_own_drops_cut_frame_rate():
+    controller = RateController(max_fps=30, quality=0.7, window=0.25)
+    stream(controller, 2, fps=20, dropped=lambda t: int(t * 10))
+    assert controller.counters['overloaded'] > 0
+    assert controller.recommendation()['fps'] < 20
+    assert controller.recommendation()['quality'] == 0.7
+
+
+def test_recommendation_header():
+    assert format_recommendation({'quality': 0.7, 'fps': 20, 'scale': 1.0}) == 'quality=0.7, fps=20, scale=1.0'
+
+
+def test_drops_are_charged_to_the_publisher_that_lost_the_frame():
+    pipeline = FramePipeline(lambda data: data, queue_size=2)  # Not started: nothing is decoded
+    pipeline.add_output('busy', lambda job, repeat: None)
+    pipeline.add_output('quiet', lambda job, repeat: None)
+    pipeline.submit(b'1', publisher='quiet')
+    pipeline.submit(b'1', publisher='busy')
+    pipeline.submit(b'2', publisher='busy')  # Replaces its own waiting frame
+    pipeline.submit(b'3', publisher='busy')
+    assert pipeline.publisher_load('busy') == (2, None)
+    assert pipeline.publisher_load('quiet') == (0, None)
+    assert pipeline.publisher_load('unknown') == (0, None)
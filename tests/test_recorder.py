@@ -0,0 +1,209 @@
+import struct
+
+import pytest
+
+import recorder
+from recorder import MatroskaWriter, Recorder, _size, _void
+
+
+def read_id(data, pos):
+    length = 8 - data[pos].bit_length() + 1
+    return int.from_bytes(data[pos:pos + length], 'big'), pos + length
+
+
+def read_size(data, pos):
+    length = 8 - data[pos].bit_length() + 1
+    value = int.from_bytes(data[pos:pos + length], 'big') & ((1 << (7 * length)) - 1)
+    return value, pos + length
+
+
+def elements(data, start=0, end=None):
+    """(id, payload) of the elements in data[start:end]"""
+    pos, end = start, len(data) if end is None else end
+    while pos < end:
+        element_id, pos = read_id(data, pos)
+        size, pos = read_size(data, pos)
+        yield element_id, data[pos:pos + size]
+        pos += size
+
+
+def children(payload):
+    return list(elements(payload))
+
+
+def child(payload, element_id):
+    return next(value for key, value in elements(payload) if key == element_id)
+
+
+@pytest.mark.parametrize('n, encoded', [
+    (0, b'\x80'), (126, b'\xfe'), (127, b'\x40\x7f'), (16382, b'\x7f\xfe'), (16383, b'\x20\x3f\xff'),
+])
+def test_size_uses_the_shortest_width_avoiding_all_ones(n, encoded):
+    assert _size(n) == encoded
+    assert read_size(encoded, 0) == (n, len(encoded))
+
+
+def test_size_can_be_forced_to_a_width():
+    assert _size(5, 8) == b'\x01' + bytes(6) + b'\x05'
+
+
+def test_void_fills_exactly():
+    void = _void(96)
+    assert len(void) == 96
+    ((element_id, payload),) = children(void)
+    assert element_id == recorder.VOID and len(payload) == 96 - 9
+
+
+def write_file(path, timestamps, close=True):
+    writer = MatroskaWriter(str(path), 640, 480)
+    frames = [b'\xff\xd8' + bytes([i]) * (i + 1) + b'\xff\xd9' for i in range(len(timestamps))]
+    for data, timestamp in zip(frames, timestamps):
+        writer.add(data, timestamp)
+    if close:
+        writer.close()
+    else:
+        writer.flush()
+        writer._file.flush()
+    return path.read_bytes(), frames
+
+
+def blocks(segment):
+    """(timestamp in ms, frame) of every SimpleBlock, in file order"""
+    for element_id, cluster in children(segment):
+        if element_id != recorder.CLUSTER:
+            continue
+        start = int.from_bytes(child(cluster, recorder.CLUSTER_TIMESTAMP), 'big')
+        for key, block in children(cluster):
+            if key == recorder.SIMPLE_BLOCK:
+                assert block[0] == 0x81 and block[3] == 0x80  # Track 1, keyframe
+                yield start + struct.unpack('>h', block[1:3])[0], block[4:]
+
+
+def test_closed_file_is_a_complete_segment(tmp_path):
+    data, frames = write_file(tmp_path / 'a.mkv', [100.0, 100.04, 100.08])
+    (ebml, header), (segment_id, segment) = children(data)
+    assert ebml == recorder.EBML and segment_id == recorder.SEGMENT
+    assert child(header, 0x4282) == b'matroska'
+    assert len(data) == data.index(segment) + len(segment)  # Segment size was patched in
+
+    ids = [element_id for element_id, _ in children(segment)]
+    assert ids == [recorder.SEEK_HEAD, recorder.VOID, recorder.INFO, recorder.TRACKS, recorder.CLUSTER,
+                   recorder.CUES]
+    assert list(blocks(segment)) == [(0, frames[0]), (40, frames[1]), (80, frames[2])]
+
+    info = child(segment, recorder.INFO)
+    assert int.from_bytes(child(info, recorder.TIMESTAMP_SCALE), 'big') == 1000000
+    assert struct.unpack('>d', child(info, recorder.DURATION))[0] == 80.0
+    video = child(child(child(segment, recorder.TRACKS), recorder.TRACK_ENTRY), recorder.VIDEO)
+    assert int.from_bytes(child(video, recorder.PIXEL_WIDTH), 'big') == 640
+    assert int.from_bytes(child(video, recorder.PIXEL_HEIGHT), 'big') == 480
+
+
+def test_seek_head_points_at_its_elements(tmp_path):
+    data, _ = write_file(tmp_path / 'a.mkv', [0.0, 0.5])
+    _, (_, segment) = children(data)
+    base = data.index(segment)
+    for _, seek in children(child(segment, recorder.SEEK_HEAD)):
+        target = int.from_bytes(child(seek, recorder.SEEK_ID), 'big')
+        position = int.from_bytes(child(seek, recorder.SEEK_POSITION), 'big')
+        assert read_id(data, base + position)[0] == target
+
+
+def test_clusters_split_by_duration_and_are_indexed(tmp_path):
+    data, frames = write_file(tmp_path / 'a.mkv', [10.0, 10.5, 11.0, 11.5, 12.2])
+    _, (_, segment) = children(data)
+    base = data.index(segment)
+    clusters = [payload for element_id, payload in children(segment) if element_id == recorder.CLUSTER]
+    assert [int.from_bytes(child(c, recorder.CLUSTER_TIMESTAMP), 'big') for c in clusters] == [0, 1000, 2200]
+    assert [frame for _, frame in blocks(segment)] == frames
+
+    cues = []
+    for _, point in children(child(segment, recorder.CUES)):
+        positions = child(point, recorder.CUE_TRACK_POSITIONS)
+        cues.append((int.from_bytes(child(point, recorder.CUE_TIME), 'big'),
+                     int.from_bytes(child(positions, recorder.CUE_CLUSTER_POSITION), 'big')))
+    assert [time for time, _ in cues] == [0, 1000, 2200]
+    for _, position in cues:
+        assert read_id(data, base + position)[0] == recorder.CLUSTER
+
+
+def test_timestamps_never_go_backwards(tmp_path):
+    data, _ = write_file(tmp_path / 'a.mkv', [5.0, 5.1, 5.05, 5.2])
+    _, (_, segment) = children(data)
+    assert [ms for ms, _ in blocks(segment)] == [0, 100, 100, 200]
+
+
+def _ebml_header(data):
+    _, pos = read_id(data, 0)
+    size, pos = read_size(data, pos)
+    return data[:pos + size]
+
+
+def test_unfinished_file_reads_up_to_its_last_cluster(tmp_path):
+    data, frames = write_file(tmp_path / 'a.mkv', [1.0, 1.04], close=False)
+    _, segment_at = read_id(data, len(_ebml_header(data)))
+    assert data[segment_at:segment_at + 8] == recorder.UNKNOWN_SIZE
+    segment = data[segment_at + 8:]
+    assert [frame for _, frame in blocks(segment)] == frames
+
+
+def test_recorder_writes_queued_frames_before_stopping(tmp_path):
+    rec = Recorder(str(tmp_path), 'cam')
+    for i in range(5):
+        assert rec.write(b'\xff\xd8' + bytes(10) + b'\xff\xd9', timestamp=1000.0 + i / 30)
+    rec.close()
+    rec.join(5)
+    assert rec.frames == 5 and rec.dropped == 0 and len(rec.files) == 1
+    _, (_, segment) = children(open(rec.files[0], 'rb').read())
+    assert len(list(blocks(segment))) == 5
+
+
+def test_recorder_rotates_files_by_duration(tmp_path):
+    rec = Recorder(str(tmp_path), 'cam', segment_seconds=1)
+    for i in range(4):
+        rec.write(b'\xff\xd8\xff\xd9', timestamp=1000.0 + i * 0.6)
+    rec.close()
+    rec.join(5)
+    assert len(rec.files) == 2
+    assert rec.files[0] != rec.files[1]
+
+
+def sized_jpeg(width, height):
+    # SOI and a baseline frame header are all jpeg_size reads
+    return b'\xff\xd8\xff\xc0\x00\x11\x08' + struct.pack('>HH', height, width) + bytes(10) + b'\xff\xd9'
+
+
+def test_recorder_starts_a_new_file_when_the_dimensions_change(tmp_path):
+    rec = Recorder(str(tmp_path), 'cam')
+    for i, (width, height) in enumerate([(640, 480), (640, 480), (1280, 720)]):
+        rec.write(sized_jpeg(width, height), timestamp=1000.0 + i / 30)
+    rec.close()
+    rec.join(5)
+    assert len(rec.files) == 2
+    sizes = []
+    for path in rec.files:
+        _, (_, segment) = children(open(path, 'rb').read())
+        video = child(child(child(segment, recorder.TRACKS), recorder.TRACK_ENTRY), recorder.VIDEO)
+        sizes.append((int.from_bytes(child(video, recorder.PIXEL_WIDTH), 'big'),
+                      int.from_bytes(child(video, recorder.PIXEL_HEIGHT), 'big')))
+    assert sizes == [(640, 480), (1280, 720)]
+
+
+def test_recorder_closes_the_file_when_writing_fails(tmp_path, monkeypatch):
+    writers = []
+
+    class FailingWriter(MatroskaWriter):
+        def __init__(self, *args):
+            super().__init__(*args)
+            writers.append(self)
+
+        def add(self, data, timestamp):
+            raise OSError('No space left on device')
+
+    monkeypatch.setattr(recorder, 'MatroskaWriter', FailingWriter)
+    rec = Recorder(str(tmp_path), 'cam')
+    rec.write(b'\xff\xd8\xff\xd9', timestamp=1000.0)
+    rec.close()
+    rec.join(5)
+    assert rec.failed and rec.stats()['file'] is None
+    assert len(writers) == 1 and writers[0]._file.closed
@@ -0,0 +1,62 @@
+import threading
+
+from framestore import FrameStore
+from restream import BOUNDARY, Broadcaster
+
+
+def test_unsent_response_holds_no_viewer_slot():
+    broadcaster = Broadcaster(FrameStore(), max_viewers=1)
+    for _ in range(3):
+        assert broadcaster.stream() is not None
+    assert broadcaster.viewers == 0
+
+
+def test_viewer_slot_is_held_while_streaming():
+    store = FrameStore()
+    broadcaster = Broadcaster(store, max_viewers=1)
+    body = broadcaster.stream()
+    assert next(body) == b''
+    assert broadcaster.viewers == 1
+    assert broadcaster.stream() is None
+    assert broadcaster.refused == 1
+    body.close()
+    assert broadcaster.viewers == 0
+    assert broadcaster.stream() is not None
+
+
+def test_body_ends_when_slots_were_taken_meanwhile():
+    broadcaster = Broadcaster(FrameStore(), max_viewers=1)
+    first, second = broadcaster.stream(), broadcaster.stream()
+    next(first)
+    assert list(second) == []
+    assert broadcaster.viewers == 1 and broadcaster.refused == 1
+    first.close()
+
+
+def test_viewer_gets_the_newest_frame_as_a_part():
+    store = FrameStore()
+    broadcaster = Broadcaster(store)
+    body = broadcaster.stream()
+    next(body)
+    store.publish(b'\xff\xd8one', seq=1, timestamp=0.0)
+    assert next(body).startswith(f'--{BOUNDARY}'.encode()) and next(body) == b'\xff\xd8one'
+    next(body)
+    store.publish(b'\xff\xd8two', seq=2, timestamp=0.0)
+    store.publish(b'\xff\xd8new', seq=3, timestamp=0.0)  # The viewer was busy; it skips "two"
+    header = next(body)
+    assert header.startswith(f'--{BOUNDARY}\r\n'.encode())
+    assert b'Content-Length: 5\r\n' in header
+    assert next(body) == b'\xff\xd8new'
+    assert next(body) == b'\r\n'
+    assert broadcaster.sent == 2 and broadcaster.skipped == 1
+    body.close()
+
+
+def test_body_ends_when_the_store_closes():
+    store = FrameStore()
+    broadcaster = Broadcaster(store)
+    body = broadcaster.stream()
+    next(body)
+    threading.Timer(0.05, store.close).start()
+    assert list(body) == []
+    assert broadcaster.viewers == 0
@@ -0,0 +1,30 @@
+import numpy as np
+
+import scaling
+from scaling import FrameScaler
+
+
+def test_plan_cache_keeps_only_the_recent_sizes():
+    scaler = FrameScaler(1280, 720)
+    kept = scaler.plan(1920, 1080)
+    for width in range(100, 100 + 4 * scaling.MAX_PLANS):
+        scaler.plan(width, 480)
+        scaler.plan(1920, 1080)  # Used all along, so never the least recent
+    assert scaler.stats()['cached_plans'] == scaling.MAX_PLANS
+    assert scaler.plan(1920, 1080) is kept
+    assert (100, 480) not in scaler._plans
+
+
+def test_letterboxed_frame_is_centred():
+    scaler = FrameScaler(160, 90)
+    out = scaler.scale(np.full((100, 100, 3), 255, np.uint8))
+    plan = scaler.plan(100, 100)
+    assert (plan.width, plan.height, plan.y) == (90, 90, 0)
+    assert (out[:, :plan.x] == 0).all() and (out[:, plan.x + plan.width:] == 0).all()
+    assert (out[:, plan.x:plan.x + plan.width] == 255).all()
+
+
+def test_stretched_frame_fills_the_output():
+    scaler = FrameScaler(160, 90, letterbox=False)
+    out = scaler.scale(np.full((100, 100, 3), 255, np.uint8))
+    assert out.shape == (90, 160, 3) and (out == 255).all()
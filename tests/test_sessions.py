@@ -0,0 +1,78 @@
+import pytest
+
+from sessions import SessionRegistry
+
+
+def registry(**kwargs):
+    opened, closed = [], []
+    sessions = SessionRegistry(lambda: None, on_open=opened.append, on_close=closed.append, **kwargs)
+    return sessions, opened, closed
+
+
+def test_open_reuses_known_ids_and_generates_missing_ones():
+    sessions, opened, _ = registry()
+    first = sessions.open('phone-1', now=0)
+    assert sessions.open('phone-1', now=1) is first
+    generated = sessions.open(now=1)
+    assert generated.id != 'phone-1' and generated.slot == 1
+    assert opened == [first, generated]
+
+
+@pytest.mark.parametrize('session_id', ['', 'has space', 'x' * 65, 'ok\n', '../etc', 'ünïcode'])
+def test_malformed_ids_never_open_a_session(session_id):
+    sessions, opened, _ = registry(max_sessions=1)
+    with pytest.raises(ValueError):
+        sessions.open(session_id)
+    assert len(sessions) == 0 and opened == []
+
+
+def test_full_registry_refuses_new_sessions():
+    sessions, _, _ = registry(max_sessions=2)
+    sessions.open('a', now=0)
+    sessions.open('b', now=0)
+    assert sessions.open('c', now=0) is None
+    assert sessions.stats()['sessions_refused'] == 1
+    assert sessions.open('a', now=0) is not None  # Known sessions still get through
+
+
+def test_idle_sessions_expire_and_free_their_slot():
+    sessions, _, closed = registry(max_sessions=2, idle_timeout=30)
+    a = sessions.open('a', now=0)
+    b = sessions.open('b', now=0)
+    b.touch(now=20)
+    sessions.expire(now=31)
+    assert closed == [a]
+    assert sessions.get('a') is None and sessions.get('b') is b
+    assert sessions.open('c', now=31).slot == a.slot
+    assert sessions.stats()['sessions_expired'] == 1
+
+
+def test_sessions_never_expire_without_idle_timeout():
+    sessions, _, closed = registry(idle_timeout=None)
+    sessions.open('a', now=0)
+    sessions.expire(now=1e9)
+    assert closed == [] and len(sessions) == 1
+
+
+def test_forced_slot_must_be_free():
+    sessions, _, _ = registry(max_sessions=4)
+    assert sessions.open('a', slot=2, now=0).slot == 2
+    assert sessions.open('b', slot=2, now=0) is None
+
+
+def test_server_rejects_malformed_session_ids():
+    server = pytest.importorskip('main')
+    client = server.app.test_client()
+    before = len(server.sessions)
+    for session_id in ('x' * 65, 'not/valid', 'a b'):
+        response = client.post('/upload', data=b'\xff\xd8', headers={'X-Session-Id': session_id})
+        assert response.status_code == 400
+    assert len(server.sessions) == before
+
+
+def test_standalone_server_rejects_malformed_session_ids():
+    standalone = pytest.importorskip('standalone')
+    client = standalone.app.test_client()
+    response = client.post('/upload', data=b'\xff\xd8', headers={'X-Session-Id': 'x' * 65})
+    assert response.status_code == 400
+    assert not any(len(session_id) > 64 for session_id in standalone.sessions)
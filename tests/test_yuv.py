@@ -0,0 +1,58 @@
+import cv2
+import numpy as np
+import pytest
+
+from scaling import FrameScaler
+from yuv import TJSAMP_420, YuvDecoder, yuv_to_rgb
+
+
+def encode(width=64, height=48):
+    image = np.zeros((height, width, 3), np.uint8)
+    image[:, :, 1] = 200
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+class BrokenTurboJPEG:
+    """Reads the header but fails on the decode itself, as libjpeg-turbo does on some corrupt frames"""
+
+    def __init__(self, planes=None):
+        self.planes = planes
+
+    def decode_header(self, jpeg_buf):
+        return 128, 96, TJSAMP_420, 0
+
+    def decode_to_yuv_planes(self, jpeg_buf, scaling_factor=None):
+        if self.planes is None:
+            raise OSError('Premature end of JPEG file')
+        return self.planes
+
+
+class RecordingPool:
+    def __init__(self):
+        self.released = []
+
+    def acquire(self, shape, dtype=np.uint8):
+        return np.empty(shape, dtype)
+
+    def release(self, buf):
+        self.released.append(buf)
+
+
+@pytest.mark.parametrize('pixel_format', ['i420', 'nv12'])
+def test_turbo_failure_falls_back_to_opencv(pixel_format):
+    decoder = YuvDecoder(FrameScaler(64, 48), pixel_format)
+    decoder._turbo = BrokenTurboJPEG()
+    frame = decoder.decode(encode())
+    assert frame.shape == (72, 64)
+    assert yuv_to_rgb(frame, pixel_format)[24, 32, 1] > 150
+    stats = decoder.stats()
+    assert (stats['yuv_turbo_frames'], stats['yuv_turbo_failures'], stats['yuv_fallback_frames']) == (0, 1, 1)
+
+
+def test_buffer_is_released_when_filling_it_fails():
+    pool = RecordingPool()
+    decoder = YuvDecoder(FrameScaler(64, 48), pool=pool)
+    # A luma plane without rows can't be scaled into the frame
+    decoder._turbo = BrokenTurboJPEG(planes=(np.zeros(8, np.uint8),) * 3)
+    assert decoder.decode(encode()).shape == (72, 64)
+    assert len(pool.released) == 1 and pool.released[0].shape == (72, 64)